@@ -0,0 +1,199 @@
+"""
+Cliente de la API HTTP del chatbot SOP
+Misma interfaz que SOPEngine para que la UI pueda ser un cliente ligero (sin el motor ni sus dependencias)
+"""
+
+import base64
+import io
+import json
+import threading
+import time
+
+import requests
+
+from friendly_errors import friendly_error
+from query_router import QUERY_ROUTING_ENABLED, Route, context_key, route_query
+
+DEFAULT_TIMEOUT = 60
+
+# /health se consulta en cada rerun (modelo, índice, versión de temas): se reutiliza unos segundos
+HEALTH_TTL_SECONDS = 30
+# Las métricas de la barra lateral también (cambian con cada consulta: TTL corto)
+METRICS_TTL_SECONDS = 5
+
+
+class RemoteEngine:
+    """Equivalente remoto de SOPEngine (generate_response, stream_response, analyze_image)"""
+
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._health = None
+        self._health_at = 0.0
+        self._previews = None
+        self._metrics = None
+        self._metrics_at = 0.0
+
+    def _url(self, path):
+        return f"{self.base_url}{path}"
+
+    @staticmethod
+    def _history(chat_history):
+        return [{"role": m["role"], "content": m["content"]} for m in chat_history]
+
+    def health(self, max_age=HEALTH_TTL_SECONDS):
+        """Estado del servidor; reutiliza la última respuesta si tiene menos de max_age segundos"""
+        if self._health is not None and time.monotonic() - self._health_at < max_age:
+            return self._health
+        response = self.session.get(self._url("/health"), timeout=self.timeout)
+        response.raise_for_status()
+        self._health = response.json()
+        self._health_at = time.monotonic()
+        return self._health
+
+    @property
+    def model_name(self):
+        return self.health()["model"]
+
+    @property
+    def index_path(self):
+        """Ruta del índice en el servidor (solo como identificador de versión)"""
+        return self.health()["index"]
+
+    @property
+    def guided_topics_version(self):
+        return self.health()["topics_version"]
+
+    def metrics_snapshot(self, max_age=METRICS_TTL_SECONDS):
+        """Métricas del servidor (GET /metrics.json del worker que responde)"""
+        if self._metrics is not None and time.monotonic() - self._metrics_at < max_age:
+            return self._metrics
+        response = self.session.get(self._url("/metrics.json"), timeout=self.timeout)
+        response.raise_for_status()
+        self._metrics = response.json()
+        self._metrics_at = time.monotonic()
+        return self._metrics
+
+    def page_previews(self):
+        """Vistas previas del índice activo del servidor (misma interfaz que page_previews.PagePreviews)"""
+        index = self.index_path
+        if self._previews is None or self._previews.index != index:
+            self._previews = RemotePagePreviews(self, index)
+        return self._previews
+
+    def _chat_payload(self, user_query, chat_history, context_cache):
+        """Cuerpo de /chat y /chat/stream + función que guarda el contexto que devuelva el servidor
+
+        El servidor no guarda conversaciones: el contexto ya recuperado (session_store.ContextCache)
+        viaja con la consulta y lo nuevo vuelve para guardarse aquí. La ruta se calcula igual que
+        en SOPEngine.route para elegir la misma entrada
+        """
+        payload = {"query": user_query, "history": self._history(chat_history)}
+        if context_cache is None:
+            return payload, lambda context: None
+        if QUERY_ROUTING_ENABLED:
+            route = route_query(user_query, chat_history)
+        else:
+            route = Route("rag", user_query, search_query=user_query, question=user_query)
+        if not route.needs_search:
+            return payload, lambda context: None
+        index = self.index_path
+        cached = context_cache.for_route(route, index)
+        if cached is not None:
+            payload["context"] = [{"text": text, "metadata": metadata} for text, metadata in cached]
+            return payload, lambda context: None
+        payload["return_context"] = True
+
+        def store(context):
+            if context:
+                context_cache.put(context_key(route), index, [(d["text"], d["metadata"]) for d in context])
+
+        return payload, store
+
+    def generate_response(self, user_query, chat_history=(), raise_errors=False, context_cache=None, warmup=False):
+        """Regresa (respuesta, páginas de la guía usadas); context_cache y warmup como en SOPEngine"""
+        try:
+            payload, store_context = self._chat_payload(user_query, chat_history, context_cache)
+            response = self.session.post(
+                self._url("/chat"),
+                json={**payload, "raise_errors": raise_errors, "warmup": warmup},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            if raise_errors:
+                raise
+            return friendly_error(e), []
+        data = response.json()
+        store_context(data.get("context"))
+        return data["answer"], data["pages"]
+
+    def stream_response(self, user_query, chat_history=(), context_cache=None):
+        """Eventos NDJSON de /chat/stream"""
+        payload, store_context = self._chat_payload(user_query, chat_history, context_cache)
+        with self.session.post(
+            self._url("/chat/stream"),
+            json=payload,
+            timeout=self.timeout,
+            stream=True,
+        ) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line:
+                    event = json.loads(line)
+                    if event["type"] == "done":
+                        store_context(event.pop("context", None))
+                    yield event
+
+    def analyze_image(self, image, kind="general"):
+        buffer = io.BytesIO()
+        image.save(buffer, format=image.format or "PNG")
+        try:
+            response = self.session.post(
+                self._url("/image"),
+                files={"file": ("imagen", buffer.getvalue())},
+                data={"kind": kind},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            return f"❌ Error: {str(e)}"
+        return response.json()["analysis"]
+
+
+class RemotePagePreviews:
+    """get/thumbnail de PagePreviews servidos por GET /previews/{página}; cada página se pide una vez"""
+
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+        self._lock = threading.Lock()
+        self._pages = {}
+
+    def _fetch(self, page):
+        with self._lock:
+            if page in self._pages:
+                return self._pages[page]
+        try:
+            response = self.engine.session.get(self.engine._url(f"/previews/{page}"), timeout=self.engine.timeout)
+            if response.status_code == 404:
+                data = None
+            else:
+                response.raise_for_status()
+                data = response.json()
+                if data["thumbnail"]:
+                    data["thumbnail"] = base64.b64decode(data["thumbnail"])
+        except requests.RequestException:
+            # Sin vista previa la UI muestra solo el número de página; se reintenta en otro rerun
+            return None
+        with self._lock:
+            self._pages[page] = data
+        return data
+
+    def get(self, page):
+        return self._fetch(page)
+
+    def thumbnail(self, page):
+        data = self._fetch(page)
+        return data["thumbnail"] if data else None
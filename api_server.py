@@ -0,0 +1,247 @@
+"""
+API HTTP del chatbot SOP
+Expone el motor (chat, chat en streaming, imágenes, salud y métricas) sin la UI
+
+Uso:
+    uvicorn api_server:app --host 0.0.0.0 --port 8000 --workers 4
+    python api_server.py --workers 4
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+
+import google.generativeai as genai
+import pandas as pd
+import PIL.Image
+from dotenv import load_dotenv
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from gemini_pool import load_api_keys
+from metrics import METRICS
+from risk_model import RiskScorer
+from friendly_errors import friendly_error
+from sop_engine import IMAGE_ANALYSES, SOPEngine, build_pooled_models, load_index_manager
+
+load_dotenv()
+
+app = FastAPI(title="API Chatbot SOP", version="1.0")
+
+# Un motor por proceso worker (se crea en el arranque, no por petición)
+_engine = None
+_risk_scorer = None
+
+
+def get_engine():
+    if _engine is None:
+        raise HTTPException(status_code=503, detail="Motor no inicializado")
+    return _engine
+
+
+def get_risk_scorer():
+    if _risk_scorer is None:
+        raise HTTPException(status_code=503, detail="Modelo de riesgo no exportado")
+    return _risk_scorer
+
+
+@app.on_event("startup")
+def startup():
+    global _engine, _risk_scorer
+    api_keys = load_api_keys()
+    if not api_keys:
+        raise RuntimeError("Falta GOOGLE_API_KEY (o GOOGLE_API_KEYS) en .env")
+    # La primera clave queda como global (context caching); el pool reparte entre todas
+    genai.configure(api_key=api_keys[0])
+    model, vision_models = build_pooled_models(api_keys)
+    _engine = SOPEngine(load_index_manager(), model, vision_models=vision_models)
+    try:
+        _risk_scorer = RiskScorer.load()
+    except FileNotFoundError:
+        _risk_scorer = None
+
+
+# ==========================================
+# ESQUEMAS
+# ==========================================
+
+class ChatMessage(BaseModel):
+    role: str
+    content: str
+
+
+class ContextDoc(BaseModel):
+    text: str
+    metadata: dict = {}
+
+
+class ChatRequest(BaseModel):
+    query: str = Field(..., min_length=1)
+    history: list[ChatMessage] = []
+    raise_errors: bool = False
+    # Contexto que el cliente ya tenía guardado para esta consulta (se usa sin volver a buscar)
+    context: list[ContextDoc] | None = None
+    # Devolver el contexto recuperado para que el cliente lo guarde en su conversación
+    return_context: bool = False
+    # Precálculo de temas guiados (no cuenta como consulta en chat_total)
+    warmup: bool = False
+
+
+class ChatResponse(BaseModel):
+    answer: str
+    pages: list[int]
+    context: list[ContextDoc] | None = None
+
+
+class RiskRequest(BaseModel):
+    features: dict[str, float]
+
+
+def _history(request):
+    return [{"role": m.role, "content": m.content} for m in request.history]
+
+
+class RequestContext:
+    """ContextCache de una sola petición (el servidor no guarda conversaciones)
+
+    Entrega el contexto que mandó el cliente y anota lo que se recupere para devolvérselo
+    """
+
+    def __init__(self, docs=None):
+        self.docs = [(d.text, d.metadata) for d in docs] if docs else None
+        self.retrieved = None
+
+    @classmethod
+    def from_request(cls, request):
+        if request.context is None and not request.return_context:
+            return None
+        return cls(request.context)
+
+    def for_route(self, route, index):
+        return self.docs
+
+    def put(self, key, index, docs):
+        self.retrieved = [{"text": d.page_content, "metadata": dict(d.metadata)} for d in docs]
+
+
+# ==========================================
+# ENDPOINTS
+# ==========================================
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest):
+    context = RequestContext.from_request(request)
+    try:
+        answer, pages = await get_engine().agenerate_response(
+            request.query, _history(request), raise_errors=request.raise_errors, context_cache=context,
+            warmup=request.warmup,
+        )
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=friendly_error(e))
+    retrieved = context.retrieved if context is not None and request.return_context else None
+    return ChatResponse(answer=answer, pages=pages, context=retrieved)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """NDJSON: una línea por evento {"type": "chunk"|"done", ...}
+
+    Con return_context, el evento done trae también el contexto recuperado
+    """
+    context = RequestContext.from_request(request)
+    events = get_engine().astream_response(request.query, _history(request), context_cache=context)
+
+    async def lines():
+        async for event in events:
+            if event["type"] == "done" and request.return_context and context.retrieved:
+                event = {**event, "context": context.retrieved}
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.post("/image")
+async def analyze_image(file: UploadFile = File(...), kind: str = Form("general")):
+    if kind not in IMAGE_ANALYSES:
+        raise HTTPException(status_code=422, detail=f"Tipo inválido: {kind}")
+    try:
+        image = PIL.Image.open(io.BytesIO(await file.read()))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error al abrir imagen: {str(e)}")
+    return {"kind": kind, "analysis": await get_engine().aanalyze_image(image, kind)}
+
+
+@app.post("/risk")
+def risk(request: RiskRequest):
+    """Puntuación educativa de un formulario (RISK_FEATURES; las faltantes se rellenan con la media)"""
+    with METRICS.stage("risk_score"):
+        return get_risk_scorer().score(request.features)
+
+
+@app.post("/risk/batch")
+async def risk_batch(file: UploadFile = File(...)):
+    """CSV con las columnas del modelo -> CSV con las probabilidades añadidas"""
+    scorer = get_risk_scorer()
+    try:
+        df = pd.read_csv(io.BytesIO(await file.read()))
+        with METRICS.stage("risk_score_batch"):
+            scores = scorer.score_batch(df)
+    except (ValueError, pd.errors.ParserError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    df["prob_logistica"] = scores["logistic"]
+    df["prob_random_forest"] = scores["forest"]
+    return PlainTextResponse(df.to_csv(index=False), media_type="text/csv")
+
+
+@app.get("/health")
+def health():
+    engine = get_engine()
+    return {
+        "status": "ok",
+        "model": engine.model_name,
+        "index": engine.index_path,
+        # El cliente ligero versiona sus temas guiados con esto (no ve el índice)
+        "topics_version": engine.guided_topics_version,
+        "pid": os.getpid(),
+        "gemini_keys": engine.gemini_key_stats(),
+    }
+
+
+@app.get("/previews/{page}")
+def page_preview(page: int):
+    """Sección, fragmento y miniatura (JPEG en base64) de una página citada (0-based)"""
+    previews = get_engine().page_previews()
+    info = previews.get(page) if previews is not None else None
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Sin vista previa de la página {page}")
+    thumbnail = previews.thumbnail(page)
+    return {
+        "section": info["section"],
+        "snippet": info["snippet"],
+        "thumbnail": base64.b64encode(thumbnail).decode("ascii") if thumbnail else None,
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Formato de texto de Prometheus (métricas de este worker)"""
+    return METRICS.to_prometheus()
+
+
+@app.get("/metrics.json")
+def metrics_json():
+    return METRICS.snapshot()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="API HTTP del chatbot SOP")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    uvicorn.run("api_server:app", host=args.host, port=args.port, workers=args.workers)
@@ -0,0 +1,356 @@
+"""
+Benchmark offline del chatbot
+Recuperación real + Gemini falso (sin gastar cuota)
+
+Uso:
+    python benchmark.py --mode all --requests 200 --concurrency 8
+    python benchmark.py --mode concurrency --requests 400 --concurrency 64
+    python benchmark.py --compare bench_results/anterior.json bench_results/nuevo.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from embedding_batcher import EMBED_BATCH_WINDOW_MS
+from gemini_stub import FakeCachedContent, FakeGenerativeModel
+from metrics import METRICS
+
+RESULTS_DIR = "./bench_results"
+
+# Consultas fijas para que las corridas sean comparables entre versiones
+BENCHMARK_QUERIES = [
+    "¿Qué es el SOP?",
+    "¿Cómo se diagnostica el síndrome de ovario poliquístico?",
+    "¿Cuáles son los criterios de Rotterdam?",
+    "¿Qué tratamientos existen para el SOP?",
+    "¿Puedo embarazarme si tengo SOP?",
+    "¿Qué dieta se recomienda para el SOP?",
+    "¿Cuánto ejercicio debo hacer?",
+    "¿El SOP aumenta el riesgo de diabetes?",
+    "¿Qué relación hay entre el SOP y la depresión?",
+    "¿Para qué sirve la metformina en el SOP?",
+    "¿Qué es la hormona antimülleriana?",
+    "¿Cómo afecta el SOP a la piel y el acné?",
+    "¿Qué es el hirsutismo?",
+    "¿Los anticonceptivos ayudan con el SOP?",
+    "¿Qué es el letrozol y cuándo se usa?",
+    "¿El SOP afecta el embarazo?",
+    "¿Cómo se mide la resistencia a la insulina?",
+    "¿Qué significa tener ciclos irregulares?",
+    "¿Las adolescentes pueden tener SOP?",
+    "¿El SOP tiene cura?",
+]
+
+
+# ==========================================
+# MEDICIÓN
+# ==========================================
+
+def _latency_summary(latencies):
+    ordered = sorted(latencies)
+
+    def pct(q):
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000
+
+    return {
+        "mean": statistics.fmean(ordered) * 1000,
+        "p50": pct(0.50),
+        "p95": pct(0.95),
+        "p99": pct(0.99),
+        "max": ordered[-1] * 1000,
+    }
+
+
+def prefix_cache_report(min_tokens):
+    """Tokens estimados de cada prefijo fijo de producción y cuántos llegan al mínimo del caché"""
+    from prompt_templates import estimate_tokens
+    from sop_engine import CHAT_TEMPLATE, IMAGE_PROMPTS
+
+    prefixes = {"sop-chat": CHAT_TEMPLATE.static_prefix}
+    prefixes.update((f"sop-vision-{kind}", prompt) for kind, prompt in IMAGE_PROMPTS.items())
+    tokens = {name: estimate_tokens(prefix) for name, prefix in prefixes.items()}
+    return {
+        "min_tokens": min_tokens,
+        "prefixes": tokens,
+        "cacheable": sum(1 for t in tokens.values() if t >= min_tokens),
+    }
+
+
+def run_load(fn, n_requests, concurrency):
+    """Ejecuta fn(consulta) n veces con `concurrency` hilos"""
+    queries = [BENCHMARK_QUERIES[i % len(BENCHMARK_QUERIES)] for i in range(n_requests)]
+
+    def one(query):
+        start = time.perf_counter()
+        try:
+            fn(query)
+            ok = True
+        except Exception:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    tracemalloc.start()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, queries))
+    wall = time.perf_counter() - wall_start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies = [latency for latency, _ in outcomes]
+    errors = sum(1 for _, ok in outcomes if not ok)
+
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_s": wall,
+        "throughput_rps": n_requests / wall,
+        "latency_ms": _latency_summary(latencies),
+        "memory": {
+            "tracemalloc_peak_mb": peak / 2**20,
+            # ru_maxrss está en KB en Linux
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+    }
+
+
+async def _run_async(coro_fn, queries, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(query):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await coro_fn(query)
+                ok = True
+            except Exception:
+                ok = False
+            return time.perf_counter() - start, ok
+
+    return await asyncio.gather(*(one(q) for q in queries))
+
+
+def run_load_async(coro_fn, n_requests, concurrency):
+    """Igual que run_load, pero con asyncio y `concurrency` peticiones en vuelo"""
+    queries = [BENCHMARK_QUERIES[i % len(BENCHMARK_QUERIES)] for i in range(n_requests)]
+
+    tracemalloc.start()
+    wall_start = time.perf_counter()
+    outcomes = asyncio.run(_run_async(coro_fn, queries, concurrency))
+    wall = time.perf_counter() - wall_start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies = [latency for latency, _ in outcomes]
+    errors = sum(1 for _, ok in outcomes if not ok)
+
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "wall_s": wall,
+        "throughput_rps": n_requests / wall,
+        "latency_ms": _latency_summary(latencies),
+        "memory": {
+            "tracemalloc_peak_mb": peak / 2**20,
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+    }
+
+
+def _git_version():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconocida"
+
+
+# ==========================================
+# COMPARACIÓN
+# ==========================================
+
+def compare(old_path, new_path):
+    """Imprime la diferencia porcentual entre dos corridas"""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+
+    print(f"📊 {old['version']} → {new['version']}")
+    for mode in sorted(set(old["results"]) & set(new["results"])):
+        a, b = old["results"][mode], new["results"][mode]
+        print(f"\n[{mode}]")
+        rows = [("throughput_rps", a["throughput_rps"], b["throughput_rps"])]
+        rows += [(f"latency_{k}_ms", a["latency_ms"][k], b["latency_ms"][k]) for k in ("p50", "p95", "p99")]
+        rows += [("tracemalloc_peak_mb", a["memory"]["tracemalloc_peak_mb"], b["memory"]["tracemalloc_peak_mb"])]
+        for name, before, after in rows:
+            delta = (after - before) / before * 100 if before else 0.0
+            print(f"  {name:<22} {before:>10.2f} → {after:>10.2f}  ({delta:+.1f}%)")
+
+
+# ==========================================
+# MAIN
+# ==========================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark offline del chatbot SOP")
+    parser.add_argument("--mode", choices=["retrieval", "pipeline", "concurrency", "all"], default="all")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--sync-threads", type=int, default=None,
+                        help="Hilos del servidor síncrono en --mode concurrency (por defecto = --concurrency)")
+    parser.add_argument("--latency", type=float, default=0.8, help="Latencia media del Gemini falso (s)")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--error-429", type=float, default=0.0, help="Fracción de llamadas con 429")
+    parser.add_argument("--error-safety", type=float, default=0.0, help="Fracción bloqueada por seguridad")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--prefill-ms-per-1k", type=float, default=0.0,
+                        help="Latencia extra del Gemini falso por 1000 tokens de entrada no cacheados")
+    parser.add_argument("--prompt-cache", choices=["off", "local", "cached"], default="off",
+                        help="Prefijo fijo: en el prompt (off), como system instruction (local) o cacheado")
+    parser.add_argument("--keys", type=int, default=1,
+                        help="Claves falsas en el pool de Gemini (gemini_pool.py)")
+    parser.add_argument("--rpm-per-key", type=int, default=None,
+                        help="Cuota por clave del Gemini falso (429 al pasarla)")
+    parser.add_argument("--quota-window", type=float, default=60.0,
+                        help="Ventana de la cuota en segundos (acortar para corridas rápidas)")
+    parser.add_argument("--embed-window-ms", type=float, default=EMBED_BATCH_WINDOW_MS,
+                        help="Ventana de micro-batching de embeddings (0 = desactivado)")
+    parser.add_argument("--output", default=None, help="Ruta del JSON de resultados")
+    parser.add_argument("--compare", nargs=2, metavar=("ANTERIOR", "NUEVO"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    from sop_engine import SOPEngine, load_vectorstore
+
+    print("📚 Cargando vectorstore...")
+    vectorstore = load_vectorstore(batch_window_ms=args.embed_window_ms)
+    fake_models = [
+        FakeGenerativeModel(
+            latency=args.latency,
+            jitter=args.jitter,
+            rate_limit_rate=args.error_429,
+            safety_rate=args.error_safety,
+            seed=args.seed + i,
+            prefill_per_1k=args.prefill_ms_per_1k / 1000,
+            rpm_limit=args.rpm_per_key,
+            quota_window=args.quota_window,
+        )
+        for i in range(max(args.keys, 1))
+    ]
+    models = fake_models
+    prompt_cache_report = None
+    if args.prompt_cache != "off":
+        from prompt_cache import PROMPT_CACHE_MIN_TOKENS, PrefixCachedModel
+        from sop_engine import CHAT_TEMPLATE
+
+        # Mismo mínimo que Gemini (1024 tokens): un prefijo más corto se mide como "fallback"
+        cache_factory = (lambda p, ttl: FakeCachedContent(p, ttl)) if args.prompt_cache == "cached" else None
+        models = [
+            PrefixCachedModel(CHAT_TEMPLATE.static_prefix, fake.with_prefix, cache_factory, name="sop-chat")
+            for fake in fake_models
+        ]
+        prompt_cache_report = prefix_cache_report(PROMPT_CACHE_MIN_TOKENS)
+    model = models[0]
+    pool = None
+    if args.keys > 1:
+        from gemini_pool import GeminiPool, PooledModel
+
+        labels = [f"key{i + 1}" for i in range(args.keys)]
+        pool = GeminiPool(labels, rpm=args.rpm_per_key or 10**9, window_seconds=args.quota_window)
+        model = PooledModel(pool, dict(zip(labels, models)))
+    engine = SOPEngine(vectorstore, model)
+
+    # Calentamiento: carga perezosa del modelo de embeddings
+    engine.search_context(BENCHMARK_QUERIES[0])
+
+    results = {}
+    if args.mode in ("retrieval", "all"):
+        print("🔍 Recuperación (search_context)...")
+        results["retrieval"] = run_load(
+            lambda q: engine.search_context(q, k=4), args.requests, args.concurrency
+        )
+    if args.mode in ("pipeline", "all"):
+        print("🤖 Pipeline completo (generate_response + Gemini falso)...")
+        results["pipeline"] = run_load(
+            # raise_errors para contar los 429/seguridad inyectados
+            lambda q: engine.generate_response(q, raise_errors=True), args.requests, args.concurrency
+        )
+    if args.mode == "concurrency":
+        # Mismas peticiones en vuelo: hilos bloqueados en Gemini vs corutinas
+        threads = args.sync_threads or args.concurrency
+        print(f"🧵 Síncrono ({threads} hilos)...")
+        results["sync"] = run_load(
+            lambda q: engine.generate_response(q, raise_errors=True), args.requests, threads
+        )
+        print(f"⚡ Async ({args.concurrency} en vuelo)...")
+        results["async"] = run_load_async(
+            lambda q: engine.agenerate_response(q, raise_errors=True), args.requests, args.concurrency
+        )
+
+    report = {
+        "version": _git_version(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": vars(args),
+        "results": results,
+    }
+    # Llamadas a Gemini con respuesta (las fallidas no reportan uso)
+    calls = sum(r["requests"] - r["errors"] for mode, r in results.items() if mode != "retrieval") or 1
+    report["tokens_per_call"] = {
+        "prompt": METRICS.counter("gemini_prompt_tokens_total", call="chat") / calls,
+        "cached": METRICS.counter("gemini_cached_tokens_total", call="chat") / calls,
+    }
+    if prompt_cache_report is not None:
+        report["prompt_cache"] = prompt_cache_report
+    if pool is not None:
+        report["gemini_keys"] = pool.stats()
+    if hasattr(vectorstore.embeddings, "stats"):
+        report["embedding_batches"] = vectorstore.embeddings.stats()
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{report['version']}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for mode, r in results.items():
+        lat = r["latency_ms"]
+        print(f"\n[{mode}] {r['throughput_rps']:.1f} req/s · p50 {lat['p50']:.1f} ms · "
+              f"p95 {lat['p95']:.1f} ms · p99 {lat['p99']:.1f} ms · "
+              f"pico {r['memory']['tracemalloc_peak_mb']:.1f} MB · errores {r['errors']}")
+    tokens = report["tokens_per_call"]
+    if tokens["prompt"]:
+        print(f"\n🔤 Tokens de entrada por llamada: {tokens['prompt']:.0f} "
+              f"({tokens['cached']:.0f} desde caché)")
+    if prompt_cache_report is not None:
+        cache = prompt_cache_report
+        print(f"\n🗄️ Prefijos cacheables: {cache['cacheable']}/{len(cache['prefixes'])} "
+              f"(mínimo {cache['min_tokens']} tokens): "
+              + ", ".join(f"{name} ~{tokens}" for name, tokens in cache["prefixes"].items()))
+    if "embedding_batches" in report:
+        b = report["embedding_batches"]
+        print(f"\n🧮 Embeddings: {b['queries']} consultas en {b['batches']} lotes "
+              f"(media {b['mean_batch']:.1f}, máx {b['max_batch']})")
+    for key in report.get("gemini_keys", []):
+        print(f"🔑 {key['key']}: {key['requests']} llamadas · errores recientes {key['error_rate']:.0%}")
+    if "sync" in results and "async" in results:
+        speedup = results["async"]["throughput_rps"] / results["sync"]["throughput_rps"]
+        print(f"\n⚡ Async vs síncrono: {speedup:.2f}x throughput")
+    print(f"\n✅ Resultados en {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark del motor de riesgo: latencia de un formulario y throughput por lotes
+
+Uso:
+    python benchmark_risk.py
+    python benchmark_risk.py --single 20000 --batch-sizes 1000 10000 100000 --sklearn
+"""
+
+import argparse
+import statistics
+import time
+
+import numpy as np
+
+from pcos_data import load_pcos
+from risk_model import FEATURE_SPECS, RISK_FEATURES, RiskScorer
+
+
+def random_rows(n, seed=0):
+    """Filas sintéticas dentro de los rangos del formulario"""
+    rng = np.random.default_rng(seed)
+    columns = []
+    for name in RISK_FEATURES:
+        spec = FEATURE_SPECS[name]
+        if spec["kind"] == "flag":
+            columns.append(rng.integers(0, 2, n))
+        elif spec["kind"] == "cycle":
+            columns.append(rng.choice([2, 4], n))
+        else:
+            columns.append(rng.uniform(spec["min"], spec["max"], n))
+    return np.column_stack(columns).astype(np.float64)
+
+
+def bench_single(scorer, n):
+    form = {name: spec["default"] for name, spec in FEATURE_SPECS.items()}
+    for _ in range(100):
+        scorer.score(form)
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        scorer.score(form)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        "p50_us": latencies[len(latencies) // 2] * 1e6,
+        "p99_us": latencies[int(0.99 * len(latencies))] * 1e6,
+        "mean_us": statistics.fmean(latencies) * 1e6,
+    }
+
+
+def bench_batch(score_fn, X, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        score_fn(X)
+        best = min(best, time.perf_counter() - start)
+    return {"seconds": best, "rows_per_s": X.shape[0] / best}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del motor de riesgo de SOP")
+    parser.add_argument("--version", type=int, default=None)
+    parser.add_argument("--single", type=int, default=5000)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1000, 10000, 100000])
+    parser.add_argument("--sklearn", action="store_true", help="Compara con los modelos de sklearn reentrenados")
+    args = parser.parse_args()
+
+    scorer = RiskScorer.load(args.version)
+    print(f"🩺 Modelo de riesgo v{scorer.version}")
+
+    single = bench_single(scorer, args.single)
+    print(f"\n[formulario] p50 {single['p50_us']:.0f} µs · p99 {single['p99_us']:.0f} µs · "
+          f"media {single['mean_us']:.0f} µs")
+
+    reference = None
+    if args.sklearn:
+        from export_risk_model import train
+
+        lr, forest, _, _ = train(load_pcos())
+        reference = lambda X: (lr.predict_proba(X)[:, 1], forest.predict_proba(X)[:, 1])
+        row = random_rows(1)
+        start = time.perf_counter()
+        for _ in range(200):
+            reference(row)
+        print(f"[formulario sklearn] media {(time.perf_counter() - start) / 200 * 1e6:.0f} µs")
+
+    print()
+    for size in args.batch_sizes:
+        X = random_rows(size)
+        numpy_result = bench_batch(scorer.score_batch, X)
+        line = f"[lote {size:>7}] NumPy {numpy_result['rows_per_s']:>12,.0f} filas/s"
+        if reference is not None:
+            sk_result = bench_batch(reference, X)
+            line += (f" · sklearn {sk_result['rows_per_s']:>12,.0f} filas/s "
+                     f"({numpy_result['rows_per_s'] / sk_result['rows_per_s']:.1f}x)")
+        print(line)
+
+    # Dataset real desde la caché columnar (sin parsear el CSV)
+    start = time.perf_counter()
+    data = load_pcos()
+    X = data.matrix(scorer.features)
+    load_ms = (time.perf_counter() - start) * 1000
+    dataset_result = bench_batch(scorer.score_batch, X)
+    print(f"[dataset {data.rows:>5}] carga {load_ms:.1f} ms · NumPy {dataset_result['rows_per_s']:>12,.0f} filas/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,22 @@ Con Hugging Face embeddings + Gemini + Análisis de Imágenes
 """
 
 import streamlit as st
-import google.generativeai as genai
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
 import os
 from dotenv import load_dotenv
 import time
 import PIL.Image
+import pandas as pd
 from datetime import datetime
+from session_store import ChatHistory, ContextCache, ImageHistory, new_session_id, purge_expired, session_exists
+from guided_topics import QUICK_QUESTIONS, GuidedTopicsCache
+from conversation_export import EXPORT_FORMATS, export_data
+from metrics import METRICS, merge_snapshots, snapshot_counter, snapshot_summary, snapshot_to_json, snapshot_to_prometheus
+from friendly_errors import friendly_error
+from page_previews import pages_label
+from profiling import ProfileSession, profile_calls, profile_request, read_profile_file
+from gemini_pool import load_api_keys
+from api_client import RemoteEngine
+from risk_model import FEATURE_SPECS, RiskScorer
 
 load_dotenv()
 
@@ -20,6 +28,24 @@ st.set_page_config(
     page_icon="💜",
     layout="wide"
 )
+
+# ==========================================
+# PERFILADO A DEMANDA (SOLO ADMIN)
+# ==========================================
+
+# ?profile=<SOP_ADMIN_TOKEN>[&profile_scope=chat][&profile_mode=sample]; sin él no se perfila nada
+PROFILE = profile_request(st.query_params)
+
+# Un rerun cortado por st.stop()/st.rerun() no llega al final del script: su perfil quedó congelado
+# al salir el script de la pila (watch_file) y se guarda aquí, sin la espera hasta este rerun
+if 'rerun_profile' in st.session_state:
+    st.session_state.setdefault('profiles', []).insert(0, st.session_state.pop('rerun_profile').finish())
+
+if PROFILE is not None:
+    st.session_state.setdefault('profiles', [])
+    if PROFILE["scope"] == "rerun":
+        st.session_state.rerun_profile = ProfileSession("rerun", PROFILE["mode"], watch_file=__file__).start()
+
 # ==========================================
 # CSS PERSONALIZADO PARA TABS
 # ==========================================
@@ -109,46 +135,29 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # ==========================================
-# CONFIGURACIÓN API
+# MOTOR: API REMOTA O LOCAL
 # ==========================================
 
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-
-if not GOOGLE_API_KEY:
-    st.error("❌ Falta GOOGLE_API_KEY en .env")
-    st.stop()
-
-genai.configure(api_key=GOOGLE_API_KEY)
+# Con SOP_API_URL la UI es un cliente ligero de api_server.py
+SOP_API_URL = os.getenv("SOP_API_URL")
 
-# ==========================================
-# MODELO GEMINI
-# ==========================================
-
-model = genai.GenerativeModel(
-    'gemini-2.5-flash-lite',
-    generation_config={
-        "temperature": 0.3,
-        "top_p": 0.8,
-        "top_k": 40,
-        "max_output_tokens": 2048,
-    },
-    safety_settings={
-        'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
-        'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
-        'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_LOW_AND_ABOVE',
-        'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_MEDIUM_AND_ABOVE',
-    }
-)
-
-# ==========================================
-# CARGAR VECTORSTORE (RÁPIDO)
-# ==========================================
+@st.cache_resource
+def load_remote_engine(base_url):
+    """Cliente HTTP compartido por todas las sesiones"""
+    return RemoteEngine(base_url)
 
 @st.cache_resource
-def load_vectorstore():
-    """Carga vectorstore con Hugging Face embeddings"""
-    
-    if not os.path.exists("./chroma_db_sop"):
+def load_engine(api_keys):
+    """Modelo Gemini (una o varias claves) + índice versionado, una vez por proceso (el índice cambia en caliente)"""
+    # Solo en modo local: el cliente ligero no importa el motor (embeddings, Chroma, Gemini)
+    import google.generativeai as genai
+    from sop_engine import SOPEngine, build_pooled_models, load_index_manager
+    
+    # La primera clave queda como global (context caching); el pool reparte entre todas
+    genai.configure(api_key=api_keys[0])
+    try:
+        vectorstore = load_index_manager()
+    except FileNotFoundError:
         st.error("""
         ❌ Base de datos no encontrada.
         
@@ -156,327 +165,93 @@ def load_vectorstore():
         """)
         st.stop()
     
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-        model_kwargs={'device': 'cpu'},
-        encode_kwargs={'normalize_embeddings': True}
+    model, vision_models = build_pooled_models(list(api_keys))
+    return SOPEngine(
+        vectorstore,
+        model,
+        on_search_error=lambda e: st.error(f"Error búsqueda: {str(e)}"),
+        vision_models=vision_models,
     )
+
+if SOP_API_URL:
+    engine = load_remote_engine(SOP_API_URL)
+else:
+    # GOOGLE_API_KEYS="clave1,clave2" reparte la carga entre varias claves
+    API_KEYS = tuple(load_api_keys())
     
-    vectorstore = Chroma(
-        persist_directory="./chroma_db_sop",
-        collection_name="sop_medical_guide",
-        embedding_function=embeddings
-    )
+    if not API_KEYS:
+        st.error("❌ Falta GOOGLE_API_KEY en .env")
+        st.stop()
     
-    return vectorstore
-
-with st.spinner("📚 Cargando base de conocimiento..."):
-    vectorstore = load_vectorstore()
-
-# ==========================================
-# SYSTEM PROMPT
-# ==========================================
-
-SYSTEM_PROMPT = """Eres Sofía, una amiga comprensiva y educada que ayuda a entender el SOP.
-
-🌸TU PERSONALIDAD:
-- Hablas como una amiga cercana, NO como un documento médico
-- Usas ejemplos de la vida real y analogías simples
-- Eres cálida, empática y validadora de emociones
-- Explicas con lenguaje cotidiano, luego mencionas términos médicos
-- Usas emojis para conectar emocionalmente 💜
-
-📚 TU CONOCIMIENTO viene del CONTEXTO (guía ESHRE 2023):
-{context}
-
-💬 CÓMO RESPONDER:
+    with st.spinner("📚 Cargando base de conocimiento..."):
+        engine = load_engine(API_KEYS)
 
-**PRIMERO - Valida la emoción:**
-Si detectas preocupación/ansiedad/frustración → reconócela antes de dar info
-Ejemplo: "Entiendo que esto te preocupa 💜, es totalmente normal sentirse así"
+generate_response = engine.generate_response
 
-**SEGUNDO - Explica en lenguaje simple:**
-- Usa analogías del día a día
-- Evita jerga médica al inicio
-- Si usas términos médicos, explícalos inmediatamente
-
-**TERCERO - Da contexto práctico:**
-- "Esto significa que en tu día a día..."
-- "Por ejemplo, muchas mujeres notan que..."
-- "Imagina que tu cuerpo es como..."
-
-**CUARTO - Información de la guía:**
-- Conecta la info médica con situaciones reales
-- Menciona "según la guía internacional" de forma natural
-- No cites constantemente, solo cuando sea relevante
-
-🚨 LO QUE NUNCA HACES:
-- ❌ Contestar a preguntas fuera del SOP
-- ❌ Diagnosticar ("tienes" o "no tienes" SOP)
-- ❌ Dar dosis de medicamentos
-- ❌ Sonar como un robot médico
-- ❌ Usar lenguaje técnico sin explicarlo primero
-
-✅ EJEMPLOS DE BUEN ESTILO:
-
-Pregunta: "¿Tengo SOP si estoy gorda?"
-❌ MAL: "La guía ESHRE indica que existe asociación entre IMC elevado y SOP"
-✅ BIEN: "Te entiendo, es una duda súper común 💜. Mira, tener sobrepeso NO significa automáticamente que tengas SOP. Piensa en el SOP como un rompecabezas de 3 piezas - necesitas al menos 2 para el diagnóstico. El peso puede ser un síntoma, pero por sí solo no define nada. Muchas mujeres delgadas tienen SOP, y muchas mujeres con sobrepeso NO lo tienen. Solo un médico puede ver el cuadro completo con estudios 😊"
-
-Pregunta: "¿Qué es el SOP?"
-❌ MAL: "El SOP es un trastorno endocrino metabólico complejo que afecta a mujeres en edad reproductiva"
-✅ BIEN: "¡Buena pregunta! 😊 Imagina que tus ovarios están un poco 'confundidos' sobre cuándo hacer su trabajo. El SOP (Síndrome de Ovario Poliquístico) básicamente significa que tus hormonas están un poco desbalanceadas, lo que puede causar ciclos irregulares, acné, o dificultad para bajar de peso. Es súper común - como 1 de cada 10 mujeres lo tiene. No es tu culpa, no hiciste nada mal, y hay muchas formas de manejarlo 💜"
-
-Pregunta: "Me siento horrible, ¿es por el SOP?"
-❌ MAL: "La guía ESHRE 2023 indica mayor prevalencia de depresión en SOP"
-✅ BIEN: "Lamento mucho que te sientas así 💜. Primero que nada: tus emociones son totalmente válidas. Y sí, hay una conexión real entre el SOP y cómo nos sentimos emocionalmente. No estás 'loca' ni eres 'dramática' - hay razones biológicas. Las mismas hormonas que afectan tus ciclos también pueden afectar tu ánimo. Es como cuando estás con el periodo y te sientes más sensible, pero puede ser más intenso con SOP. Muchas mujeres con SOP experimentan ansiedad o depresión, y hay ayuda disponible. ¿Has hablado con tu médico sobre cómo te sientes?"
-
-🎯 TU META: Que la persona se sienta ESCUCHADA, ENTENDIDA y con información ÚTIL, no como si leyera un documento médico aburrido.
-
-Fecha actual: {date}
-"""
+if PROFILE is not None and PROFILE["scope"] == "chat":
+    # Cada respuesta del chat se perfila por separado (los temas guiados en segundo plano no)
+    generate_response = profile_calls(
+        engine.generate_response, "generate_response", PROFILE["mode"],
+        lambda result: st.session_state.profiles.insert(0, result)
+    )
 
 # ==========================================
-# ANÁLISIS DE IMÁGENES
+# SESIÓN (HISTORIAL PERSISTENTE)
 # ==========================================
 
-class MedicalImageAnalyzer:
-    """Analiza imágenes médicas de forma educativa"""
-    
-    def __init__(self, model):
-        self.model = model
-    
-    def analyze_lab_results(self, image):
-        """Analiza resultados de laboratorio"""
-        
-        prompt = """Analiza estos RESULTADOS DE LABORATORIO de forma educativa y específica.
-
-**ESTRUCTURA TU RESPUESTA ASÍ:**
-
-📊 **LO QUE VEO EN TU ANÁLISIS:**
-(Describe específicamente qué tipo de análisis es, qué valores aparecen)
-
-🧠 **QUÉ SIGNIFICAN ESTOS ESTUDIOS EN SOP:**
-(Explica CADA valor visible y por qué es relevante en SOP)
-Ejemplo: "Veo que tienes análisis de testosterona. Este valor es importante porque en SOP los niveles de andrógenos (hormonas masculinas) pueden estar elevados, lo que explica síntomas como acné o vello excesivo"
-
-💡 **POR QUÉ TU MÉDICO PIDIÓ ESTO:**
-(Conecta los estudios con el diagnóstico/seguimiento de SOP)
-
-🎯 **LO QUE ESTOS RESULTADOS PUEDEN INDICAR (EN GENERAL):**
-(Sin interpretar valores específicos, explica qué patrones busca el médico)
-
-**REGLAS:**
-- Sé MUY específica con lo que ves
-- Explica CADA tipo de estudio visible
-- Usa lenguaje simple pero completo
-- NO digas si valores están altos/bajos
-- NO diagnostiques
-
-Si no es un resultado de laboratorio claro, dilo amablemente.
-"""
-        
-        try:
-            response = self.model.generate_content([prompt, image])
-            return response.text
-        except Exception as e:
-            if "safety" in str(e).lower():
-                return "⚠️ No pude analizar esta imagen por filtros de seguridad. Intenta con otra o consulta directamente con tu médico. 💜"
-            return f"❌ Error: {str(e)}"
-    
-    def analyze_cycle_chart(self, image):
-        """Analiza gráfica de ciclos menstruales"""
-        
-        prompt = """Analiza esta GRÁFICA DE CICLOS de forma educativa, específica y útil.
-
-**ESTRUCTURA TU RESPUESTA ASÍ:**
-
-📅 **LO QUE VEO EN TU REGISTRO:**
-(Describe específicamente: app que usas, qué marca, cuántos ciclos registrados, qué síntomas anota)
-
-📊 **ANÁLISIS DETALLADO:**
-Observo los siguientes patrones:
-- Duración de ciclos que puedo ver: [ser específica]
-- Síntomas que registras: [listar lo que se ve]
-- Regularidad aparente: [comentar si los ciclos parecen consistentes]
-
-🔍 **QUÉ BUSCA EL MÉDICO EN ESTO (según ESHRE 2023):**
-- Ciclos regulares: 21-35 días
-- En SOP: ciclos <21 o >35 días (disfunción ovulatoria)
-- Patrones de síntomas que se repiten
-- Relación entre síntomas y fase del ciclo
-
-💜 **POR QUÉ ESTE REGISTRO ES VALIOSO:**
-(Explica cómo este registro específico ayuda al diagnóstico)
-
-🎯 **LO QUE PODRÍAS AGREGAR PARA HACERLO AÚN MEJOR:**
-(Sugerencias específicas basadas en lo que ya tiene)
-
-**TONO:** Validador, específico, útil. Felicítala por llevar el registro.
-
-Si no es una gráfica de ciclos, dilo amablemente.
-"""
-        
-        try:
-            response = self.model.generate_content([prompt, image])
-            return response.text
-        except Exception as e:
-            if "safety" in str(e).lower():
-                return "⚠️ No pude analizar por seguridad. Intenta con otra imagen. 💜"
-            return f"❌ Error: {str(e)}"
-    
-    def analyze_ultrasound(self, image):
-        """Analiza ecografía (MUY limitado)"""
-        
-        prompt = """Analiza esta ECOGRAFÍA con MUCHA PRECAUCIÓN.
-
-**ESTRUCTURA TU RESPUESTA ASÍ:**
-
-🔬 **LO QUE IDENTIFICO:**
-(Solo tipo general: ecografía pélvica, transvaginal, tiene etiquetas, fecha, etc.)
-
-📚 **QUÉ BUSCA EL MÉDICO EN ECOGRAFÍAS DE SOP (según ESHRE 2023):**
-- Morfología ovárica: ≥20 folículos de 2-9mm por ovario
-- Volumen ovárico: ≥10ml
-- Esto es UNO de los 3 criterios diagnósticos
-- En mujeres <35 años con ciclos regulares puede no ser necesaria
-
-⚠️ **POR QUÉ NO PUEDO "LEER" TU ECOGRAFÍA:**
-La interpretación de ecografías requiere:
-- Años de formación especializada
-- Ver el estudio en movimiento (no solo una foto)
-- Conocer contexto completo (edad, síntomas, otros estudios)
-- Equipo calibrado correctamente
-
-✅ **LO QUE SÍ PUEDES HACER:**
-- Pedir al radiólogo el REPORTE OFICIAL por escrito
-- Llevar ese reporte a tu ginecólogo
-- Hacer preguntas específicas sobre hallazgos mencionados
-
-**TONO:** Muy cauto, educativo sobre limitaciones.
-
-Si no es ecografía, dilo.
-"""
-        
-        try:
-            response = self.model.generate_content([prompt, image])
-            return response.text
-        except Exception as e:
-            if "safety" in str(e).lower():
-                return "⚠️ No puedo analizar esta imagen. Consulta directamente con tu médico. 💜"
-            return f"❌ Error: {str(e)}"
-    
-    def analyze_general(self, image):
-        """Análisis general mejorado"""
-        
-        prompt = """Analiza esta imagen médica de forma educativa y específica.
-
-**PASOS:**
-
-1. **IDENTIFICA** qué tipo de imagen es (laboratorio, ciclos, ecografía, otro)
+# El código anónimo de la sesión no va en la URL (un enlace compartido expondría la conversación):
+# se muestra en la barra lateral y se pega ahí para retomar. ?sesion= solo se acepta de enlaces antiguos
+SESSION_PARAM = "sesion"
 
-2. **ANALIZA ESPECÍFICAMENTE** basándote en el tipo:
-   - Describe lo que ves con detalle
-   - Explica qué significan esos estudios en contexto de SOP
-   - Conecta con criterios ESHRE 2023 relevantes
-
-3. **EXPLICA** por qué este tipo de estudio es útil para el diagnóstico/seguimiento
-
-4. **SUGIERE** qué más podría ser útil registrar o preguntar
-
-**REGLAS:**
-❌ NO interpretes valores específicos
-❌ NO diagnostiques
-✅ Sé específica con lo que ves
-✅ Usa lenguaje simple
-✅ Conecta con vida real
-
-Si no es imagen médica clara, dilo amablemente.
-"""
-        
-        try:
-            response = self.model.generate_content([prompt, image])
-            return response.text
-        except Exception as e:
-            if "safety" in str(e).lower():
-                return "⚠️ No puedo analizar. Consulta con tu médico. 💜"
-            return f"❌ Error: {str(e)}"
+@st.cache_resource
+def purge_old_sessions():
+    """Borra conversaciones sin actividad reciente (una vez por proceso)"""
+    return purge_expired()
+
+purge_old_sessions()
+
+def start_session(session_id, resumed):
+    """Historiales y contexto recuperado de la sesión (guardados si se retoma)"""
+    for key in ('messages', 'image_analyses', 'chat_older_loaded'):
+        st.session_state.pop(key, None)
+    st.session_state.session_id = session_id
+    st.session_state.resumed = resumed
+    if resumed:
+        st.session_state.context_cache = ContextCache.resume(session_id)
+        images = ImageHistory.resume(session_id)
+        if images:
+            st.session_state.image_analyses = images
+    else:
+        st.session_state.context_cache = ContextCache(session_id)
 
-# Inicializar analizador de imágenes
-image_analyzer = MedicalImageAnalyzer(model)
+if 'session_id' not in st.session_state:
+    token = st.query_params.get(SESSION_PARAM)
+    if session_exists(token):
+        start_session(token, resumed=True)
+    else:
+        start_session(new_session_id(), resumed=False)
+if SESSION_PARAM in st.query_params:
+    del st.query_params[SESSION_PARAM]
 
 # ==========================================
-# BÚSQUEDA Y RESPUESTA
+# TEMAS GUIADOS (PRECALCULADOS)
 # ==========================================
 
-def search_context(query, k=5):
-    """Búsqueda semántica simple"""
-    try:
-        # Sin filtro de score - retorna los k más relevantes
-        docs = vectorstore.similarity_search(query, k=k)
-        return docs
-    except Exception as e:
-        st.error(f"Error búsqueda: {str(e)}")
-        return []
-
-def generate_response(user_query, chat_history=[]):
-    """Genera respuesta con contexto del PDF"""
-    
-    # Buscar contexto relevante
-    docs = search_context(user_query, k=4)
-    
-    if not docs:
-        return """Lo siento, no encontré información específica en la guía médica que consulto.
-
-Te recomiendo:
-- Consultar con tu ginecólogo o endocrinólogo
-- Buscar en fuentes médicas oficiales
-- Si es urgente, contactar a tu médico
-
-¿Tienes otra pregunta sobre el SOP? 💜"""
-    
-    # Preparar contexto
-    context = "\n\n---\n\n".join([
-        f"[{d.metadata.get('fuente', 'Guía médica')}]\n{d.page_content}"
-        for d in docs
-    ])
-    
-    # Construir prompt
-    full_prompt = SYSTEM_PROMPT.format(
-        context=context,
-        date=datetime.now().strftime('%Y-%m-%d')
-    )
-    
-    # Agregar historial si existe
-    if chat_history and len(chat_history) > 0:
-        full_prompt += "\n\n**CONVERSACIÓN PREVIA:**\n"
-        recent = chat_history[-6:]
-        for msg in recent:
-            role = "Usuario" if msg["role"] == "user" else "Asistente"
-            full_prompt += f"\n{role}: {msg['content']}\n"
-    
-    full_prompt += f"\n\n**PREGUNTA ACTUAL:**\n{user_query}\n\n**TU RESPUESTA:**"
-    
-    # Generar respuesta
-    try:
-        response = model.generate_content(full_prompt)
-        answer = response.text
-        
-        # Agregar footer si cita guía
-        if "guía" in answer.lower() or "eshre" in answer.lower():
-            answer += "\n\n---\n📚 *Información basada en guías médicas ESHRE 2023*"
-        
-        return answer
-    
-    except Exception as e:
-        error_str = str(e).lower()
-        
-        if "safety" in error_str or "block" in error_str:
-            return "⚠️ Mi sistema de seguridad bloqueó esta respuesta. Intenta reformular tu pregunta o consulta directamente con tu médico. 💜"
-        elif "quota" in error_str or "429" in error_str:
-            return f"⏱️ He alcanzado mi límite de uso. Intenta en 1 minuto. 💜"
-        else:
-            return f"❌ Error técnico. Intenta de nuevo. 💜"
+@st.cache_resource
+def load_guided_topics():
+    """Caché de temas guiados compartida por todas las sesiones"""
+    return GuidedTopicsCache()
+
+guided_topics = load_guided_topics()
+# En modo remoto la calcula el servidor (el índice no está en esta máquina)
+GUIDED_TOPICS_VERSION = engine.guided_topics_version
+
+# Si cambió el índice o el prompt, se recalcula en segundo plano (con backoff si falla).
+# raise_errors: los errores de búsqueda se propagan al hilo en vez de ir a st.error
+guided_topics.ensure_fresh(
+    GUIDED_TOPICS_VERSION,
+    lambda q: engine.generate_response(q, raise_errors=True, warmup=True)
+)
 
 # ==========================================
 # UI PRINCIPAL
@@ -521,19 +296,72 @@ st.markdown("---")
 # TABS: CHAT + IMÁGENES
 # ==========================================
 
-tab1, tab2, tab3 = st.tabs(["💬 Chat Médico", "📸 Análisis de Imágenes", "🎥 Recursos"])
+tab1, tab2, tab3, tab4 = st.tabs(["💬 Chat Médico", "📸 Análisis de Imágenes", "🎥 Recursos", "🩺 Riesgo (educativo)"])
 
 # ========================================
 # TAB 1: CHAT
 # ========================================
 
+CHAT_VISIBLE_MESSAGES = 10
+CHAT_PAGE_SIZE = 20
+
+# Miniaturas y fragmentos de la versión activa del índice (en modo remoto, desde la API)
+page_previews = engine.page_previews()
+
+def render_sources(pages, previews=page_previews):
+    """Páginas citadas en la respuesta, sin abrir el PDF"""
+    with st.expander(f"📚 Fuentes: Guía ESHRE 2023, {pages_label(pages)}"):
+        for page in pages:
+            info = previews.get(page) if previews is not None else None
+            if info is None:
+                st.caption(f"Página {page + 1}")
+                continue
+            col_thumb, col_text = st.columns([1, 3])
+            with col_thumb:
+                thumbnail = previews.thumbnail(page)
+                if thumbnail:
+                    st.image(thumbnail, use_container_width=True)
+            with col_text:
+                st.markdown(f"**Página {page + 1}**" + (f" · {info['section']}" if info["section"] else ""))
+                st.caption(info["snippet"])
+
+@st.fragment
+def render_chat_history():
+    """Dibuja el historial reciente; cargar más solo re-ejecuta este fragmento"""
+    messages = st.session_state.messages
+    if 'chat_older_loaded' not in st.session_state:
+        st.session_state.chat_older_loaded = 0
+    
+    visible_start = max(len(messages) - CHAT_VISIBLE_MESSAGES, 0)
+    older_start = max(visible_start - st.session_state.chat_older_loaded, 0)
+    
+    if older_start > 0:
+        if st.button(f"⬆️ Cargar mensajes anteriores ({older_start} ocultos)", key="load_older"):
+            st.session_state.chat_older_loaded += CHAT_PAGE_SIZE
+            st.rerun(scope="fragment")
+    
+    if older_start < visible_start:
+        with st.expander(f"📜 {visible_start - older_start} mensajes anteriores", expanded=False):
+            for msg in messages.page(older_start, visible_start):
+                st.markdown(f"**{'Tú' if msg.role == 'user' else 'Sofía'}:** {msg.content}")
+    
+    for msg in messages.page(visible_start, len(messages)):
+        with st.chat_message(msg.role):
+            st.markdown(msg.content)
+            if msg.sources:
+                render_sources(msg.sources)
+
 with tab1:
     # Inicializar historial
     if 'messages' not in st.session_state:
-        st.session_state.messages = [
-            {
-                "role": "assistant",
-                "content": """¡Hola! Me llamo Sofía 💜
+        st.session_state.messages = (
+            ChatHistory.resume(st.session_state.session_id) if st.session_state.resumed
+            else ChatHistory(st.session_state.session_id)
+        )
+    if not st.session_state.messages:
+        st.session_state.messages.append(
+            "assistant",
+            """¡Hola! Me llamo Sofía 💜
 
 Soy tu **guía educativa sobre el Síndrome de Ovario Poliquístico (SOP)**.
 
@@ -558,13 +386,10 @@ Soy tu **guía educativa sobre el Síndrome de Ovario Poliquístico (SOP)**.
 🔒 **Mi compromiso:** Solo información verificable. Si no sé algo, te lo digo honestamente.
 
 ¿Qué te gustaría saber sobre el SOP? 😊"""
-            }
-        ]
+        )
     
-    # Mostrar mensajes
-    for msg in st.session_state.messages:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
+    # Mostrar mensajes (solo los últimos; los anteriores se cargan a demanda)
+    render_chat_history()
     
 # Input del usuario
 if prompt := st.chat_input("Escribe tu pregunta sobre SOP... 💭"):
@@ -581,7 +406,8 @@ if prompt := st.chat_input("Escribe tu pregunta sobre SOP... 💭"):
     st.session_state.last_request_time = time.time()
 
     # Agregar mensaje del usuario
-    st.session_state.messages.append({"role": "user", "content": prompt})
+    history = st.session_state.messages.recent(6)
+    st.session_state.messages.append("user", prompt)
     
     with st.chat_message("user"):
         st.markdown(prompt)
@@ -589,14 +415,16 @@ if prompt := st.chat_input("Escribe tu pregunta sobre SOP... 💭"):
     # Generar respuesta
     with st.chat_message("assistant"):
         with st.spinner("🔍 Buscando en guía médica..."):
-            response = generate_response(
-                prompt,
-                st.session_state.messages[:-1]
+            response, pages = generate_response(
+                prompt, history, context_cache=st.session_state.context_cache
             )
+        with METRICS.stage("render"):
             st.markdown(response)
+            if pages:
+                render_sources(pages)
     
     # Guardar respuesta
-    st.session_state.messages.append({"role": "assistant", "content": response})
+    st.session_state.messages.append("assistant", response, sources=pages)
 
 # ========================================
 # TAB 2: ANÁLISIS DE IMÁGENES
@@ -678,14 +506,7 @@ with tab2:
                         img = PIL.Image.open(uploaded_file)
                         
                         # Análisis según tipo
-                        if st.session_state.image_type == "lab":
-                            analysis = image_analyzer.analyze_lab_results(img)
-                        elif st.session_state.image_type == "cycle":
-                            analysis = image_analyzer.analyze_cycle_chart(img)
-                        elif st.session_state.image_type == "ultrasound":
-                            analysis = image_analyzer.analyze_ultrasound(img)
-                        else:
-                            analysis = image_analyzer.analyze_general(img)
+                        analysis = engine.analyze_image(img, st.session_state.image_type)
                         
                         st.markdown("### 📋 Análisis Educativo:")
                         st.info(analysis)
@@ -781,13 +602,13 @@ Si tienes dudas urgentes, contacta a tu médico. 💜
                         
                         # Guardar en historial
                         if 'image_analyses' not in st.session_state:
-                            st.session_state.image_analyses = []
+                            st.session_state.image_analyses = ImageHistory(st.session_state.session_id)
                         
-                        st.session_state.image_analyses.append({
-                            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                            "type": type_labels[st.session_state.image_type],
-                            "analysis": analysis
-                        })
+                        st.session_state.image_analyses.append(
+                            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                            type_labels[st.session_state.image_type],
+                            analysis
+                        )
                         
                         st.success("✅ Análisis completado")
                     
@@ -799,7 +620,7 @@ Si tienes dudas urgentes, contacta a tu médico. 💜
         st.markdown("---")
         st.markdown("### 📜 Historial de Análisis")
         
-        for idx, item in enumerate(reversed(st.session_state.image_analyses)):
+        for idx, item in enumerate(reversed(list(st.session_state.image_analyses))):
             with st.expander(f"{item['type']} - {item['timestamp']}", expanded=(idx==0)):
                 st.markdown(item['analysis'])
 
@@ -807,6 +628,14 @@ Si tienes dudas urgentes, contacta a tu médico. 💜
 # TAB 3: RECURSOS MULTIMEDIA
 # ========================================
 
+GUIDE_PDF_PATH = "guia_sop.pdf"
+
+@st.cache_resource
+def load_guide_pdf():
+    """Bytes del PDF leídos una sola vez por proceso"""
+    with open(GUIDE_PDF_PATH, "rb") as f:
+        return f.read()
+
 with tab3:
     st.markdown("## 🎥 Recursos Educativos sobre el SOP")
     
@@ -996,17 +825,16 @@ with tab3:
             - 📙 [CDC - Información sobre SOP](https://www.cdc.gov/)
             """)
             
-            # Botón de descarga de tu PDF
-            if os.path.exists("guia_sop.pdf"):
+            # Botón de descarga de tu PDF (bytes leídos una vez por proceso)
+            if os.path.exists(GUIDE_PDF_PATH):
                 st.markdown("---")
-                with open("guia_sop.pdf", "rb") as pdf_file:
-                    st.download_button(
-                        label="📥 Descargar Guía Completa (PDF)",
-                        data=pdf_file,
-                        file_name="guia_sop_completa.pdf",
-                        mime="application/pdf",
-                        use_container_width=True
-                    )
+                st.download_button(
+                    label="📥 Descargar Guía Completa (PDF)",
+                    data=load_guide_pdf(),
+                    file_name="guia_sop_completa.pdf",
+                    mime="application/pdf",
+                    use_container_width=True
+                )
         
         with col2:
             st.markdown("""
@@ -1038,6 +866,97 @@ with tab3:
     ¡Recuerda que no estás sola en esto! 🤗
     """)
 
+# ========================================
+# TAB 4: RIESGO (EDUCATIVO)
+# ========================================
+
+@st.cache_resource
+def load_risk_scorer():
+    """Artefacto del modelo de riesgo, una vez por proceso (None si no se ha exportado)"""
+    try:
+        return RiskScorer.load()
+    except FileNotFoundError:
+        return None
+
+def risk_form_input(name, spec):
+    """Widget del formulario según el tipo de variable"""
+    if spec["kind"] == "flag":
+        return int(st.checkbox(spec["label"], value=bool(spec["default"]), key=f"risk_{name}"))
+    if spec["kind"] == "cycle":
+        return 4 if st.checkbox(spec["label"], value=spec["default"] == 4, key=f"risk_{name}") else 2
+    if spec["kind"] == "int":
+        return st.number_input(spec["label"], spec["min"], spec["max"], spec["default"], step=1, key=f"risk_{name}")
+    return st.number_input(spec["label"], spec["min"], spec["max"], spec["default"], step=0.1, key=f"risk_{name}")
+
+with tab4:
+    st.markdown("## 🩺 ¿Qué tanto se parecen tus datos a los casos de SOP?")
+    
+    st.warning("""
+    ⚠️ **Herramienta EDUCATIVA, no diagnóstica.** Los modelos se entrenaron con un dataset 
+    pequeño (541 registros) y solo muestran qué tanto se parecen tus datos a los casos con SOP 
+    de ese conjunto. El diagnóstico lo hace tu médico con los criterios de Rotterdam/ESHRE 💜
+    """)
+    
+    risk_scorer = load_risk_scorer()
+    
+    if risk_scorer is None:
+        st.info("El modelo aún no está exportado. Ejecuta: `python export_risk_model.py`")
+    else:
+        with st.form("risk_form"):
+            col1, col2 = st.columns(2)
+            names = list(FEATURE_SPECS)
+            form_values = {}
+            for i, name in enumerate(names):
+                with (col1 if i % 2 == 0 else col2):
+                    form_values[name] = risk_form_input(name, FEATURE_SPECS[name])
+            submitted = st.form_submit_button("🔍 Ver resultado educativo", use_container_width=True)
+        
+        if submitted:
+            with METRICS.stage("risk_score"):
+                risk = risk_scorer.score(form_values)
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Regresión logística", f"{risk['logistic']:.0%}")
+                st.progress(risk["logistic"])
+            with col2:
+                st.metric("Random forest", f"{risk['forest']:.0%}")
+                st.progress(risk["forest"])
+            
+            if risk["logistic_flag"]:
+                st.info("""
+                💜 Tus datos se parecen a varios casos con SOP del dataset. Esto **no** significa 
+                que lo tengas, pero sí es una buena razón para platicarlo con tu ginecóloga/o. 
+                Pregúntale a Sofía en el **Chat** qué estudios suelen pedirse.
+                """)
+            else:
+                st.success("""
+                😊 Tus datos se parecen poco a los casos con SOP del dataset. Aun así, si tienes 
+                síntomas que te preocupan, consulta a tu médico: solo una valoración completa lo confirma.
+                """)
+            st.caption(f"Modelo v{risk['version']} · umbral de la logística {risk_scorer.threshold:.0%}")
+        
+        with st.expander("📄 Puntuar un CSV (varias filas)"):
+            st.caption("Columnas: " + ", ".join(risk_scorer.features))
+            risk_csv = st.file_uploader("CSV con las 12 variables", type=["csv"], key="risk_csv")
+            if risk_csv is not None:
+                try:
+                    risk_df = pd.read_csv(risk_csv)
+                    with METRICS.stage("risk_score_batch"):
+                        batch = risk_scorer.score_batch(risk_df)
+                except ValueError as e:
+                    st.error(f"❌ {str(e)}")
+                else:
+                    risk_df["prob_logistica"] = batch["logistic"].round(4)
+                    risk_df["prob_random_forest"] = batch["forest"].round(4)
+                    st.dataframe(risk_df.head(100), use_container_width=True)
+                    st.download_button(
+                        "💾 Descargar resultados",
+                        risk_df.to_csv(index=False).encode("utf-8"),
+                        file_name="riesgo_sop_resultados.csv",
+                        mime="text/csv",
+                    )
+
 # ==========================================
 # SIDEBAR
 # ==========================================
@@ -1156,26 +1075,24 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### 🌸 Temas guiados")
     
-    quick_questions = [
-        "¿Qué es el SOP?",
-        "¿Cómo se diagnostica?",
-        "Tratamientos disponibles",
-        "¿Puedo embarazarme?",
-        "Dieta para SOP",
-        "Ejercicio recomendado",
-        "Riesgo de diabetes",
-        "Salud mental y SOP"
-    ]
-    
-    for q in quick_questions:
+    for q in QUICK_QUESTIONS:
         if st.button(q, key=f"quick_{q}", use_container_width=True):
             # Agregar pregunta del usuario
-            st.session_state.messages.append({"role": "user", "content": q})
+            st.session_state.messages.append("user", q)
             
-            # Generar respuesta inmediatamente
-            with st.spinner("🔍 Buscando en guía médica..."):
-                response = generate_response(q, st.session_state.messages[:-1])
-                st.session_state.messages.append({"role": "assistant", "content": response})
+            # Respuesta precalculada si está al día; si no, en vivo
+            cached = guided_topics.get(q, GUIDED_TOPICS_VERSION)
+            METRICS.incr("guided_topics_cache_total", result="hit" if cached else "miss")
+            if cached:
+                response, pages = cached["answer"], cached["pages"]
+            else:
+                # Tema fijo: sin historial, igual que la respuesta precalculada ("Tratamientos
+                # disponibles" no es un seguimiento de la pregunta anterior)
+                with st.spinner("🔍 Buscando en guía médica..."):
+                    response, pages = generate_response(
+                        q, (), context_cache=st.session_state.context_cache
+                    )
+            st.session_state.messages.append("assistant", response, sources=pages)
             
             st.rerun()
     st.markdown("### 📊 Estado del Sistema")
@@ -1185,29 +1102,88 @@ with st.sidebar:
     st.caption("🔍 Búsqueda semántica")
     st.caption("📸 Análisis de imágenes")
     st.caption("🤖 Gemini 2.5 Flash")
-    st.caption("📊 Límite: 15 consultas/minuto")
+    
+    # Números reales del proceso (no por sesión); en modo cliente, los de la API + los de esta UI
+    metrics_snapshot = METRICS.snapshot()
+    if SOP_API_URL:
+        try:
+            metrics_snapshot = merge_snapshots(engine.metrics_snapshot(), metrics_snapshot)
+        except Exception as e:
+            st.caption(f"⚠️ Sin métricas de la API: {friendly_error(e)}")
+    chat_stats = snapshot_summary(metrics_snapshot, "stage_seconds", stage="chat_total")
+    if chat_stats and chat_stats["count"]:
+        st.caption(
+            f"⏱️ Respuesta p50 {chat_stats['p50']:.2f}s · "
+            f"p95 {chat_stats['p95']:.2f}s · p99 {chat_stats['p99']:.2f}s"
+        )
+        st.caption(f"📊 {chat_stats['rate_1m']} consultas en el último minuto (límite 15)")
+        st.caption(
+            f"🔤 Tokens: {snapshot_counter(metrics_snapshot, 'gemini_prompt_tokens_total', call='chat'):.0f} entrada · "
+            f"{snapshot_counter(metrics_snapshot, 'gemini_response_tokens_total', call='chat'):.0f} salida"
+        )
+    else:
+        st.caption("📊 Sin consultas registradas aún")
+    
+    with st.expander("📈 Latencia por etapa"):
+        for stage in ("query_encoding", "vector_search", "prompt_assembly", "gemini_chat", "render"):
+            summary = snapshot_summary(metrics_snapshot, "stage_seconds", stage=stage)
+            if summary and summary["count"]:
+                st.caption(f"**{stage}**: p50 {summary['p50'] * 1000:.0f} ms · p95 {summary['p95'] * 1000:.0f} ms")
+        col_json, col_prom = st.columns(2)
+        with col_json:
+            st.download_button("JSON", snapshot_to_json(metrics_snapshot), file_name="metricas_sop.json",
+                               mime="application/json", use_container_width=True)
+        with col_prom:
+            st.download_button("Prometheus", snapshot_to_prometheus(metrics_snapshot), file_name="metricas_sop.prom",
+                               mime="text/plain", use_container_width=True)
 
     
     st.markdown("---")
     st.markdown("### 💬 Controles")
     
     # Stats
+    session_bytes = 0
     if 'messages' in st.session_state:
-        user_msgs = len([m for m in st.session_state.messages if m["role"] == "user"])
-        st.metric("Preguntas realizadas", user_msgs)
+        st.metric("Preguntas realizadas", st.session_state.messages.user_turns)
+        session_bytes += st.session_state.messages.memory_bytes()
     
     if 'image_analyses' in st.session_state:
         st.metric("Imágenes analizadas", len(st.session_state.image_analyses))
+        session_bytes += st.session_state.image_analyses.memory_bytes()
+    
+    st.caption(f"💾 Memoria de sesión: {session_bytes / 1024:.1f} KB")
     
     # Botones de control
     if st.button("🗑️ Limpiar Chat", type="secondary", use_container_width=True):
-        st.session_state.messages = [
-            {"role": "assistant", "content": "💜 ¡Chat reiniciado! ¿En qué puedo ayudarte?"}
-        ]
+        st.session_state.messages.clear()
+        st.session_state.messages.append("assistant", "💜 ¡Chat reiniciado! ¿En qué puedo ayudarte?")
+        st.session_state.context_cache.clear()
+        st.session_state.chat_older_loaded = 0
+        st.rerun()
+    
+    # La conversación actual queda guardada con su código; una nueva no se mezcla con ella
+    if st.button("🆕 Nueva conversación", type="secondary", use_container_width=True):
+        start_session(new_session_id(), resumed=False)
         st.rerun()
     
+    with st.expander("🔑 Retomar conversación"):
+        st.caption("Código de esta conversación (guárdalo en privado: quien lo tenga puede leerla)")
+        st.code(st.session_state.session_id, language=None)
+        with st.form("resume_session", clear_on_submit=True):
+            code = st.text_input("Código de una conversación anterior", type="password")
+            if st.form_submit_button("Retomar", use_container_width=True):
+                code = code.strip().lower()
+                if code == st.session_state.session_id:
+                    st.info("Ya estás en esa conversación")
+                elif session_exists(code):
+                    start_session(code, resumed=True)
+                    st.rerun()
+                else:
+                    st.error("No hay ninguna conversación guardada con ese código")
+    
     if st.button("🗑️ Limpiar Historial Imágenes", type="secondary", use_container_width=True):
-        st.session_state.image_analyses = []
+        if 'image_analyses' in st.session_state:
+            st.session_state.image_analyses.clear()
         st.success("✅ Historial limpiado")
         st.rerun()
     
@@ -1215,20 +1191,23 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### 💾 Exportar")
     
-    if st.button("📥 Descargar Conversación", use_container_width=True):
-        if 'messages' in st.session_state and len(st.session_state.messages) > 1:
-            chat_text = "\n\n".join([
-                f"{'Usuario' if m['role'] == 'user' else 'Sofía'}: {m['content']}"
-                for m in st.session_state.messages
-            ])
-            
-            st.download_button(
-                label="⬇️ Descargar TXT",
-                data=chat_text,
-                file_name=f"chat_sop_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                mime="text/plain",
-                use_container_width=True
-            )
+    export_format = st.selectbox("Formato", list(EXPORT_FORMATS), key="export_format")
+    
+    # Un solo botón: Streamlit llama a export_data al hacer clic (nada se genera en cada rerun)
+    if 'messages' in st.session_state and len(st.session_state.messages) > 1:
+        ext, mime, _ = EXPORT_FORMATS[export_format]
+        image_analyses = st.session_state.get('image_analyses')
+        st.download_button(
+            label=f"📥 Descargar {export_format}",
+            data=export_data(
+                export_format,
+                st.session_state.messages.iter_all,
+                image_analyses.iter_all if image_analyses else tuple
+            ),
+            file_name=f"chat_sop_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}",
+            mime=mime,
+            use_container_width=True
+        )
     
     # Información adicional
     st.markdown("---")
@@ -1246,4 +1225,49 @@ with st.sidebar:
     - Basado 100% en evidencia
     
     **Versión:** 2.0 Advanced (Hugging Face)
-    """)
\ No newline at end of file
+    """)
+
+# ==========================================
+# PERFILES (SOLO ADMIN)
+# ==========================================
+
+def render_profiles(profiles):
+    """Funciones más costosas de los últimos perfiles + descarga del perfil crudo"""
+    st.markdown("---")
+    st.markdown("### 🔬 Perfiles")
+    if not profiles:
+        st.caption("Sin perfiles aún: haz una pregunta para perfilar generate_response")
+    for i, result in enumerate(profiles):
+        label = f"{result['label']} (interrumpido)" if result.get("interrupted") else result["label"]
+        with st.expander(f"{label} · {result['wall_s'] * 1000:.0f} ms · {result['mode']}", expanded=i == 0):
+            st.caption(f"ID: `{result['request_id']}`")
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "función": row["function"],
+                        "acum. ms": round(row["cum_s"] * 1000, 1),
+                        "propio ms": round(row["self_s"] * 1000, 1),
+                        "llamadas": row["calls"],
+                    }
+                    for row in result["top"][:15]
+                ]),
+                hide_index=True,
+                use_container_width=True
+            )
+            col_txt, col_raw = st.columns(2)
+            with col_txt:
+                st.download_button("Resumen", read_profile_file(result["report_path"]),
+                                   file_name=os.path.basename(result["report_path"]), mime="text/plain",
+                                   key=f"profile_txt_{result['request_id']}", use_container_width=True)
+            with col_raw:
+                st.download_button("Perfil", read_profile_file(result["path"]),
+                                   file_name=os.path.basename(result["path"]), mime="application/octet-stream",
+                                   key=f"profile_raw_{result['request_id']}", use_container_width=True)
+
+if PROFILE is not None:
+    # El perfil del rerun termina aquí, antes de dibujar el propio panel
+    if 'rerun_profile' in st.session_state:
+        st.session_state.profiles.insert(0, st.session_state.pop('rerun_profile').finish())
+    del st.session_state.profiles[5:]
+    with st.sidebar:
+        render_profiles(st.session_state.profiles)
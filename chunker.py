@@ -0,0 +1,167 @@
+"""
+Chunker estructural para la guía ESHRE 2023
+Respeta páginas, secciones y recomendaciones; quita encabezados, referencias y texto repetido
+"""
+
+import hashlib
+import re
+
+from langchain_core.documents import Document
+
+MAX_CHUNK_CHARS = 2500
+MIN_CHUNK_CHARS = 200
+
+# Encabezado de cada página (con o sin número) y números de página sueltos
+BOILERPLATE_LINES = [
+    re.compile(r"^\d{0,3}\s*International Evidence-based Guideline for the assessment and management of polycystic ovary syndrome 2023$"),
+    re.compile(r"^\d{1,3}$"),
+    # Encabezado de las tablas de recomendaciones
+    re.compile(r"^(No\.|Type|Living#|Grade/|Quality|Recommendation)$"),
+]
+
+# "1.4 Ultrasound and polycystic ovarian morphology"
+HEADING = re.compile(r"^(\d{1,2}(?:\.\d{1,2}){1,2})\s+([A-Z][^.]{3,120})$")
+# "1.4.1 EBR Follicle number per ovary ..."
+RECOMMENDATION = re.compile(r"^(\d{1,2}\.\d{1,2}\.\d{1,2})\s+(EBR|CR|PP)\b")
+# "213. Moran LJ, Brown WJ, ..." (bibliografía)
+REFERENCE = re.compile(r"^\d{1,3}\.\s+[A-ZÁÉÍÓÚ][\w'’\-]+(?:\s[\w'’\-]+)?\s[A-Z]{1,4}[,.]")
+REFERENCE_LINES_PER_PAGE = 5
+
+
+def clean_lines(text):
+    """Líneas con contenido, sin encabezados ni números de página"""
+    lines = []
+    for raw in text.splitlines():
+        line = " ".join(raw.split())
+        if line and not any(p.match(line) for p in BOILERPLATE_LINES):
+            lines.append(line)
+    return lines
+
+
+def is_reference_page(lines):
+    return sum(1 for line in lines if REFERENCE.match(line)) >= REFERENCE_LINES_PER_PAGE
+
+
+def _fingerprint(text):
+    return hashlib.sha1(re.sub(r"\W+", " ", text.lower()).strip().encode()).hexdigest()
+
+
+def _split_long(text, max_chars):
+    """Parte un bloque largo por oraciones, sin solapamiento"""
+    if len(text) <= max_chars:
+        return [text]
+    pieces, current = [], ""
+    for sentence in re.split(r"(?<=[.;:])\s+", text):
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip()
+        while len(current) > max_chars:
+            pieces.append(current[:max_chars])
+            current = current[max_chars:]
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def page_blocks(lines, section):
+    """Bloques de una página: un bloque por recomendación, el resto por sección
+
+    Regresa (bloques, sección vigente al final de la página); cada bloque es
+    (sección, id de recomendación o None, texto)
+    """
+    blocks = []
+    current, current_rec = [], None
+
+    def flush():
+        if current:
+            blocks.append((section, current_rec, " ".join(current)))
+
+    for line in lines:
+        heading = HEADING.match(line)
+        rec = RECOMMENDATION.match(line)
+        if rec:
+            flush()
+            current, current_rec = [line], rec.group(1)
+        elif heading:
+            # Un encabezado también cierra la recomendación abierta
+            flush()
+            section = f"{heading.group(1)} {heading.group(2)}"
+            current, current_rec = [line], None
+        else:
+            current.append(line)
+    flush()
+    return blocks, section
+
+
+def _pack(blocks, max_chars, min_chars):
+    """Junta bloques consecutivos de la misma sección hasta max_chars"""
+    chunks = []
+    for section, rec, text in blocks:
+        for piece in _split_long(text, max_chars):
+            last = chunks[-1] if chunks else None
+            if (
+                last is not None
+                and last["section"] == section
+                and len(last["text"]) + len(piece) + 1 <= max_chars
+                and (len(piece) < min_chars or len(last["text"]) < min_chars or (rec and last["recs"]))
+            ):
+                last["text"] += "\n" + piece
+                if rec:
+                    last["recs"].append(rec)
+                continue
+            chunks.append({"section": section, "recs": [rec] if rec else [], "text": piece})
+    return chunks
+
+
+def structural_chunks(documents, max_chars=MAX_CHUNK_CHARS, min_chars=MIN_CHUNK_CHARS):
+    """Documentos por página (PyPDFLoader) -> chunks densos con página, sección y recomendaciones"""
+    stats = {"pages": len(documents), "reference_pages": 0, "empty_pages": 0, "duplicates": 0}
+    seen = set()
+    chunks = []
+    section = ""
+
+    for doc in documents:
+        lines = clean_lines(doc.page_content)
+        if is_reference_page(lines):
+            stats["reference_pages"] += 1
+            continue
+        blocks, section = page_blocks(lines, section)
+
+        # Las recomendaciones aparecen en el resumen y en su capítulo: se deja la primera
+        unique = []
+        for block in blocks:
+            key = _fingerprint(block[2])
+            if key in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(key)
+            unique.append(block)
+
+        page_chunks = [c for c in _pack(unique, max_chars, min_chars) if len(c["text"]) >= 40]
+        if not page_chunks:
+            stats["empty_pages"] += 1
+            continue
+
+        for chunk in page_chunks:
+            metadata = dict(doc.metadata)
+            metadata.update({
+                "section": chunk["section"],
+                "recommendations": ",".join(chunk["recs"]),
+                "chunk_type": "recommendation" if chunk["recs"] else "text",
+            })
+            chunks.append(Document(page_content=chunk["text"], metadata=metadata))
+
+    stats["chunks"] = len(chunks)
+    return chunks, stats
+
+
+def chunk_report(chunks):
+    """Número de chunks y tamaño del texto a indexar"""
+    sizes = [len(c.page_content) for c in chunks]
+    return {
+        "chunks": len(chunks),
+        "total_chars": sum(sizes),
+        "avg_chars": sum(sizes) / len(sizes) if sizes else 0.0,
+        "max_chars": max(sizes, default=0),
+    }
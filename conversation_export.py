@@ -0,0 +1,193 @@
+"""
+Exportación de conversaciones
+TXT / Markdown / JSON / PDF generados por partes; el archivo se arma solo al pedir la descarga
+"""
+
+import io
+import json
+import textwrap
+from datetime import datetime
+
+from page_previews import pages_label
+
+
+def _speaker(role):
+    return "Usuario" if role == "user" else "Sofía"
+
+
+def _format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# ==========================================
+# GENERADORES POR FORMATO
+# ==========================================
+
+def iter_txt(messages, image_analyses=()):
+    """Transcripción en texto plano"""
+    yield "Conversación - Guía Educativa SOP\n"
+    yield f"Exportada: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+    for m in messages:
+        yield f"{_speaker(m.role)}: {m.content}\n"
+        if m.sources:
+            yield f"[Fuentes: Guía ESHRE 2023, {pages_label(m.sources)}]\n"
+        yield "\n"
+    for item in image_analyses:
+        yield f"=== Análisis de imagen: {item.type} ({item.timestamp}) ===\n"
+        yield f"{item.analysis}\n\n"
+
+
+def iter_markdown(messages, image_analyses=()):
+    """Transcripción en Markdown"""
+    yield "# 💜 Conversación - Guía Educativa SOP\n\n"
+    yield f"*Exportada: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}*\n\n"
+    for m in messages:
+        yield f"### {_speaker(m.role)}\n\n{m.content}\n\n"
+        if m.sources:
+            yield f"> 📚 Fuentes: Guía ESHRE 2023, {pages_label(m.sources)}\n\n"
+    for idx, item in enumerate(image_analyses):
+        if idx == 0:
+            yield "---\n\n## 📸 Análisis de imágenes\n\n"
+        yield f"### {item.type} - {item.timestamp}\n\n{item.analysis}\n\n"
+
+
+def iter_json(messages, image_analyses=()):
+    """Documento JSON escrito elemento por elemento"""
+    yield '{"exported_at": '
+    yield json.dumps(datetime.now().isoformat(timespec="seconds"))
+    yield ', "messages": ['
+    for idx, m in enumerate(messages):
+        yield (", " if idx else "") + json.dumps({
+            "role": m.role,
+            "content": m.content,
+            "timestamp": _format_time(m.timestamp),
+            "source_pages": [page + 1 for page in m.sources],
+        }, ensure_ascii=False)
+    yield '], "image_analyses": ['
+    for idx, item in enumerate(image_analyses):
+        yield (", " if idx else "") + json.dumps({
+            "type": item.type,
+            "timestamp": item.timestamp,
+            "analysis": item.analysis,
+        }, ensure_ascii=False)
+    yield "]}\n"
+
+
+# ==========================================
+# PDF MÍNIMO (HELVETICA, WINANSI)
+# ==========================================
+
+PDF_PAGE_WIDTH = 612
+PDF_PAGE_HEIGHT = 792
+PDF_MARGIN = 50
+PDF_FONT_SIZE = 10
+PDF_LEADING = 14
+PDF_WRAP = 95
+PDF_LINES_PER_PAGE = (PDF_PAGE_HEIGHT - 2 * PDF_MARGIN) // PDF_LEADING
+
+
+def _pdf_escape(line):
+    # Helvetica estándar solo cubre latin-1; los emojis se descartan
+    line = line.encode("latin-1", "ignore").decode("latin-1")
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _pdf_lines(text_chunks):
+    for chunk in text_chunks:
+        for paragraph in chunk.split("\n"):
+            wrapped = textwrap.wrap(paragraph, PDF_WRAP) or [""]
+            yield from wrapped
+
+
+def iter_pdf(messages, image_analyses=()):
+    """PDF de texto generado página por página"""
+    offsets = {}
+    position = 0
+
+    def emit(obj_id, body):
+        nonlocal position
+        offsets[obj_id] = position
+        data = f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n"
+        position += len(data)
+        return data
+
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    position += len(header)
+    yield header
+    yield emit(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    yield emit(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+                  b"/Encoding /WinAnsiEncoding >>")
+
+    page_ids = []
+    next_id = 4
+    page_lines = []
+
+    def flush_page():
+        nonlocal next_id
+        text = "".join(f"({_pdf_escape(line)}) Tj T*\n" for line in page_lines)
+        stream = (
+            f"BT /F1 {PDF_FONT_SIZE} Tf {PDF_LEADING} TL "
+            f"{PDF_MARGIN} {PDF_PAGE_HEIGHT - PDF_MARGIN} Td\n{text}ET"
+        ).encode("latin-1")
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        page_ids.append(page_id)
+        page_lines.clear()
+        return (
+            emit(content_id, f"<< /Length {len(stream)} >>\nstream\n".encode()
+                 + stream + b"\nendstream")
+            + emit(page_id, (
+                f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PDF_PAGE_WIDTH} {PDF_PAGE_HEIGHT}] "
+                f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+            ).encode())
+        )
+
+    for line in _pdf_lines(iter_txt(messages, image_analyses)):
+        page_lines.append(line)
+        if len(page_lines) >= PDF_LINES_PER_PAGE:
+            yield flush_page()
+    if page_lines or not page_ids:
+        yield flush_page()
+
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    yield emit(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode())
+
+    xref_position = position
+    xref = [f"xref\n0 {next_id}\n", "0000000000 65535 f \n"]
+    xref += [f"{offsets[obj_id]:010d} 00000 n \n" for obj_id in range(1, next_id)]
+    xref.append(f"trailer\n<< /Size {next_id} /Root 1 0 R >>\nstartxref\n{xref_position}\n%%EOF\n")
+    yield "".join(xref).encode()
+
+
+# ==========================================
+# REGISTRO DE FORMATOS
+# ==========================================
+
+EXPORT_FORMATS = {
+    "TXT": ("txt", "text/plain", iter_txt),
+    "Markdown": ("md", "text/markdown", iter_markdown),
+    "JSON": ("json", "application/json", iter_json),
+    "PDF": ("pdf", "application/pdf", iter_pdf),
+}
+
+
+def build_export(fmt, messages, image_analyses=()):
+    """Consume el generador del formato en un buffer; regresa (buffer, ext, mime)"""
+    ext, mime, generator = EXPORT_FORMATS[fmt]
+    buffer = io.BytesIO()
+    for chunk in generator(messages, image_analyses):
+        buffer.write(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+    buffer.seek(0)
+    return buffer, ext, mime
+
+
+def export_data(fmt, messages, image_analyses=tuple):
+    """Callable sin argumentos para st.download_button(data=...): genera el archivo al hacer clic
+
+    messages e image_analyses son funciones que devuelven los registros (p. ej. history.iter_all);
+    se recorren en ese momento, en el hilo de la descarga y no en el del script
+    """
+    def build():
+        return build_export(fmt, messages(), image_analyses())[0]
+
+    return build
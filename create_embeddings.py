@@ -1,14 +1,74 @@
 """
 Crea embeddings con Hugging Face (gratis, sin límites)
+Cada corrida genera una versión nueva en indices/ y la publica al terminar;
+los servidores en marcha la cargan sin reiniciar
+
+Uso:
+    python create_embeddings.py                      # chunker estructural (por defecto)
+    python create_embeddings.py --chunker recursivo  # división anterior (2000/200)
+    python create_embeddings.py --profile exact-ish  # perfil HNSW (ver index_profiles.py)
+    python create_embeddings.py --compress pca128 --rescore-dtype int8   # índice reducido + reordenamiento
+    python create_embeddings.py --retune fast        # copia la versión activa con otro search_ef
 """
 
+import argparse
+import os
+import sys
+import uuid
+
+import numpy as np
+
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import Chroma
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
 
+from chunker import chunk_report, structural_chunks
+from embedding_compression import RESCORE_DTYPES, ROW_KEY, Projection, parse_spec, save_compression
+from index_manager import current_index_dir, new_version_dir, prune_versions, publish_version
+from index_profiles import DEFAULT_PROFILE, HNSW_PROFILES, collection_metadata, retune_copy, write_profile
+from page_previews import build_previews
+
 PDF_PATH = "guia_sop.pdf"
 
+
+def dir_size_mb(path):
+    if not path or not os.path.isdir(path):
+        return 0.0
+    total = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _dirs, files in os.walk(path) for name in files
+    )
+    return total / 2**20
+
+
+parser = argparse.ArgumentParser(description="Crea una versión nueva del índice de la guía")
+parser.add_argument("--chunker", choices=["estructural", "recursivo"], default="estructural")
+parser.add_argument("--profile", choices=list(HNSW_PROFILES), default=DEFAULT_PROFILE,
+                    help="Parámetros HNSW del índice (M, construction_ef, search_ef)")
+parser.add_argument("--compress", default="none",
+                    help="Vectores del HNSW: none, pca<d> o rp<d> (ver evaluate_compression.py)")
+parser.add_argument("--rescore-dtype", choices=RESCORE_DTYPES, default="float32",
+                    help="Tipo de los vectores completos para reordenar (solo con --compress)")
+parser.add_argument("--retune", choices=list(HNSW_PROFILES),
+                    help="No reindexa: publica una copia de la versión activa con el search_ef del perfil")
+args = parser.parse_args()
+parse_spec(args.compress)
+
+if args.retune:
+    # Chroma guarda search_ef en la colección: se cambia en una copia y se publica como versión nueva,
+    # así las apps que usan la versión activa no ven el cambio hasta recargar
+    source_dir = current_index_dir()
+    if source_dir is None:
+        sys.exit("❌ No hay una versión publicada en indices/ (ejecuta create_embeddings.py primero)")
+    version_dir = new_version_dir()
+    print(f"🎛️ Copiando {source_dir} → {version_dir} con search_ef del perfil {args.retune}...")
+    if not retune_copy(source_dir, version_dir, args.retune):
+        sys.exit("❌ chromadb no aceptó el cambio de search_ef; la versión activa sigue igual")
+    prune_versions(protect=[version_dir])
+    print(f"✅ Versión {publish_version(version_dir)} publicada (indices/CURRENT)")
+    sys.exit(0)
+
 print("📖 Cargando PDF...")
 loader = PyPDFLoader(PDF_PATH)
 documents = loader.load()
@@ -24,9 +84,18 @@ text_splitter = RecursiveCharacterTextSplitter(
     chunk_overlap=200,
     separators=["\n\n", "\n", ". ", " ", ""]
 )
-chunks = text_splitter.split_documents(documents)
+recursive_chunks = text_splitter.split_documents(documents)
+page_chunks, chunk_stats = structural_chunks(documents)
+
+before, after = chunk_report(recursive_chunks), chunk_report(page_chunks)
+print(f"   recursivo:   {before['chunks']} chunks, {before['total_chars']:,} caracteres "
+      f"(media {before['avg_chars']:.0f})")
+print(f"   estructural: {after['chunks']} chunks, {after['total_chars']:,} caracteres "
+      f"(media {after['avg_chars']:.0f}; sin {chunk_stats['reference_pages']} páginas de referencias, "
+      f"{chunk_stats['duplicates']} bloques repetidos)")
 
-print(f"✅ {len(chunks)} chunks")
+chunks = page_chunks if args.chunker == "estructural" else recursive_chunks
+print(f"✅ {len(chunks)} chunks ({args.chunker})")
 
 print("🧠 Creando embeddings con Hugging Face...")
 print("   (Primera vez descarga modelo ~500MB - puede tardar)")
@@ -37,13 +106,58 @@ embeddings = HuggingFaceEmbeddings(
     encode_kwargs={'normalize_embeddings': True}
 )
 
-print("💾 Creando vectorstore...")
-vectorstore = Chroma.from_documents(
-    documents=chunks,
-    embedding=embeddings,
-    persist_directory="./chroma_db_sop",
-    collection_name="sop_medical_guide"
-)
+version_dir = new_version_dir()
+
+print(f"💾 Creando vectorstore en {version_dir} (perfil HNSW {args.profile})...")
+if args.compress == "none":
+    vectorstore = Chroma.from_documents(
+        documents=chunks,
+        embedding=embeddings,
+        persist_directory=version_dir,
+        collection_name="sop_medical_guide",
+        collection_metadata=collection_metadata(args.profile)
+    )
+else:
+    # Se codifica una sola vez: el HNSW recibe la proyección y los completos van a disco
+    texts = [c.page_content for c in chunks]
+    full_vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    projection = Projection.fit(full_vectors, args.compress)
+    reduced = projection.transform(full_vectors)
+    save_compression(version_dir, projection, full_vectors, args.rescore_dtype)
+
+    vectorstore = Chroma(
+        persist_directory=version_dir,
+        collection_name="sop_medical_guide",
+        embedding_function=embeddings,
+        collection_metadata=collection_metadata(args.profile)
+    )
+    metadatas = [{**c.metadata, ROW_KEY: i} for i, c in enumerate(chunks)]
+    ids = [str(uuid.uuid4()) for _ in chunks]
+    for start in range(0, len(chunks), 4000):
+        stop = start + 4000
+        vectorstore._collection.add(
+            ids=ids[start:stop],
+            embeddings=reduced[start:stop].tolist(),
+            documents=texts[start:stop],
+            metadatas=metadatas[start:stop],
+        )
+    print(f"   {args.compress}: {full_vectors.shape[1]} → {projection.dims} dimensiones en el HNSW; "
+          f"reordenamiento con vectores {args.rescore_dtype}")
+write_profile(version_dir, args.profile)
+
+# Miniaturas y fragmentos de las páginas citables: se pagan aquí, no en cada respuesta
+print("🖼️ Generando vistas previas de páginas...")
+previews = build_previews(version_dir, chunks, PDF_PATH)
+print(f"   {previews['pages']} páginas, {previews['thumbnails']} miniaturas ({previews['bytes'] / 1024:.0f} KB)")
+
+previous_dir = current_index_dir(fallback="./chroma_db_sop")
+print(f"📦 Índice: {dir_size_mb(previous_dir):.2f} MB antes → {dir_size_mb(version_dir):.2f} MB ahora")
+
+# Antes de publicar: la versión activa sigue protegida por CURRENT mientras las apps cambian de versión
+removed = prune_versions(protect=[version_dir])
+if removed:
+    print(f"🧹 {len(removed)} versiones antiguas o sin publicar eliminadas")
 
-print("✅ ¡LISTO! Vectorstore guardado en ./chroma_db_sop")
+version = publish_version(version_dir)
+print(f"✅ ¡LISTO! Versión {version} publicada (indices/CURRENT)")
 print("\nAhora ejecuta: streamlit run bot_sop.py")
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+Micro-batching de embeddings de consulta
+Junta las consultas concurrentes durante unos milisegundos y las codifica en un solo lote
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+from metrics import METRICS
+
+# Ventana de espera para juntar consultas (0 = sin micro-batching)
+EMBED_BATCH_WINDOW_MS = float(os.getenv("SOP_EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_MAX_BATCH = int(os.getenv("SOP_EMBED_MAX_BATCH", "32"))
+
+
+class BatchingEmbeddings(Embeddings):
+    """Envuelve unos embeddings: embed_query se agrupa, embed_documents pasa directo"""
+
+    def __init__(self, base, window_ms=EMBED_BATCH_WINDOW_MS, max_batch=EMBED_MAX_BATCH):
+        self.base = base
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._queue = queue.SimpleQueue()
+        self._worker = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.max_seen = 0
+
+    def __getattr__(self, name):
+        # model_name, encode_kwargs, etc. del modelo envuelto
+        if name == "base":
+            raise AttributeError(name)
+        return getattr(self.base, name)
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._start_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._run, name="sop-embed-batcher", daemon=True
+                    )
+                    self._worker.start()
+
+    def _collect(self):
+        """Bloquea hasta la primera consulta y junta las que lleguen dentro de la ventana"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                with METRICS.stage("query_encoding_batch"):
+                    vectors = self.base.embed_documents(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+            self._record(len(batch))
+
+    def _record(self, size):
+        METRICS.observe("embedding_batch_size", size)
+        with self._stats_lock:
+            self.batches += 1
+            self.queries += size
+            self.max_seen = max(self.max_seen, size)
+
+    def stats(self):
+        """Tamaños de lote conseguidos desde el arranque"""
+        with self._stats_lock:
+            return {
+                "batches": self.batches,
+                "queries": self.queries,
+                "mean_batch": self.queries / self.batches if self.batches else 0.0,
+                "max_batch": self.max_seen,
+            }
+
+    def embed_query(self, text):
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def embed_documents(self, texts):
+        return self.base.embed_documents(texts)
@@ -0,0 +1,172 @@
+"""
+Compresión de embeddings del índice vectorial
+El HNSW guarda vectores reducidos (PCA o proyección aleatoria); los vectores completos quedan
+en disco (float32, float16 o int8) y solo se leen los candidatos para reordenar el top-k final
+"""
+
+import json
+import os
+import re
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+COMPRESSION_FILE = "compression.json"
+PROJECTION_FILE = "projection.npz"
+FULL_VECTORS_FILE = "full_vectors.npy"
+ROW_KEY = "vec_row"
+
+# Candidatos del HNSW reducido por cada resultado final
+RESCORE_OVERSAMPLE = int(os.getenv("SOP_RESCORE_OVERSAMPLE", "4"))
+
+RESCORE_DTYPES = ("float32", "float16", "int8")
+
+
+def parse_spec(spec):
+    """'pca128', 'rp96' o 'none' -> (método, dimensiones)"""
+    if spec in (None, "", "none"):
+        return None, None
+    match = re.fullmatch(r"(pca|rp)(\d+)", spec)
+    if not match:
+        raise ValueError(f"Compresión desconocida: {spec} (usa pca<d>, rp<d> o none)")
+    return match.group(1), int(match.group(2))
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# ==========================================
+# PROYECCIÓN Y CUANTIZACIÓN
+# ==========================================
+
+class Projection:
+    """x -> normalizar((x - media) @ matriz); con vectores normalizados, l2 sigue ordenando como coseno"""
+
+    def __init__(self, method, mean, matrix):
+        self.method = method
+        self.mean = mean.astype(np.float32)
+        self.matrix = matrix.astype(np.float32)
+
+    @property
+    def dims(self):
+        return self.matrix.shape[1]
+
+    @classmethod
+    def fit(cls, vectors, spec, seed=0):
+        method, dims = parse_spec(spec)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if dims > vectors.shape[1]:
+            raise ValueError(f"{spec}: más dimensiones que los embeddings ({vectors.shape[1]})")
+        if method == "pca":
+            mean = vectors.mean(axis=0)
+            # Con menos chunks que dimensiones, PCA no puede pasar del rango de los datos
+            if dims > min(vectors.shape) - 1:
+                raise ValueError(f"{spec}: PCA necesita más de {dims} chunks (hay {len(vectors)})")
+            _, _, vt = np.linalg.svd(vectors - mean, full_matrices=False)
+            matrix = vt[:dims].T
+        else:
+            rng = np.random.default_rng(seed)
+            mean = np.zeros(vectors.shape[1], dtype=np.float32)
+            matrix = rng.normal(0.0, 1.0 / np.sqrt(dims), (vectors.shape[1], dims))
+        return cls(method, mean, matrix)
+
+    def transform(self, vectors):
+        return _normalize((np.asarray(vectors, dtype=np.float32) - self.mean) @ self.matrix)
+
+
+def quantize(vectors, dtype):
+    """Vectores completos para el reordenamiento; int8 con escala por dimensión"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == "int8":
+        scale = np.maximum(np.abs(vectors).max(axis=0), 1e-12) / 127.0
+        return np.round(vectors / scale).astype(np.int8), scale.astype(np.float32)
+    return vectors.astype(dtype), None
+
+
+def dequantize(stored, scale):
+    stored = np.asarray(stored, dtype=np.float32)
+    return stored * scale if scale is not None else stored
+
+
+# ==========================================
+# ÍNDICE COMPRIMIDO EN DISCO
+# ==========================================
+
+def save_compression(index_dir, projection, full_vectors, rescore_dtype="float32"):
+    """Guarda proyección + vectores completos (fila i = metadata vec_row i)"""
+    stored, scale = quantize(full_vectors, rescore_dtype)
+    np.save(os.path.join(index_dir, FULL_VECTORS_FILE), stored)
+    arrays = {"mean": projection.mean, "matrix": projection.matrix}
+    if scale is not None:
+        arrays["scale"] = scale
+    np.savez(os.path.join(index_dir, PROJECTION_FILE), **arrays)
+    with open(os.path.join(index_dir, COMPRESSION_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "method": projection.method,
+            "dims": projection.dims,
+            "full_dims": int(full_vectors.shape[1]),
+            "rescore_dtype": rescore_dtype,
+            "rows": int(full_vectors.shape[0]),
+        }, f, indent=2)
+
+
+class CompressedIndex:
+    """Proyección de consultas + reordenamiento con los vectores completos (memory-mapped)"""
+
+    def __init__(self, projection, full_vectors, scale, config):
+        self.projection = projection
+        self.full_vectors = full_vectors
+        self.scale = scale
+        self.config = config
+
+    @classmethod
+    def load(cls, index_dir):
+        """None si el índice no está comprimido"""
+        try:
+            with open(os.path.join(index_dir, COMPRESSION_FILE), encoding="utf-8") as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            return None
+        with np.load(os.path.join(index_dir, PROJECTION_FILE)) as data:
+            projection = Projection(config["method"], data["mean"], data["matrix"])
+            scale = data["scale"] if "scale" in data.files else None
+        full_vectors = np.load(os.path.join(index_dir, FULL_VECTORS_FILE), mmap_mode="r")
+        return cls(projection, full_vectors, scale, config)
+
+    def rescore(self, full_query, rows, k):
+        """Índices (en `rows`) de los k candidatos más cercanos con vectores completos"""
+        candidates = dequantize(self.full_vectors[np.asarray(rows)], self.scale)
+        scores = candidates @ np.asarray(full_query, dtype=np.float32)
+        return np.argsort(-scores, kind="stable")[:k]
+
+
+class ProjectedEmbeddings(Embeddings):
+    """Embeddings en el espacio reducido del índice (lo que ve Chroma); base da los completos"""
+
+    def __init__(self, base, compressed):
+        self.base = base
+        self.compressed = compressed
+
+    def __getattr__(self, name):
+        if name in ("base", "compressed"):
+            raise AttributeError(name)
+        return getattr(self.base, name)
+
+    def embed_documents(self, texts):
+        return self.compressed.projection.transform(self.base.embed_documents(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.compressed.projection.transform(self.base.embed_query(text)).tolist()
+
+
+def compressed_search(vectorstore, full_query, k, oversample=RESCORE_OVERSAMPLE):
+    """Candidatos en el HNSW reducido -> top-k reordenado con los vectores completos"""
+    compressed = vectorstore.embeddings.compressed
+    reduced = compressed.projection.transform(full_query).tolist()
+    docs = vectorstore.similarity_search_by_vector(reduced, k=k * max(oversample, 1))
+    if not docs:
+        return docs
+    rows = [d.metadata[ROW_KEY] for d in docs]
+    return [docs[i] for i in compressed.rescore(full_query, rows, k)]
@@ -0,0 +1,180 @@
+"""
+Evaluación de la compresión de embeddings: tamaño del índice, memoria y recall@k por configuración
+Búsqueda exacta en NumPy para aislar el efecto de la compresión (el del HNSW lo mide sweep_hnsw.py)
+
+Uso:
+    python evaluate_compression.py
+    python evaluate_compression.py --specs none pca128 pca64 rp128 --rescore none float32 int8 --k 4
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmark import BENCHMARK_QUERIES
+from embedding_compression import (
+    RESCORE_DTYPES, RESCORE_OVERSAMPLE, ROW_KEY, CompressedIndex, Projection, dequantize, quantize,
+)
+from evaluate_retrieval import GOLDEN_SET_PATH, RESULTS_DIR, load_golden_set, score_query
+from index_profiles import DEFAULT_PROFILE, get_profile
+
+BYTES = {"float32": 4, "float16": 2, "int8": 1}
+
+
+# ==========================================
+# DATOS
+# ==========================================
+
+def load_index_vectors(index_dir):
+    """Vectores completos y páginas del índice (si está comprimido, los del reordenamiento)"""
+    from sop_engine import load_embeddings, load_vectorstore
+
+    vectorstore = load_vectorstore(index_dir, load_embeddings())
+    data = vectorstore._collection.get(include=["embeddings", "metadatas"])
+    pages = [m.get("page") for m in data["metadatas"]]
+    compressed = CompressedIndex.load(index_dir)
+    if compressed is None:
+        return np.asarray(data["embeddings"], dtype=np.float32), pages, vectorstore.embeddings
+    order = np.argsort([m[ROW_KEY] for m in data["metadatas"]])
+    vectors = dequantize(compressed.full_vectors, compressed.scale)
+    return vectors, [pages[i] for i in order], vectorstore.embeddings.base
+
+
+def top_k(scores, k):
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+# ==========================================
+# CONFIGURACIONES
+# ==========================================
+
+def evaluate_setting(spec, rescore, corpus, queries, truth, k, oversample):
+    """Top-k de una configuración: búsqueda en el espacio reducido (+ reordenamiento opcional)"""
+    start = time.perf_counter()
+    if spec == "none":
+        search_vectors, search_queries, dims = corpus, queries, corpus.shape[1]
+    else:
+        projection = Projection.fit(corpus, spec)
+        search_vectors, search_queries, dims = projection.transform(corpus), projection.transform(queries), projection.dims
+    fit_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if rescore == "none":
+        found = top_k(search_queries @ search_vectors.T, k)
+    else:
+        candidates = top_k(search_queries @ search_vectors.T, k * oversample)
+        stored, scale = quantize(corpus, rescore)
+        found = np.empty((len(queries), k), dtype=np.int64)
+        for i, rows in enumerate(candidates):
+            scores = dequantize(stored[rows], scale) @ queries[i]
+            found[i] = rows[np.argsort(-scores, kind="stable")[:k]]
+    search_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    recall = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+    return {"spec": spec, "rescore": rescore, "dims": int(dims), "fit_s": fit_s,
+            "search_ms": search_ms, f"recall@{k}": recall}, found
+
+
+def size_report(dims, full_dims, rescore, rows, m):
+    """Bytes por vector: HNSW (vectores float32 + enlaces de nivel 0) en RAM; reordenamiento en disco"""
+    hnsw = dims * 4 + 2 * m * 4
+    rescore_bytes = 0 if rescore == "none" else full_dims * BYTES[rescore]
+    projection = 0 if dims == full_dims else full_dims * (dims + 1) * 4
+    return {
+        "ram_bytes_per_vector": hnsw,
+        "disk_bytes_per_vector": hnsw + rescore_bytes,
+        "ram_mb": (rows * hnsw + projection) / 2**20,
+        "disk_mb": (rows * (hnsw + rescore_bytes) + projection) / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evalúa la compresión de embeddings del índice")
+    parser.add_argument("--index", default=None, help="Directorio del índice (por defecto indices/CURRENT)")
+    parser.add_argument("--specs", nargs="+", default=["none", "pca256", "pca128", "pca64", "rp192", "rp128"])
+    parser.add_argument("--rescore", nargs="+", choices=("none",) + RESCORE_DTYPES,
+                        default=["none", "float32", "int8"])
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--oversample", type=int, default=RESCORE_OVERSAMPLE)
+    parser.add_argument("--extra-queries", type=int, default=200)
+    parser.add_argument("--project-rows", type=int, default=1_000_000,
+                        help="Tamaño de corpus para estimar RAM y disco")
+    parser.add_argument("--golden", default=GOLDEN_SET_PATH)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    from index_manager import current_index_dir
+    from sop_engine import VECTORSTORE_DIR
+
+    index_dir = args.index or current_index_dir(fallback=VECTORSTORE_DIR)
+    corpus, pages, embeddings = load_index_vectors(index_dir)
+    golden = load_golden_set(args.golden)
+
+    questions = [q["question"] for q in golden["queries"]] + BENCHMARK_QUERIES
+    queries = np.asarray(embeddings.embed_documents(questions), dtype=np.float32)
+    rng = np.random.default_rng(1)
+    extra = min(args.extra_queries, len(corpus))
+    noisy = corpus[rng.choice(len(corpus), size=extra, replace=False)]
+    noisy = noisy + rng.normal(0.0, 0.05, noisy.shape).astype(np.float32)
+    queries = np.vstack([queries, noisy / np.linalg.norm(noisy, axis=1, keepdims=True)])
+    truth = top_k(queries @ corpus.T, args.k)
+    print(f"📐 {len(corpus)} vectores de {corpus.shape[1]} dimensiones ({index_dir}); {len(queries)} consultas")
+
+    m = get_profile(DEFAULT_PROFILE)["hnsw:M"]
+    rows = []
+    for spec in args.specs:
+        for rescore in args.rescore:
+            if spec == "none" and rescore != "none":
+                continue
+            try:
+                row, found = evaluate_setting(spec, rescore, corpus, queries, truth, args.k, args.oversample)
+            except ValueError as e:
+                print(f"⚠️ {spec}: {e}")
+                break
+            # Calidad real: páginas relevantes del golden set
+            per_query = [
+                score_query([pages[i] for i in found[n]], item["relevant_pages"])
+                for n, item in enumerate(golden["queries"])
+            ]
+            row["golden_hit@k"] = statistics.fmean(q["hit"] for q in per_query)
+            row["golden_mrr"] = statistics.fmean(q["rr"] for q in per_query)
+            row["corpus"] = size_report(row["dims"], corpus.shape[1], rescore, len(corpus), m)
+            row["projected"] = size_report(row["dims"], corpus.shape[1], rescore, args.project_rows, m)
+            rows.append(row)
+
+    print(f"\n{'config':<16} {'dims':>5} {f'recall@{args.k}':>9} {'hit@k':>6} {'MRR':>6} "
+          f"{'B/vec RAM':>10} {'B/vec disco':>11} {f'RAM {args.project_rows:,}':>16} {'ms/q':>6}")
+    for r in rows:
+        label = r["spec"] if r["rescore"] == "none" else f"{r['spec']}+{r['rescore']}"
+        print(f"{label:<16} {r['dims']:>5} {r[f'recall@{args.k}']:>9.3f} {r['golden_hit@k']:>6.3f} "
+              f"{r['golden_mrr']:>6.3f} {r['corpus']['ram_bytes_per_vector']:>10} "
+              f"{r['corpus']['disk_bytes_per_vector']:>11} {r['projected']['ram_mb']:>13,.0f} MB "
+              f"{r['search_ms']:>6.2f}")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"compression_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "index": index_dir,
+            "corpus_size": int(len(corpus)),
+            "k": args.k,
+            "oversample": args.oversample,
+            "hnsw_profile": DEFAULT_PROFILE,
+            "results": rows,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"✅ Resultados en {output}")
+
+
+if __name__ == "__main__":
+    main()
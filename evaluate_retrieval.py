@@ -0,0 +1,152 @@
+"""
+Evaluación de la recuperación contra el golden set de la guía ESHRE
+recall@k, hit@k, MRR, latencia y tamaño de contexto por configuración
+
+Uso:
+    python evaluate_retrieval.py --index ./chroma_db_sop --k 2 4 6
+    python evaluate_retrieval.py --index ./chroma_db_sop ./chroma_db_v2@intfloat/multilingual-e5-small --k 4
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+from datetime import datetime
+
+GOLDEN_SET_PATH = "./eval/golden_set_v1.json"
+RESULTS_DIR = "./eval/results"
+
+# Margen de calidad aceptado al recomendar la configuración más barata
+QUALITY_TOLERANCE = 0.02
+
+
+def load_golden_set(path=GOLDEN_SET_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_index_spec(spec):
+    """'ruta' o 'ruta@modelo_de_embeddings'"""
+    path, _, model_name = spec.partition("@")
+    return path, model_name or None
+
+
+# ==========================================
+# MÉTRICAS
+# ==========================================
+
+def score_query(retrieved_pages, relevant_pages):
+    """recall, hit y reciprocal rank de una consulta"""
+    relevant = set(relevant_pages)
+    found = relevant & set(retrieved_pages)
+    reciprocal_rank = 0.0
+    for rank, page in enumerate(retrieved_pages, start=1):
+        if page in relevant:
+            reciprocal_rank = 1.0 / rank
+            break
+    return {
+        "recall": len(found) / len(relevant),
+        "hit": 1.0 if found else 0.0,
+        "rr": reciprocal_rank,
+    }
+
+
+def evaluate(search_fn, golden, k):
+    """Corre el golden set con search_fn(pregunta, k) -> docs"""
+    per_query = []
+    for item in golden["queries"]:
+        start = time.perf_counter()
+        docs = search_fn(item["question"], k)
+        latency = time.perf_counter() - start
+        pages = [d.metadata.get("page") for d in docs]
+        per_query.append({
+            "id": item["id"],
+            "retrieved_pages": pages,
+            "latency_ms": latency * 1000,
+            "context_chars": sum(len(d.page_content) for d in docs),
+            **score_query(pages, item["relevant_pages"]),
+        })
+
+    latencies = sorted(q["latency_ms"] for q in per_query)
+    return {
+        "k": k,
+        "recall@k": statistics.fmean(q["recall"] for q in per_query),
+        "hit@k": statistics.fmean(q["hit"] for q in per_query),
+        "mrr": statistics.fmean(q["rr"] for q in per_query),
+        "latency_p50_ms": latencies[len(latencies) // 2],
+        "latency_p95_ms": latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)],
+        "avg_context_chars": statistics.fmean(q["context_chars"] for q in per_query),
+        "queries": per_query,
+    }
+
+
+def recommend(rows):
+    """Configuración con menos contexto que mantiene la mejor calidad (± tolerancia)"""
+    best_hit = max(r["hit@k"] for r in rows)
+    best_mrr = max(r["mrr"] for r in rows)
+    candidates = [
+        r for r in rows
+        if r["hit@k"] >= best_hit - QUALITY_TOLERANCE and r["mrr"] >= best_mrr - QUALITY_TOLERANCE
+    ]
+    return min(candidates, key=lambda r: (r["avg_context_chars"], r["latency_p50_ms"]))
+
+
+# ==========================================
+# MAIN
+# ==========================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Evalúa configuraciones de search_context")
+    parser.add_argument("--index", nargs="+", default=["./chroma_db_sop"],
+                        help="Directorios de índice; 'ruta@modelo' para otro modelo de embeddings")
+    parser.add_argument("--k", nargs="+", type=int, default=[2, 4, 6, 8])
+    parser.add_argument("--golden", default=GOLDEN_SET_PATH)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    from sop_engine import EMBEDDING_MODEL, SOPEngine, load_embeddings, load_vectorstore
+
+    golden = load_golden_set(args.golden)
+    print(f"📋 Golden set v{golden['version']}: {len(golden['queries'])} preguntas")
+
+    rows = []
+    for spec in args.index:
+        path, model_name = parse_index_spec(spec)
+        embeddings = load_embeddings(model_name or EMBEDDING_MODEL)
+        engine = SOPEngine(load_vectorstore(path, embeddings), model=None)
+        engine.search_context(golden["queries"][0]["question"])  # calentamiento
+
+        for k in args.k:
+            result = evaluate(lambda q, k: engine.search_context(q, k=k), golden, k)
+            result["index"] = path
+            result["embedding_model"] = model_name or EMBEDDING_MODEL
+            rows.append(result)
+
+    print(f"\n{'índice':<28} {'k':>3} {'recall@k':>9} {'hit@k':>7} {'MRR':>6} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'contexto':>9}")
+    for r in rows:
+        print(f"{r['index'][-28:]:<28} {r['k']:>3} {r['recall@k']:>9.3f} {r['hit@k']:>7.3f} "
+              f"{r['mrr']:>6.3f} {r['latency_p50_ms']:>8.1f} {r['latency_p95_ms']:>8.1f} "
+              f"{r['avg_context_chars']:>9.0f}")
+
+    best = recommend(rows)
+    print(f"\n💡 Recomendada: {best['index']} con k={best['k']} "
+          f"(hit@k {best['hit@k']:.3f}, MRR {best['mrr']:.3f}, {best['avg_context_chars']:.0f} caracteres)")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"retrieval_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "golden_set_version": golden["version"],
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "results": rows,
+            "recommended": {"index": best["index"], "k": best["k"]},
+        }, f, ensure_ascii=False, indent=2)
+    print(f"✅ Resultados en {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Exporta los modelos de los notebooks como artefactos compactos y versionados
+Regresión logística (12 variables del RFE) + random forest, listos para risk_model.RiskScorer
+
+Uso:
+    python export_risk_model.py              # siguiente versión en models/artifacts
+    python export_risk_model.py --version 3
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from pcos_data import DATASET_PATH, load_pcos
+from risk_model import ARTIFACTS_DIR, FEATURE_SPECS, RISK_FEATURES, RiskScorer, artifact_paths, latest_version
+
+# Umbral del notebook de regresión logística (prioriza sensibilidad)
+LOGISTIC_THRESHOLD = 0.1
+
+
+def flatten_forest(forest):
+    """Árboles de sklearn -> arreglos planos con índices globales"""
+    left, right, feature, threshold, proba, roots = [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+        roots.append(offset)
+        left.append(np.where(is_leaf, -1, tree.children_left + offset))
+        right.append(np.where(is_leaf, -1, tree.children_right + offset))
+        feature.append(tree.feature)
+        threshold.append(tree.threshold)
+        counts = tree.value[:, 0, :]
+        proba.append(counts[:, 1] / counts.sum(axis=1))
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+    return {
+        "rf_left": np.concatenate(left).astype(np.int32),
+        "rf_right": np.concatenate(right).astype(np.int32),
+        "rf_feature": np.concatenate(feature).astype(np.int16),
+        "rf_threshold": np.concatenate(threshold).astype(np.float64),
+        "rf_proba": np.concatenate(proba).astype(np.float32),
+        "rf_roots": np.array(roots, dtype=np.int32),
+        "rf_max_depth": np.array(max_depth, dtype=np.int16),
+    }
+
+
+def train(data):
+    """Entrena sobre la caché columnar (pcos_data.PCOSData), ya limpia"""
+    X = data.matrix(RISK_FEATURES)
+    y = data.target
+    fill_values = data.fill_series(RISK_FEATURES)
+
+    # Regresión logística como en el notebook: 70/30 estratificado, max_iter=20000
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.3, random_state=42, stratify=y)
+    lr = LogisticRegression(max_iter=20000)
+    lr.fit(X_train, y_train)
+    lr_proba = lr.predict_proba(X_test)[:, 1]
+
+    # Random forest como en el notebook: todos los datos y validación OOB
+    forest = RandomForestClassifier(n_jobs=1, oob_score=True, n_estimators=50, random_state=42)
+    forest.fit(X, y)
+
+    metrics = {
+        "logistic": {
+            "test_accuracy": accuracy_score(y_test, lr_proba >= 0.5),
+            "test_auc": roc_auc_score(y_test, lr_proba),
+            "test_accuracy_at_threshold": accuracy_score(y_test, lr_proba >= LOGISTIC_THRESHOLD),
+        },
+        "forest": {
+            "oob_accuracy": forest.oob_score_,
+            "oob_auc": roc_auc_score(y, forest.oob_decision_function_[:, 1]),
+        },
+    }
+    return lr, forest, fill_values, metrics
+
+
+def unknown_features(features):
+    """Variables que el formulario del panel no pide (FEATURE_SPECS)"""
+    return [f for f in features if f not in FEATURE_SPECS]
+
+
+def export(lr, forest, fill_values, metrics, version, source_hash, directory=ARTIFACTS_DIR, extra=None,
+           features=RISK_FEATURES, source_path=DATASET_PATH):
+    """Escribe pcos_risk_v<versión>.npz + .json (ambos modelos sobre las mismas `features`)
+
+    La app carga la última versión: un artefacto con variables fuera del formulario las puntuaría
+    con el valor de relleno del entrenamiento, así que no se publica
+    """
+    unknown = unknown_features(features)
+    if unknown:
+        raise ValueError(
+            f"El artefacto usa variables que el formulario no pide: {', '.join(unknown)}. "
+            "Agrégalas a FEATURE_SPECS (risk_model.py) antes de publicarlo"
+        )
+    os.makedirs(directory, exist_ok=True)
+    npz_path, json_path = artifact_paths(version, directory)
+
+    arrays = {
+        "fill_values": fill_values[features].to_numpy(dtype=np.float64),
+        "lr_coef": lr.coef_[0].astype(np.float64),
+        "lr_intercept": np.array(lr.intercept_[0], dtype=np.float64),
+        **flatten_forest(forest),
+    }
+    manifest = {
+        "version": version,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "features": list(features),
+        "source": {"path": source_path, "sha256": source_hash},
+        "sklearn_version": sklearn.__version__,
+        "logistic": {"threshold": LOGISTIC_THRESHOLD, "max_iter": lr.max_iter},
+        "forest": {"n_estimators": forest.n_estimators, "nodes": int(arrays["rf_left"].size)},
+        "metrics": metrics,
+        **(extra or {}),
+    }
+
+    np.savez_compressed(npz_path, **arrays)
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return npz_path, json_path
+
+
+def verify(scorer, lr, forest, X):
+    """Diferencia máxima entre el motor NumPy y sklearn"""
+    scores = scorer.score_batch(X)
+    return {
+        "logistic": float(np.abs(scores["logistic"] - lr.predict_proba(X)[:, 1]).max()),
+        "forest": float(np.abs(scores["forest"] - forest.predict_proba(X)[:, 1]).max()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta el modelo de riesgo de SOP")
+    parser.add_argument("--data", default=DATASET_PATH)
+    parser.add_argument("--version", type=int, default=None)
+    args = parser.parse_args()
+
+    try:
+        version = args.version or latest_version() + 1
+    except FileNotFoundError:
+        version = 1
+
+    data = load_pcos(args.data)
+    lr, forest, fill_values, metrics = train(data)
+    npz_path, json_path = export(
+        lr, forest, fill_values, metrics, version, data.manifest["source"]["sha256"], source_path=args.data
+    )
+
+    X = data.matrix(RISK_FEATURES)
+    diff = verify(RiskScorer.load(version), lr, forest, X)
+    print(f"✅ v{version}: {npz_path} ({os.path.getsize(npz_path) / 1024:.1f} KB) + {json_path}")
+    print(f"   Logística: AUC test {metrics['logistic']['test_auc']:.3f} · "
+          f"Random forest: OOB {metrics['forest']['oob_accuracy']:.3f}")
+    print(f"   Diferencia máx. vs sklearn: logística {diff['logistic']:.2e}, bosque {diff['forest']:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""
+Mensajes de error para el usuario
+Sin dependencias: lo comparten el motor, la API y el cliente ligero (api_client.py)
+"""
+
+
+def friendly_error(e):
+    """Mensaje para el usuario según el tipo de error de Gemini"""
+    error_str = str(e).lower()
+    
+    if "safety" in error_str or "block" in error_str:
+        return "⚠️ Mi sistema de seguridad bloqueó esta respuesta. Intenta reformular tu pregunta o consulta directamente con tu médico. 💜"
+    elif "quota" in error_str or "429" in error_str:
+        return "⏱️ He alcanzado mi límite de uso. Intenta en 1 minuto. 💜"
+    else:
+        return "❌ Error técnico. Intenta de nuevo. 💜"
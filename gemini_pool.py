@@ -0,0 +1,232 @@
+"""
+Pool de claves de Gemini
+Reparte chat y visión entre varias API keys/proyectos: cuota por minuto de cada clave, tasa de
+errores reciente y enfriamiento exponencial de las claves que responden 429
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Límite gratuito de Gemini por clave (peticiones por minuto)
+GEMINI_RPM_PER_KEY = int(os.getenv("SOP_GEMINI_RPM", "15"))
+QUOTA_WINDOW_SECONDS = 60.0
+# Una llamada se cuenta un poco más que la ventana: el servidor la registra al recibirla
+QUOTA_MARGIN = 0.05
+
+# Espera máxima por una clave libre antes de rendirse con un error de cuota
+POOL_MAX_WAIT_SECONDS = float(os.getenv("SOP_GEMINI_POOL_MAX_WAIT", "20"))
+
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 60.0
+ERROR_WINDOW = 20
+
+
+def load_api_keys():
+    """GOOGLE_API_KEYS (separadas por comas o espacios) o, si no hay, GOOGLE_API_KEY"""
+    raw = os.getenv("GOOGLE_API_KEYS") or os.getenv("GOOGLE_API_KEY") or ""
+    keys = []
+    for key in re.split(r"[,\s]+", raw):
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def key_label(index, key):
+    """Etiqueta para logs y métricas (nunca la clave completa)"""
+    return f"key{index + 1}-{key[-4:]}"
+
+
+def is_rate_limit(error):
+    text = str(error).lower()
+    return "429" in text or "quota" in text or "resource has been exhausted" in text
+
+
+class PoolExhaustedError(Exception):
+    """Ninguna clave con cuota dentro de la espera máxima (friendly_error lo trata como 429)"""
+
+    def __init__(self, wait_seconds):
+        super().__init__(f"429 Todas las claves de Gemini sin cuota (próxima libre en {wait_seconds:.0f}s)")
+
+
+class _KeyState:
+    def __init__(self, label):
+        self.label = label
+        self.calls = deque()
+        self.outcomes = deque(maxlen=ERROR_WINDOW)
+        self.cooldown_until = 0.0
+        self.strikes = 0
+        self.in_flight = 0
+        self.total = 0
+
+    def error_rate(self):
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class GeminiPool:
+    """Elige la clave más sana para cada llamada y registra el resultado"""
+
+    def __init__(self, labels, rpm=GEMINI_RPM_PER_KEY, window_seconds=QUOTA_WINDOW_SECONDS,
+                 max_wait=POOL_MAX_WAIT_SECONDS, clock=time.monotonic):
+        if not labels:
+            raise ValueError("El pool de Gemini necesita al menos una clave")
+        self.rpm = rpm
+        self.window = window_seconds
+        self.max_wait = max_wait
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys = {label: _KeyState(label) for label in labels}
+
+    @property
+    def labels(self):
+        return list(self._keys)
+
+    def _remaining(self, state, now):
+        while state.calls and now - state.calls[0] >= self.window * (1 + QUOTA_MARGIN):
+            state.calls.popleft()
+        return self.rpm - len(state.calls)
+
+    def _next_free(self, state, now):
+        """Segundos hasta que la clave vuelva a tener cuota"""
+        wait = max(state.cooldown_until - now, 0.0)
+        if self._remaining(state, now) <= 0:
+            wait = max(wait, state.calls[0] + self.window * (1 + QUOTA_MARGIN) - now)
+        return wait
+
+    def _try_acquire(self, exclude):
+        """(etiqueta, 0) si hay clave libre; (None, espera) si no"""
+        now = self._clock()
+        with self._lock:
+            candidates = [s for label, s in self._keys.items() if label not in exclude]
+            ready = [s for s in candidates if now >= s.cooldown_until and self._remaining(s, now) > 0]
+            if ready:
+                # Menos errores recientes, luego más cuota libre y menos llamadas en vuelo
+                best = min(ready, key=lambda s: (s.error_rate(), -self._remaining(s, now), s.in_flight))
+                best.calls.append(now)
+                best.in_flight += 1
+                best.total += 1
+                return best.label, 0.0
+            waits = [self._next_free(s, now) for s in candidates]
+        return None, min(waits, default=self.max_wait)
+
+    def acquire(self, exclude=()):
+        deadline = self._clock() + self.max_wait
+        while True:
+            label, wait = self._try_acquire(exclude)
+            if label is not None:
+                return label
+            if self._clock() + wait > deadline:
+                raise PoolExhaustedError(wait)
+            time.sleep(max(wait, 0.01))
+
+    async def aacquire(self, exclude=()):
+        deadline = self._clock() + self.max_wait
+        while True:
+            label, wait = self._try_acquire(exclude)
+            if label is not None:
+                return label
+            if self._clock() + wait > deadline:
+                raise PoolExhaustedError(wait)
+            await asyncio.sleep(max(wait, 0.01))
+
+    def release(self, label, error=None, seconds=None):
+        """Resultado de una llamada: 429 enfría la clave con backoff exponencial"""
+        now = self._clock()
+        with self._lock:
+            state = self._keys[label]
+            state.in_flight -= 1
+            state.outcomes.append(error is not None)
+            if error is None:
+                state.strikes = 0
+                result = "ok"
+            elif is_rate_limit(error):
+                state.strikes += 1
+                backoff = min(BACKOFF_BASE_SECONDS * 2 ** (state.strikes - 1), BACKOFF_MAX_SECONDS)
+                state.cooldown_until = now + backoff
+                result = "rate_limited"
+            else:
+                result = "error"
+        METRICS.incr("gemini_key_requests_total", key=label, result=result)
+        if seconds is not None:
+            METRICS.observe("gemini_key_seconds", seconds, key=label)
+        if result == "rate_limited":
+            logger.warning("429 en %s; en pausa %.0fs", label, backoff)
+
+    def stats(self):
+        now = self._clock()
+        with self._lock:
+            return [
+                {
+                    "key": s.label,
+                    "remaining": max(self._remaining(s, now), 0),
+                    "rpm": self.rpm,
+                    "error_rate": s.error_rate(),
+                    "cooldown_s": max(s.cooldown_until - now, 0.0),
+                    "in_flight": s.in_flight,
+                    "requests": s.total,
+                }
+                for s in self._keys.values()
+            ]
+
+
+class PooledModel:
+    """Misma interfaz que el modelo (generate_content / _async) sobre un modelo por clave
+
+    Un 429 se reintenta en otra clave; otros errores se propagan como antes
+    """
+
+    def __init__(self, pool, models):
+        self.pool = pool
+        self.models = models
+
+    @property
+    def _first(self):
+        return self.models[self.pool.labels[0]]
+
+    @property
+    def model_name(self):
+        return getattr(self._first, "model_name", "desconocido")
+
+    @property
+    def system_prefix(self):
+        return getattr(self._first, "system_prefix", None)
+
+    def generate_content(self, contents, **kwargs):
+        tried = set()
+        while True:
+            label = self.pool.acquire(exclude=tried)
+            start = time.perf_counter()
+            try:
+                response = self.models[label].generate_content(contents, **kwargs)
+            except Exception as e:
+                self.pool.release(label, e, time.perf_counter() - start)
+                tried.add(label)
+                if is_rate_limit(e) and len(tried) < len(self.models):
+                    continue
+                raise
+            self.pool.release(label, seconds=time.perf_counter() - start)
+            return response
+
+    async def generate_content_async(self, contents, **kwargs):
+        tried = set()
+        while True:
+            label = await self.pool.aacquire(exclude=tried)
+            start = time.perf_counter()
+            try:
+                response = await self.models[label].generate_content_async(contents, **kwargs)
+            except Exception as e:
+                self.pool.release(label, e, time.perf_counter() - start)
+                tried.add(label)
+                if is_rate_limit(e) and len(tried) < len(self.models):
+                    continue
+                raise
+            self.pool.release(label, seconds=time.perf_counter() - start)
+            return response
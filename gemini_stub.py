@@ -0,0 +1,233 @@
+"""
+Gemini local de pruebas
+Sustituto de genai.GenerativeModel con latencia, streaming y errores configurables
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+STUB_ANSWER = (
+    "¡Buena pregunta! 😊 Según la guía internacional, el SOP se diagnostica cuando "
+    "hay al menos dos de tres criterios: ciclos irregulares, signos de andrógenos "
+    "elevados y ovarios con morfología poliquística. Solo tu médico puede confirmarlo 💜"
+)
+
+
+class FakeCacheTooSmallError(Exception):
+    """Imita el rechazo de un caché por debajo del mínimo de tokens"""
+
+    def __init__(self, tokens, minimum):
+        super().__init__(f"400 Cached content is too small. total_token_count={tokens}, min_total_token_count={minimum}")
+
+
+class FakeQuotaError(Exception):
+    """Imita google.api_core.exceptions.ResourceExhausted"""
+
+    def __init__(self):
+        super().__init__("429 Resource has been exhausted (e.g. check quota).")
+
+
+class FakeSafetyError(Exception):
+    """Imita el bloqueo por filtros de seguridad"""
+
+    def __init__(self):
+        super().__init__("The response was blocked by safety filters (finish_reason: SAFETY)")
+
+
+def count_tokens(contents):
+    """Aproximación de ~4 caracteres por token"""
+    if isinstance(contents, str):
+        return max(len(contents) // 4, 1)
+    if isinstance(contents, (list, tuple)):
+        # Las imágenes cuentan como bloque fijo (igual que Gemini: 258 tokens)
+        return sum(count_tokens(c) if isinstance(c, (str, list, tuple)) else 258 for c in contents)
+    return 258
+
+
+class FakeUsage:
+    __slots__ = ("prompt_token_count", "candidates_token_count", "cached_content_token_count")
+
+    def __init__(self, prompt_tokens, response_tokens, cached_tokens=0):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+        self.cached_content_token_count = cached_tokens
+
+
+class FakeCachedContent:
+    """Imita caching.CachedContent: prefijo registrado una vez y referenciado por nombre"""
+
+    _counter = 0
+
+    def __init__(self, system_instruction, ttl_seconds=3600, min_tokens=1024):
+        tokens = count_tokens(system_instruction)
+        if tokens < min_tokens:
+            raise FakeCacheTooSmallError(tokens, min_tokens)
+        FakeCachedContent._counter += 1
+        self.name = f"cachedContents/fake-{FakeCachedContent._counter}"
+        self.system_instruction = system_instruction
+        self.token_count = tokens
+        self.expire_time = time.time() + ttl_seconds
+
+
+class FakeChunk:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    """Respuesta completa o en streaming (iterar produce FakeChunk)"""
+
+    def __init__(self, text, usage, chunks=None, chunk_delay=0.0):
+        self._text = text
+        self.usage_metadata = usage
+        self._chunks = chunks
+        self._chunk_delay = chunk_delay
+
+    @property
+    def text(self):
+        return self._text
+
+    def __iter__(self):
+        for chunk in self._chunks or [self._text]:
+            if self._chunk_delay:
+                time.sleep(self._chunk_delay)
+            yield FakeChunk(chunk)
+
+    def resolve(self):
+        for _ in self:
+            pass
+
+    async def __aiter__(self):
+        for chunk in self._chunks or [self._text]:
+            if self._chunk_delay:
+                await asyncio.sleep(self._chunk_delay)
+            yield FakeChunk(chunk)
+
+
+class FakeGenerativeModel:
+    """Modelo falso con la interfaz usada por el chatbot"""
+
+    def __init__(
+        self,
+        latency=0.8,
+        jitter=0.2,
+        answer=STUB_ANSWER,
+        stream_chunks=8,
+        rate_limit_rate=0.0,
+        safety_rate=0.0,
+        seed=None,
+        model_name="models/fake-gemini",
+        system_instruction=None,
+        cached_content=None,
+        prefill_per_1k=0.0,
+        rpm_limit=None,
+        quota_window=60.0,
+        quota=None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.answer = answer
+        self.stream_chunks = stream_chunks
+        self.rate_limit_rate = rate_limit_rate
+        self.safety_rate = safety_rate
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached_content = cached_content
+        # Segundos extra por cada 1000 tokens de entrada no cacheados
+        self.prefill_per_1k = prefill_per_1k
+        # Cuota por clave: más de rpm_limit llamadas en quota_window segundos -> 429.
+        # Las copias de with_prefix comparten la cuota (misma clave)
+        self.rpm_limit = rpm_limit
+        self.quota_window = quota_window
+        self._quota = quota if quota is not None else (deque(), threading.Lock())
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _prompt_tokens(self, contents):
+        """(tokens totales, tokens servidos desde caché)"""
+        cached = self.cached_content.token_count if self.cached_content is not None else 0
+        tokens = count_tokens(contents) + cached
+        if self.system_instruction:
+            tokens += count_tokens(self.system_instruction)
+        return tokens, cached
+
+    def _plan(self, contents):
+        """Decide latencia y error de una llamada (thread-safe)"""
+        tokens, cached = self._prompt_tokens(contents)
+        prefill = (tokens - cached) / 1000 * self.prefill_per_1k
+        with self._lock:
+            self.calls += 1
+            delay = max(self.latency + self._rng.uniform(-self.jitter, self.jitter), 0.0) + prefill
+            roll = self._rng.random()
+            over_quota = self._over_quota()
+        if over_quota or roll < self.rate_limit_rate:
+            return delay * 0.1, FakeQuotaError()
+        if roll < self.rate_limit_rate + self.safety_rate:
+            return delay * 0.5, FakeSafetyError()
+        return delay, None
+
+    def _over_quota(self):
+        if self.rpm_limit is None:
+            return False
+        calls, lock = self._quota
+        now = time.monotonic()
+        with lock:
+            while calls and now - calls[0] >= self.quota_window:
+                calls.popleft()
+            if len(calls) >= self.rpm_limit:
+                return True
+            calls.append(now)
+        return False
+
+    def _build(self, contents, stream, delay):
+        tokens, cached = self._prompt_tokens(contents)
+        usage = FakeUsage(tokens, count_tokens(self.answer), cached)
+        if not stream:
+            return FakeResponse(self.answer, usage)
+        size = max(len(self.answer) // self.stream_chunks, 1)
+        chunks = [self.answer[i:i + size] for i in range(0, len(self.answer), size)]
+        return FakeResponse(self.answer, usage, chunks, chunk_delay=delay / len(chunks))
+
+    def with_prefix(self, system_instruction=None, cached_content=None):
+        """Copia con prefijo (system instruction o caché); sirve de model_factory"""
+        return FakeGenerativeModel(
+            latency=self.latency,
+            jitter=self.jitter,
+            answer=self.answer,
+            stream_chunks=self.stream_chunks,
+            rate_limit_rate=self.rate_limit_rate,
+            safety_rate=self.safety_rate,
+            seed=self._rng.random(),
+            model_name=self.model_name,
+            system_instruction=system_instruction,
+            cached_content=cached_content,
+            prefill_per_1k=self.prefill_per_1k,
+            rpm_limit=self.rpm_limit,
+            quota_window=self.quota_window,
+            quota=self._quota,
+        )
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        delay, error = self._plan(contents)
+        if stream and error is None:
+            # En streaming la latencia se reparte entre los fragmentos
+            return self._build(contents, stream, delay)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return self._build(contents, stream, delay)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        delay, error = self._plan(contents)
+        if stream and error is None:
+            return self._build(contents, stream, delay)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return self._build(contents, stream, delay)
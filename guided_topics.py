@@ -0,0 +1,152 @@
+"""
+Temas guiados precalculados
+Respuestas de los botones del sidebar, versionadas contra índice + prompt
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+GUIDED_TOPICS_PATH = "./cache/temas_guiados.json"
+
+QUICK_QUESTIONS = [
+    "¿Qué es el SOP?",
+    "¿Cómo se diagnostica?",
+    "Tratamientos disponibles",
+    "¿Puedo embarazarme?",
+    "Dieta para SOP",
+    "Ejercicio recomendado",
+    "Riesgo de diabetes",
+    "Salud mental y SOP"
+]
+
+# Misma cadencia que el rate limiting del chat (15 RPM)
+WARMUP_SPACING_SECONDS = 4
+
+# Tras una pasada con errores (sin cuota, sin índice) se espera antes de reintentar la misma versión;
+# la espera se duplica con cada fallo. Una versión nueva se intenta de inmediato
+WARMUP_RETRY_SECONDS = 300
+WARMUP_RETRY_MAX_SECONDS = 6 * 3600
+
+
+def topics_version(index_dir, *prompt_parts):
+    """Huella del índice (nombres, tamaños, mtimes) + prompts + preguntas"""
+    digest = hashlib.sha256()
+    for root, _dirs, files in sorted(os.walk(index_dir)):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, index_dir)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    for part in prompt_parts:
+        digest.update(part.encode())
+    digest.update("\n".join(QUICK_QUESTIONS).encode())
+    return digest.hexdigest()[:16]
+
+
+class GuidedTopicsCache:
+    """Caché en disco de respuestas a temas guiados con refresco en segundo plano"""
+
+    def __init__(self, path=GUIDED_TOPICS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._worker = None
+        self._data = self._read()
+        # Backoff por versión: (versión, fallos seguidos, no reintentar antes de)
+        self._backoff = (None, 0, 0.0)
+
+    def _read(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"version": None, "answers": {}}
+
+    def _write(self, data):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def get(self, question, version):
+        """Respuesta precalculada o None si no existe / está desactualizada"""
+        with self._lock:
+            if self._data.get("version") != version:
+                # Otro proceso pudo haber terminado el refresco
+                self._data = self._read()
+            if self._data.get("version") != version:
+                return None
+            return self._data["answers"].get(question)
+
+    def is_fresh(self, version):
+        with self._lock:
+            return (
+                self._data.get("version") == version
+                and all(q in self._data["answers"] for q in QUICK_QUESTIONS)
+            )
+
+    def ensure_fresh(self, version, answer_fn):
+        """Lanza el precálculo en segundo plano si la versión cambió (se llama en cada rerun)
+
+        answer_fn corre en un hilo sin sesión de Streamlit: no debe tocar la UI
+        """
+        if self.is_fresh(version):
+            return False
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return False
+            backoff_version, _, retry_at = self._backoff
+            if backoff_version == version and time.time() < retry_at:
+                return False
+            self._worker = threading.Thread(
+                target=self.warm,
+                args=(version, answer_fn),
+                name="guided-topics-warmup",
+                daemon=True
+            )
+            self._worker.start()
+        return True
+
+    def warm(self, version, answer_fn, spacing=WARMUP_SPACING_SECONDS):
+        """Calcula las respuestas faltantes y las guarda con la versión dada
+
+        answer_fn(pregunta) -> (respuesta, páginas recuperadas)
+        """
+        with self._lock:
+            current = self._read()
+        answers = current["answers"] if current.get("version") == version else {}
+
+        for question in QUICK_QUESTIONS:
+            if question in answers:
+                continue
+            try:
+                answer, pages = answer_fn(question)
+            except Exception as e:
+                # Sin cuota o error temporal: se corta la pasada y se reintenta tras el backoff
+                self._failed(version, e)
+                return answers
+            answers[question] = {
+                "answer": answer,
+                "pages": list(pages),
+                "created_at": time.time()
+            }
+            with self._lock:
+                self._data = {"version": version, "answers": dict(answers)}
+                self._write(self._data)
+            time.sleep(spacing)
+        with self._lock:
+            self._backoff = (None, 0, 0.0)
+        return answers
+
+    def _failed(self, version, error):
+        with self._lock:
+            backoff_version, failures, _ = self._backoff
+            failures = failures + 1 if backoff_version == version else 1
+            delay = min(WARMUP_RETRY_SECONDS * 2 ** (failures - 1), WARMUP_RETRY_MAX_SECONDS)
+            self._backoff = (version, failures, time.time() + delay)
+        logger.warning("Precálculo de temas guiados interrumpido (%s); reintento en %.0f s", error, delay)
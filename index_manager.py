@@ -0,0 +1,226 @@
+"""
+Índice vectorial versionado con cambio en caliente
+indices/<versión>/ + puntero atómico indices/CURRENT; las peticiones en curso terminan en su versión
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+INDEX_ROOT = "./indices"
+CURRENT_POINTER = "CURRENT"
+
+# Cada cuánto se revisa el puntero y cuánto vive una versión retirada
+INDEX_POLL_SECONDS = float(os.getenv("SOP_INDEX_POLL_SECONDS", "10"))
+INDEX_GRACE_SECONDS = float(os.getenv("SOP_INDEX_GRACE_SECONDS", "600"))
+
+# Versiones más recientes que se conservan en disco (además de CURRENT), publicadas o no
+INDEX_KEEP_VERSIONS = int(os.getenv("SOP_INDEX_KEEP_VERSIONS", "3"))
+
+# Consulta para calentar una versión nueva antes de activarla
+WARMUP_QUERY = "¿Qué es el síndrome de ovario poliquístico?"
+
+
+# ==========================================
+# VERSIONES EN DISCO
+# ==========================================
+
+def new_version_dir(root=INDEX_ROOT):
+    """Directorio para una ingesta nueva (no se activa hasta publish_version)"""
+    version = datetime.now().strftime("v%Y%m%d_%H%M%S")
+    path = os.path.join(root, version)
+    os.makedirs(path, exist_ok=False)
+    return path
+
+
+def publish_version(path, root=INDEX_ROOT):
+    """Apunta CURRENT a la versión (escritura atómica con os.replace)"""
+    version = os.path.basename(os.path.normpath(path))
+    tmp_path = os.path.join(root, f".{CURRENT_POINTER}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(root, CURRENT_POINTER))
+    return version
+
+
+def current_index_dir(root=INDEX_ROOT, fallback=None):
+    """Directorio de la versión activa; fallback si aún no hay índices versionados"""
+    try:
+        with open(os.path.join(root, CURRENT_POINTER), encoding="utf-8") as f:
+            version = f.read().strip()
+    except FileNotFoundError:
+        return fallback
+    return os.path.join(root, version) if version else fallback
+
+
+def list_versions(root=INDEX_ROOT):
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name for name in os.listdir(root)
+        if not name.startswith(".") and os.path.isdir(os.path.join(root, name))
+    )
+
+
+def prune_versions(root=INDEX_ROOT, keep=INDEX_KEEP_VERSIONS, protect=()):
+    """Borra todo menos las `keep` versiones más recientes, CURRENT y las rutas de `protect`
+
+    Incluye ingestas que fallaron o nunca se publicaron (los nombres vAAAAMMDD_HHMMSS ordenan por fecha)
+    """
+    names = list_versions(root)
+    protected = {os.path.normpath(p) for p in protect if p}
+    current = current_index_dir(root)
+    if current is not None:
+        protected.add(os.path.normpath(current))
+    recent = set(names[-keep:]) if keep > 0 else set()
+    removed = []
+    for name in names:
+        path = os.path.join(root, name)
+        if name in recent or os.path.normpath(path) in protected:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(name)
+    if removed:
+        logger.info("Versiones de índice eliminadas: %s", ", ".join(removed))
+    return removed
+
+
+# ==========================================
+# GESTOR EN MEMORIA
+# ==========================================
+
+class _LoadedIndex:
+    __slots__ = ("path", "vectorstore", "leases", "retired_at")
+
+    def __init__(self, path, vectorstore):
+        self.path = path
+        self.vectorstore = vectorstore
+        self.leases = 0
+        self.retired_at = None
+
+
+class IndexManager:
+    """Presta el vectorstore activo y cambia de versión sin reiniciar"""
+
+    def __init__(self, loader, root=INDEX_ROOT, fallback=None,
+                 poll_seconds=INDEX_POLL_SECONDS, grace_seconds=INDEX_GRACE_SECONDS, keep_versions=INDEX_KEEP_VERSIONS):
+        self.loader = loader
+        self.root = root
+        self.fallback = fallback
+        self.poll_seconds = poll_seconds
+        self.grace_seconds = grace_seconds
+        self.keep_versions = keep_versions
+        self._lock = threading.Lock()
+        self._retired = []
+        self._loading = None
+        self._collecting = False
+        self._last_check = time.monotonic()
+
+        path = current_index_dir(root, fallback)
+        if path is None or not os.path.exists(path):
+            raise FileNotFoundError(
+                f"Índice no encontrado en {root}. Ejecuta primero: python create_embeddings.py"
+            )
+        self._active = _LoadedIndex(path, loader(path))
+
+    @property
+    def path(self):
+        return self._active.path
+
+    @property
+    def vectorstore(self):
+        """Vectorstore activo (sin préstamo; para lecturas puntuales)"""
+        return self._active.vectorstore
+
+    @contextmanager
+    def lease(self):
+        """Vectorstore para una petición; no se libera mientras esté prestado"""
+        self.maybe_refresh()
+        with self._lock:
+            loaded = self._active
+            loaded.leases += 1
+        try:
+            yield loaded.vectorstore
+        finally:
+            with self._lock:
+                loaded.leases -= 1
+
+    def maybe_refresh(self):
+        """Revisa el puntero como mucho una vez por poll_seconds"""
+        now = time.monotonic()
+        if now - self._last_check < self.poll_seconds:
+            return
+        self._last_check = now
+        self.refresh()
+        self._collect_in_background()
+
+    def refresh(self):
+        """Si CURRENT cambió, carga y calienta la versión nueva en segundo plano"""
+        path = current_index_dir(self.root, self.fallback)
+        with self._lock:
+            if path is None or path == self._active.path or path == self._loading:
+                return False
+            self._loading = path
+        threading.Thread(target=self._load_and_swap, args=(path,), name="sop-index-swap", daemon=True).start()
+        return True
+
+    def _load_and_swap(self, path):
+        try:
+            vectorstore = self.loader(path)
+            vectorstore.similarity_search(WARMUP_QUERY, k=1)
+        except Exception:
+            logger.exception("No se pudo cargar el índice %s; se mantiene %s", path, self._active.path)
+            with self._lock:
+                self._loading = None
+            return
+        with self._lock:
+            old = self._active
+            old.retired_at = time.monotonic()
+            self._retired.append(old)
+            self._active = _LoadedIndex(path, vectorstore)
+            self._loading = None
+        logger.info("Índice activo: %s (antes %s)", path, old.path)
+
+    def _collect_in_background(self):
+        """collect_garbage en un hilo: borrar versiones viejas (rmtree) no retrasa la petición"""
+        with self._lock:
+            if self._collecting:
+                return False
+            self._collecting = True
+        threading.Thread(target=self._collect, name="sop-index-gc", daemon=True).start()
+        return True
+
+    def _collect(self):
+        try:
+            self.collect_garbage()
+        except Exception:
+            logger.exception("No se pudieron limpiar las versiones retiradas del índice")
+        finally:
+            with self._lock:
+                self._collecting = False
+
+    def collect_garbage(self):
+        """Suelta versiones retiradas sin préstamos y deja en disco solo las últimas keep_versions"""
+        now = time.monotonic()
+        with self._lock:
+            self._retired = [
+                r for r in self._retired
+                if r.leases > 0 or now - r.retired_at < self.grace_seconds
+            ]
+            in_use = {self._active.path, self._loading} | {r.path for r in self._retired}
+
+        # Otros procesos siguen en la versión anterior hasta notar el cambio de CURRENT
+        try:
+            published_at = os.path.getmtime(os.path.join(self.root, CURRENT_POINTER))
+        except FileNotFoundError:
+            return []
+        if time.time() - published_at < self.grace_seconds:
+            return []
+        # Una ingesta en curso es la versión más nueva: queda dentro de las keep_versions
+        return prune_versions(self.root, self.keep_versions, protect=in_use)
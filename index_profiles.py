@@ -0,0 +1,115 @@
+"""
+Perfiles HNSW del índice vectorial (Chroma)
+Un perfil fija el grafo al construir (space, M, construction_ef) y el esfuerzo de búsqueda (search_ef).
+Chroma guarda search_ef en la colección y no permite cambiarlo por consulta ni por cliente: solo
+create_embeddings.py lo escribe (al construir, o con --retune en una copia que se publica como versión
+nueva). Las apps nunca modifican el índice publicado
+"""
+
+import json
+import logging
+import os
+import shutil
+
+logger = logging.getLogger(__name__)
+
+# Los embeddings van normalizados: l2 ordena igual que coseno (y es lo que usa el índice existente)
+HNSW_PROFILES = {
+    # Valores por defecto de Chroma, como referencia en el barrido
+    "chroma-default": {"hnsw:space": "l2", "hnsw:M": 16, "hnsw:construction_ef": 100, "hnsw:search_ef": 10},
+    "exact-ish": {"hnsw:space": "l2", "hnsw:M": 32, "hnsw:construction_ef": 400, "hnsw:search_ef": 256},
+    "balanced": {"hnsw:space": "l2", "hnsw:M": 16, "hnsw:construction_ef": 200, "hnsw:search_ef": 64},
+    "fast": {"hnsw:space": "l2", "hnsw:M": 8, "hnsw:construction_ef": 64, "hnsw:search_ef": 16},
+}
+DEFAULT_PROFILE = "balanced"
+
+PROFILE_FILE = "index_profile.json"
+
+
+def get_profile(name):
+    try:
+        return HNSW_PROFILES[name]
+    except KeyError:
+        raise ValueError(
+            f"Perfil HNSW desconocido: {name}. Opciones: {', '.join(HNSW_PROFILES)}"
+        ) from None
+
+
+def collection_metadata(name=DEFAULT_PROFILE):
+    """Metadata de la colección para Chroma(...)/Chroma.from_documents(collection_metadata=...)"""
+    return dict(get_profile(name))
+
+
+# ==========================================
+# PERFIL GUARDADO CON CADA VERSIÓN DEL ÍNDICE
+# ==========================================
+
+def write_profile(index_dir, name, search_profile=None):
+    """Perfil del build + el de búsqueda si se cambió después (--retune)"""
+    data = {"profile": name, **get_profile(name)}
+    if search_profile is not None:
+        data["search_profile"] = search_profile
+        data["hnsw:search_ef"] = get_profile(search_profile)["hnsw:search_ef"]
+    with open(os.path.join(index_dir, PROFILE_FILE), "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def read_profile(index_dir):
+    """Perfil con el que se construyó el índice (None en índices anteriores a los perfiles)"""
+    try:
+        with open(os.path.join(index_dir, PROFILE_FILE), encoding="utf-8") as f:
+            return json.load(f).get("profile")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def current_search_ef(collection):
+    """search_ef vigente de una colección de chromadb
+
+    En chromadb >= 1.0 manda la configuración; la metadata hnsw:* queda con el valor de creación
+    """
+    configuration = getattr(collection, "configuration_json", None) or {}
+    search_ef = (configuration.get("hnsw") or {}).get("ef_search")
+    if search_ef is not None:
+        return search_ef
+    return (collection.metadata or {}).get("hnsw:search_ef")
+
+
+def apply_search_profile(collection, name):
+    """Ajusta search_ef de una colección de chromadb ya construida (M y construction_ef no cambian)
+
+    Solo para create_embeddings.py --retune, sobre una copia sin publicar
+    """
+    search_ef = get_profile(name)["hnsw:search_ef"]
+    if current_search_ef(collection) == search_ef:
+        return True
+    try:
+        # chromadb >= 1.0: configuración de la colección
+        collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+    except TypeError:
+        # Versiones anteriores: la metadata hnsw:* se lee al abrir el segmento
+        metadata = {k: v for k, v in (collection.metadata or {}).items() if k != "hnsw:space"}
+        metadata["hnsw:search_ef"] = search_ef
+        try:
+            collection.modify(metadata=metadata)
+        except Exception:
+            logger.warning("No se pudo aplicar search_ef=%s (perfil %s)", search_ef, name, exc_info=True)
+            return False
+    except Exception:
+        logger.warning("No se pudo aplicar search_ef=%s (perfil %s)", search_ef, name, exc_info=True)
+        return False
+    return True
+
+
+def retune_copy(source_dir, target_dir, name, collection_name="sop_medical_guide"):
+    """Copia una versión del índice con el search_ef del perfil name (la original no se toca)
+
+    target_dir debe ser una versión sin publicar; True si chromadb aceptó el cambio
+    """
+    import chromadb
+
+    shutil.copytree(source_dir, target_dir, dirs_exist_ok=True)
+    client = chromadb.PersistentClient(path=target_dir)
+    applied = apply_search_profile(client.get_collection(collection_name), name)
+    write_profile(target_dir, read_profile(source_dir) or DEFAULT_PROFILE, search_profile=name)
+    return applied
@@ -0,0 +1,227 @@
+"""
+Métricas en proceso
+Tiempos por etapa, tokens y aciertos de caché con percentiles móviles
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+HISTOGRAM_SIZE = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RollingHistogram:
+    """Últimas N observaciones con su marca de tiempo
+
+    Las lecturas copian las muestras bajo el lock: otro hilo puede estar observando
+    (iterar un deque mientras cambia lanza RuntimeError)
+    """
+
+    def __init__(self, maxlen=HISTOGRAM_SIZE):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=maxlen)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append((time.time(), value))
+            self.count += 1
+            self.total += value
+
+    def _copy(self):
+        with self._lock:
+            return list(self._samples), self.count, self.total
+
+    @staticmethod
+    def _percentile(values, q):
+        if not values:
+            return None
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+    def percentile(self, q):
+        samples, _, _ = self._copy()
+        return self._percentile(sorted(v for _, v in samples), q)
+
+    def rate(self, window=60):
+        """Observaciones en los últimos `window` segundos"""
+        since = time.time() - window
+        samples, _, _ = self._copy()
+        return sum(1 for ts, _ in samples if ts >= since)
+
+    def summary(self):
+        # Una sola copia: count, sum y percentiles son de las mismas observaciones
+        samples, count, total = self._copy()
+        values = sorted(v for _, v in samples)
+        since = time.time() - 60
+        return {
+            "count": count,
+            "sum": total,
+            "rate_1m": sum(1 for ts, _ in samples if ts >= since),
+            **{f"p{int(q * 100)}": self._percentile(values, q) for q in QUANTILES},
+        }
+
+
+def _escape_label(value):
+    """Valor de etiqueta con barras, comillas y saltos de línea escapados (formato de texto de Prometheus)"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """Registro de histogramas y contadores con etiquetas"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(RollingHistogram)
+        self._counters = defaultdict(float)
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self._histograms[self._key(name, labels)].observe(value)
+
+    def incr(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[self._key(name, labels)] += value
+
+    @contextmanager
+    def stage(self, stage):
+        """Mide la duración de una etapa en segundos"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("stage_seconds", time.perf_counter() - start, stage=stage)
+
+    def timed(self, stage):
+        """Decorador equivalente a `with metrics.stage(...)`"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_usage(self, response, call):
+        """Cuenta tokens de una respuesta de Gemini (usage_metadata)"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        self.incr("gemini_prompt_tokens_total", getattr(usage, "prompt_token_count", 0) or 0, call=call)
+        self.incr("gemini_response_tokens_total", getattr(usage, "candidates_token_count", 0) or 0, call=call)
+        # Incluidos en prompt_token_count, pero cobrados con descuento (context caching)
+        self.incr("gemini_cached_tokens_total", getattr(usage, "cached_content_token_count", 0) or 0, call=call)
+
+    def histogram(self, name, **labels):
+        with self._lock:
+            return self._histograms.get(self._key(name, labels))
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def stage_summary(self, stage):
+        hist = self.histogram("stage_seconds", stage=stage)
+        return hist.summary() if hist else None
+
+    # ==========================================
+    # EXPORTACIÓN
+    # ==========================================
+
+    def snapshot(self):
+        # Copia de los registros bajo el lock del registro; cada histograma se resume bajo el suyo
+        with self._lock:
+            histograms = list(self._histograms.items())
+            counters = list(self._counters.items())
+        return {
+            "timestamp": time.time(),
+            "histograms": [
+                {"name": name, "labels": dict(labels), **hist.summary()}
+                for (name, labels), hist in histograms
+            ],
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in counters
+            ],
+        }
+
+    def to_json(self):
+        return snapshot_to_json(self.snapshot())
+
+    def to_prometheus(self, prefix="sop_"):
+        return snapshot_to_prometheus(self.snapshot(), prefix)
+
+
+# ==========================================
+# LECTURA DE SNAPSHOTS (LOCALES O DE LA API)
+# ==========================================
+
+def snapshot_summary(snapshot, name, **labels):
+    """Resumen de un histograma de snapshot() (o de GET /metrics.json); None si no hay datos"""
+    for h in snapshot["histograms"]:
+        if h["name"] == name and h["labels"] == labels:
+            return h
+    return None
+
+
+def snapshot_counter(snapshot, name, **labels):
+    for c in snapshot["counters"]:
+        if c["name"] == name and c["labels"] == labels:
+            return c["value"]
+    return 0
+
+
+def merge_snapshots(*snapshots):
+    """Une snapshots de procesos distintos (en modo cliente: los de la API + los de la UI)"""
+    return {
+        "timestamp": max(snap["timestamp"] for snap in snapshots),
+        "histograms": [h for snap in snapshots for h in snap["histograms"]],
+        "counters": [c for snap in snapshots for c in snap["counters"]],
+    }
+
+
+def snapshot_to_json(snapshot):
+    return json.dumps(snapshot, ensure_ascii=False, indent=2)
+
+
+def snapshot_to_prometheus(snapshot, prefix="sop_"):
+    """Formato de texto de Prometheus (summaries + counters)"""
+    def fmt_labels(labels, extra=None):
+        items = list(labels.items()) + (list(extra.items()) if extra else [])
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in items) + "}"
+
+    lines = []
+    seen = set()
+    # Cada métrica en un solo bloque aunque venga de varios snapshots unidos
+    for h in sorted(snapshot["histograms"], key=lambda h: h["name"]):
+        name = prefix + h["name"]
+        if name not in seen:
+            lines.append(f"# TYPE {name} summary")
+            seen.add(name)
+        for q in QUANTILES:
+            value = h[f"p{int(q * 100)}"]
+            if value is not None:
+                lines.append(f"{name}{fmt_labels(h['labels'], {'quantile': q})} {value}")
+        lines.append(f"{name}_sum{fmt_labels(h['labels'])} {h['sum']}")
+        lines.append(f"{name}_count{fmt_labels(h['labels'])} {h['count']}")
+    for c in sorted(snapshot["counters"], key=lambda c: c["name"]):
+        name = prefix + c["name"]
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        lines.append(f"{name}{fmt_labels(c['labels'])} {c['value']}")
+    return "\n".join(lines) + "\n"
+
+
+# Instancia del proceso: los módulos importados sobreviven a los reruns de Streamlit
+METRICS = Metrics()
@@ -0,0 +1,175 @@
+"""
+Vistas previas de las páginas citadas de la guía
+Se generan una vez al construir el índice (miniatura JPEG en gris + fragmento de texto por página)
+y se guardan junto a la versión del índice; la UI las muestra sin abrir guia_sop.pdf
+
+Uso:
+    python page_previews.py                    # genera las vistas previas del índice activo
+    python page_previews.py --index indices/v20260101_120000 --width 240
+"""
+
+import argparse
+import json
+import mmap
+import os
+import time
+
+PREVIEWS_DIR = "previews"
+MANIFEST_NAME = "pages.json"
+THUMBNAILS_NAME = "thumbnails.bin"
+
+THUMB_WIDTH = 180
+THUMB_QUALITY = 60
+SNIPPET_CHARS = 280
+
+
+def pages_label(pages):
+    """Páginas 0-based -> 'p. 12, 45' (numeración impresa del PDF)"""
+    return ", ".join(f"p. {page + 1}" for page in pages)
+
+
+def _snippet(text, max_chars=SNIPPET_CHARS):
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return cut.rstrip(",;:") + "…"
+
+
+def page_snippets(chunks):
+    """(texto, metadata) de los chunks indexados -> {página: {sección, fragmento}}
+
+    El fragmento sale del primer chunk de cada página (el texto que realmente se recupera)
+    """
+    pages = {}
+    for text, metadata in chunks:
+        page = metadata.get("page")
+        if page is None or page in pages:
+            continue
+        pages[int(page)] = {
+            "section": metadata.get("section", ""),
+            "snippet": _snippet(text),
+        }
+    return pages
+
+
+# ==========================================
+# CONSTRUCCIÓN (AL CREAR EL ÍNDICE)
+# ==========================================
+
+def render_thumbnails(pdf_path, pages, width=THUMB_WIDTH, quality=THUMB_QUALITY):
+    """{página: bytes JPEG}; vacío (con aviso) si PyMuPDF no está instalado"""
+    try:
+        import pymupdf  # solo se usa al construir el índice
+    except ImportError:
+        print("⚠️ Sin PyMuPDF (pip install pymupdf): las vistas previas quedan solo con texto")
+        return {}
+    thumbnails = {}
+    with pymupdf.open(pdf_path) as doc:
+        for page in pages:
+            if not 0 <= page < doc.page_count:
+                continue
+            pdf_page = doc[page]
+            zoom = width / pdf_page.rect.width
+            pix = pdf_page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), colorspace=pymupdf.csGRAY, alpha=False)
+            thumbnails[page] = pix.tobytes("jpg", jpg_quality=quality)
+    return thumbnails
+
+
+def build_previews(index_dir, chunks, pdf_path, width=THUMB_WIDTH):
+    """Escribe previews/pages.json + previews/thumbnails.bin (miniaturas concatenadas)
+
+    chunks: pares (texto, metadata) o Documents de langchain
+    """
+    chunks = [(c.page_content, c.metadata) if hasattr(c, "page_content") else c for c in chunks]
+    pages = page_snippets(chunks)
+    thumbnails = render_thumbnails(pdf_path, sorted(pages), width)
+
+    out_dir = os.path.join(index_dir, PREVIEWS_DIR)
+    os.makedirs(out_dir, exist_ok=True)
+    offset = 0
+    with open(os.path.join(out_dir, THUMBNAILS_NAME), "wb") as f:
+        for page in sorted(pages):
+            data = thumbnails.get(page)
+            if data is None:
+                continue
+            f.write(data)
+            pages[page]["thumbnail"] = [offset, len(data)]
+            offset += len(data)
+
+    manifest = {
+        "source": os.path.basename(pdf_path),
+        "thumb_width": width,
+        "pages": {str(page): info for page, info in sorted(pages.items())},
+    }
+    tmp_path = os.path.join(out_dir, f".{MANIFEST_NAME}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_NAME))
+    return {"pages": len(pages), "thumbnails": len(thumbnails), "bytes": offset}
+
+
+# ==========================================
+# LECTURA (UI)
+# ==========================================
+
+class PagePreviews:
+    """Manifiesto en memoria + miniaturas memory-mapped (cada una es un slice de bytes)"""
+
+    def __init__(self, pages, thumbnails):
+        self.pages = pages
+        self._thumbnails = thumbnails
+
+    @classmethod
+    def load(cls, index_dir):
+        """None si la versión del índice no tiene vistas previas"""
+        out_dir = os.path.join(index_dir, PREVIEWS_DIR)
+        try:
+            with open(os.path.join(out_dir, MANIFEST_NAME), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        thumbnails = None
+        path = os.path.join(out_dir, THUMBNAILS_NAME)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                thumbnails = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        pages = {int(page): info for page, info in manifest["pages"].items()}
+        return cls(pages, thumbnails)
+
+    def get(self, page):
+        """{section, snippet} de la página (0-based) o None"""
+        return self.pages.get(page)
+
+    def thumbnail(self, page):
+        """Bytes JPEG de la miniatura o None"""
+        info = self.pages.get(page)
+        if info is None or "thumbnail" not in info or self._thumbnails is None:
+            return None
+        offset, size = info["thumbnail"]
+        return self._thumbnails[offset:offset + size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera las vistas previas de páginas de un índice")
+    parser.add_argument("--index", default=None, help="Directorio del índice (por defecto indices/CURRENT)")
+    parser.add_argument("--pdf", default="guia_sop.pdf")
+    parser.add_argument("--width", type=int, default=THUMB_WIDTH)
+    args = parser.parse_args()
+
+    from index_manager import current_index_dir
+    from sop_engine import VECTORSTORE_DIR, load_embeddings, load_vectorstore
+
+    index_dir = args.index or current_index_dir(fallback=VECTORSTORE_DIR)
+    vectorstore = load_vectorstore(index_dir, load_embeddings())
+    data = vectorstore._collection.get(include=["documents", "metadatas"])
+
+    start = time.perf_counter()
+    report = build_previews(index_dir, zip(data["documents"], data["metadatas"]), args.pdf, args.width)
+    print(f"✅ {report['pages']} páginas, {report['thumbnails']} miniaturas "
+          f"({report['bytes'] / 1024:.0f} KB) en {time.perf_counter() - start:.1f}s → "
+          f"{os.path.join(index_dir, PREVIEWS_DIR)}")
+
+
+if __name__ == "__main__":
+    main()
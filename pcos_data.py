@@ -0,0 +1,297 @@
+"""
+Caché columnar tipada de los datasets de SOP
+Convierte PCOS_data.xlsx / PCOS_data_cleaned.csv una sola vez a columnas .npy con tipos compactos
+(int8 para flags S/N, int16 para conteos, float32 para laboratorios) y la limpieza ya aplicada.
+Las lecturas siguientes son memory-mapped; la caché se invalida por hash del archivo fuente
+
+Uso:
+    python pcos_data.py                        # construye o valida la caché del CSV limpio
+    python pcos_data.py --source dataset/PCOS_data.xlsx --rebuild
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+DATASET_PATH = "./dataset/PCOS_data_cleaned.csv"
+CACHE_DIR = "./cache/pcos_columns"
+MANIFEST_NAME = "manifest.json"
+
+# Sube si cambia el esquema o la limpieza (invalida todas las cachés)
+SCHEMA_VERSION = 1
+
+# Nombre corto (el del CSV limpio) -> encabezado del Excel original y tipo en disco.
+# El orden es el de ambos archivos
+SCHEMA = {
+    "y": ("PCOS (Y/N)", "int8"),
+    "Age": ("Age (yrs)", "int16"),
+    "Weight": ("Weight (Kg)", "float32"),
+    "Height": ("Height(Cm)", "float32"),
+    "BMI": ("BMI", "float32"),
+    "BloodGroup": ("Blood Group", "int16"),
+    "PulseRate": ("Pulse rate(bpm)", "int16"),
+    "RR": ("RR (breaths/min)", "int16"),
+    "Hb": ("Hb(g/dl)", "float32"),
+    "Cycle": ("Cycle(R/I)", "int8"),
+    "CycleLength": ("Cycle length(days)", "int16"),
+    "MarraigeStatus": ("Marraige Status (Yrs)", "float32"),
+    "Pregnant": ("Pregnant(Y/N)", "int8"),
+    "NoAbortions": ("No. of abortions", "int16"),
+    "IbetaHCG": ("I beta-HCG(mIU/mL)", "float32"),
+    "IIbetaHCG": ("II beta-HCG(mIU/mL)", "float32"),
+    "FSH": ("FSH(mIU/mL)", "float32"),
+    "LH": ("LH(mIU/mL)", "float32"),
+    "FSHLH": ("FSH/LH", "float32"),
+    "Hip": ("Hip(inch)", "int16"),
+    "Waist": ("Waist(inch)", "int16"),
+    "WaistHipRatio": ("Waist:Hip Ratio", "float32"),
+    "TSH": ("TSH (mIU/L)", "float32"),
+    "AMH": ("AMH(ng/mL)", "float32"),
+    "PRL": ("PRL(ng/mL)", "float32"),
+    "VitD3": ("Vit D3 (ng/mL)", "float32"),
+    "PRG": ("PRG(ng/mL)", "float32"),
+    "RBS": ("RBS(mg/dl)", "float32"),
+    "WeightGain": ("Weight gain(Y/N)", "int8"),
+    "HairGrowth": ("hair growth(Y/N)", "int8"),
+    "SkinDarkening": ("Skin darkening (Y/N)", "int8"),
+    "HairLoss": ("Hair loss(Y/N)", "int8"),
+    "Pimples": ("Pimples(Y/N)", "int8"),
+    "FastFood": ("Fast food (Y/N)", "int8"),
+    "RegExercise": ("Reg.Exercise(Y/N)", "int8"),
+    "BPSystolic": ("BP _Systolic (mmHg)", "int16"),
+    "BPDiastolic": ("BP _Diastolic (mmHg)", "int16"),
+    "FollicleNoL": ("Follicle No. (L)", "int16"),
+    "FollicleNoR": ("Follicle No. (R)", "int16"),
+    "AvgFsizeL": ("Avg. F size (L) (mm)", "float32"),
+    "AvgFsizeR": ("Avg. F size (R) (mm)", "float32"),
+    "Endometrium": ("Endometrium (mm)", "float32"),
+}
+
+TARGET = "y"
+FEATURES = [name for name in SCHEMA if name != TARGET]
+
+
+def _normalize_header(text):
+    return " ".join(str(text).split())
+
+
+RAW_TO_NAME = {_normalize_header(raw): name for name, (raw, _) in SCHEMA.items()}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ==========================================
+# LIMPIEZA Y VALIDACIÓN
+# ==========================================
+
+def read_source(path):
+    """CSV limpio o Excel original -> DataFrame con los nombres cortos del esquema"""
+    if path.endswith((".xlsx", ".xls")):
+        # pandas necesita openpyxl para .xlsx; solo se usa al construir la caché
+        df = pd.read_excel(path)
+    else:
+        df = pd.read_csv(path)
+    df = df.rename(columns=lambda c: RAW_TO_NAME.get(_normalize_header(c), _normalize_header(c)))
+    # El Excel trae columnas vacías al final ("Unnamed: 44")
+    df = df.loc[:, ~df.columns.str.startswith("Unnamed")]
+
+    missing = [name for name in SCHEMA if name not in df.columns]
+    if missing:
+        raise ValueError(f"{path}: faltan columnas del esquema: {', '.join(missing)}")
+    return df[list(SCHEMA)]
+
+
+def clean(df):
+    """Limpieza de los notebooks: numérico + NaN -> media (redondeada en columnas enteras)
+
+    Regresa (columnas tipadas, valores de relleno usados, NaN por columna)
+    """
+    columns, fill_values, missing = {}, {}, {}
+    invalid = []
+    for name, (_, dtype) in SCHEMA.items():
+        # Celdas con texto ("1.99.") se tratan como faltantes
+        values = pd.to_numeric(df[name], errors="coerce").astype(np.float64)
+        n_missing = int(values.isna().sum())
+        fill = float(values.mean())
+        if dtype != "float32":
+            fill = float(np.round(fill))
+            if not np.allclose(values.dropna() % 1, 0):
+                invalid.append(f"{name} (no entero)")
+        if dtype == "int8" and name != "Cycle" and not values.dropna().isin([0, 1]).all():
+            invalid.append(f"{name} (flag fuera de 0/1)")
+        if name == TARGET and n_missing:
+            invalid.append(f"{name} (objetivo con faltantes)")
+        columns[name] = values.fillna(fill).to_numpy().astype(dtype)
+        fill_values[name] = fill
+        missing[name] = n_missing
+    if invalid:
+        raise ValueError(f"Esquema inválido: {', '.join(invalid)}")
+    return columns, fill_values, missing
+
+
+# ==========================================
+# CACHÉ EN DISCO
+# ==========================================
+
+def cache_path(source, cache_dir=CACHE_DIR):
+    """Un directorio por archivo fuente"""
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(cache_dir, stem)
+
+
+def _source_info(path):
+    stat = os.stat(path)
+    return {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _is_fresh(manifest, source):
+    """Tamaño y mtime evitan rehashear; si cambian, manda el hash"""
+    if manifest.get("schema_version") != SCHEMA_VERSION:
+        return False
+    info = _source_info(source)
+    cached = manifest["source"]
+    if cached["size"] == info["size"] and cached["mtime_ns"] == info["mtime_ns"]:
+        return True
+    return cached["sha256"] == file_sha256(source)
+
+
+def build_cache(source=DATASET_PATH, cache_dir=CACHE_DIR):
+    """Lee la fuente, limpia y escribe una .npy por columna + manifiesto"""
+    directory = cache_path(source, cache_dir)
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST_NAME)
+    # Sin manifiesto la caché cuenta como inválida mientras se reescribe
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    start = time.perf_counter()
+    columns, fill_values, missing = clean(read_source(source))
+    offsets = {}
+    for name, values in columns.items():
+        path = os.path.join(directory, f"{name}.npy")
+        np.save(path, values)
+        # Con el desplazamiento del encabezado se mapea sin volver a parsearlo
+        with open(path, "rb") as f:
+            np.lib.format.read_magic(f)
+            np.lib.format.read_array_header_1_0(f)
+            offsets[name] = f.tell()
+
+    manifest = {
+        "schema_version": SCHEMA_VERSION,
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "source": {**_source_info(source), "sha256": file_sha256(source)},
+        "rows": int(len(columns[TARGET])),
+        "schema": {name: dtype for name, (_, dtype) in SCHEMA.items()},
+        "offsets": offsets,
+        "fill_values": fill_values,
+        "missing": {name: n for name, n in missing.items() if n},
+        "build_seconds": time.perf_counter() - start,
+    }
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+class PCOSData:
+    """Columnas memory-mapped del dataset (solo lectura); cada columna se mapea al pedirla"""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.rows = manifest["rows"]
+        self.fill_values = manifest["fill_values"]
+        self.names = list(manifest["schema"])
+        self._columns = {}
+
+    def column(self, name):
+        if name not in self._columns:
+            if name not in self.manifest["schema"]:
+                raise KeyError(f"Columna desconocida: {name}")
+            self._columns[name] = np.memmap(
+                os.path.join(self.directory, f"{name}.npy"),
+                dtype=self.manifest["schema"][name],
+                mode="r",
+                offset=self.manifest["offsets"][name],
+                shape=(self.rows,),
+            )
+        return self._columns[name]
+
+    @property
+    def fingerprint(self):
+        """Identifica datos + limpieza (para claves de caché de entrenamiento)"""
+        return f"{self.manifest['source']['sha256']}:s{self.manifest['schema_version']}"
+
+    @property
+    def target(self):
+        return np.asarray(self.column(TARGET), dtype=np.int64)
+
+    def matrix(self, features=FEATURES, dtype=np.float64):
+        """Filas x features en el orden pedido"""
+        return np.column_stack([self.column(name) for name in features]).astype(dtype, copy=False)
+
+    def frame(self, features=None):
+        """DataFrame con los tipos compactos (para código que espera pandas)"""
+        names = self.names if features is None else list(features)
+        return pd.DataFrame({name: self.column(name) for name in names}, copy=False)
+
+    def fill_series(self, features=FEATURES):
+        return pd.Series({name: self.fill_values[name] for name in features}, dtype=np.float64)
+
+
+def load_pcos(source=DATASET_PATH, cache_dir=CACHE_DIR, rebuild=False):
+    """Dataset listo para entrenar o puntuar; reconstruye la caché solo si la fuente cambió"""
+    directory = cache_path(source, cache_dir)
+    manifest = None
+    if not rebuild:
+        try:
+            with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            manifest = None
+    if manifest is None or not _is_fresh(manifest, source):
+        manifest = build_cache(source, cache_dir)
+    return PCOSData(directory, manifest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caché columnar del dataset de SOP")
+    parser.add_argument("--source", default=DATASET_PATH)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    data = load_pcos(args.source, args.cache_dir, rebuild=args.rebuild)
+    disk = sum(os.path.getsize(os.path.join(data.directory, f"{n}.npy")) for n in data.names)
+    print(f"✅ {data.rows} filas x {len(data.names)} columnas en {data.directory} ({disk / 1024:.1f} KB)")
+    if data.manifest["missing"]:
+        print(f"   Faltantes rellenados: {data.manifest['missing']}")
+
+    repeats = 20
+    start = time.perf_counter()
+    for _ in range(repeats):
+        df = read_source(args.source)
+        df.fillna(df.mean())
+    parse_ms = (time.perf_counter() - start) / repeats * 1000
+    start = time.perf_counter()
+    for _ in range(repeats):
+        load_pcos(args.source, args.cache_dir).matrix()
+    cache_ms = (time.perf_counter() - start) / repeats * 1000
+    print(f"   Lectura + limpieza: fuente {parse_ms:.1f} ms · caché {cache_ms:.1f} ms ({parse_ms / cache_ms:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+Perfilado a demanda de sesiones en vivo (solo administración)
+Envuelve un rerun de Streamlit o una llamada a generate_response con cProfile (determinista) o con un
+muestreador de pilas; guarda el perfil con un request ID y resume las funciones más costosas.
+Desactivado no cuesta nada: sin SOP_PROFILE ni ?profile=<token> no se crea ningún perfilador
+"""
+
+import cProfile
+import hmac
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+PROFILE_DIR = "./perfiles"
+
+# ?profile=<SOP_ADMIN_TOKEN> activa el perfil para esa sesión; sin token configurado no hay toggle
+ADMIN_TOKEN = os.getenv("SOP_ADMIN_TOKEN", "")
+# SOP_PROFILE=rerun|chat perfila siempre (depuración local); SOP_PROFILE_MODE elige el perfilador
+PROFILE_ENV = os.getenv("SOP_PROFILE", "")
+PROFILE_MODE_ENV = os.getenv("SOP_PROFILE_MODE", "cprofile")
+
+PROFILE_SCOPES = ("rerun", "chat")
+PROFILE_MODES = ("cprofile", "sample")
+SAMPLE_INTERVAL_SECONDS = 0.005
+# Cada cuánto se revisa si el script perfilado sigue en la pila (rerun cortado por st.stop/st.rerun)
+WATCH_INTERVAL_SECONDS = 0.02
+TOP_N = 25
+
+
+def profile_request(query_params):
+    """{'scope', 'mode'} si hay que perfilar esta ejecución; None si no (el caso normal)
+
+    query_params: st.query_params o cualquier mapeo (profile, profile_scope, profile_mode)
+    """
+    if PROFILE_ENV:
+        scope = PROFILE_ENV if PROFILE_ENV in PROFILE_SCOPES else "rerun"
+        mode = PROFILE_MODE_ENV
+    else:
+        token = query_params.get("profile")
+        if not token or not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+            return None
+        scope = query_params.get("profile_scope", "rerun")
+        mode = query_params.get("profile_mode", PROFILE_MODE_ENV)
+    if scope not in PROFILE_SCOPES:
+        scope = "rerun"
+    if mode not in PROFILE_MODES:
+        mode = "cprofile"
+    return {"scope": scope, "mode": mode}
+
+
+def new_request_id(label):
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{label}_{uuid.uuid4().hex[:6]}"
+
+
+def _function_name(filename, lineno, name):
+    return f"{os.path.basename(filename)}:{lineno}({name})"
+
+
+# ==========================================
+# PERFILADORES
+# ==========================================
+
+class _DeterministicProfiler:
+    """cProfile sobre el hilo que lo arranca (desde Python 3.12 ve todos los hilos)"""
+
+    mode = "cprofile"
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+        self._stats = None
+
+    def start(self):
+        self._profile.enable()
+
+    def freeze(self):
+        """Fija los datos hasta ahora desde otro hilo (disable() solo actúa sobre el hilo que lo llama)"""
+        self._profile.snapshot_stats()
+        self._stats = self._profile.stats
+
+    def stop(self):
+        self._profile.disable()
+        if self._stats is None:
+            self.freeze()
+
+    def top(self, n):
+        rows = [
+            {
+                "function": _function_name(*func),
+                "calls": total_calls,
+                "self_s": self_time,
+                "cum_s": cum_time,
+            }
+            for func, (_, total_calls, self_time, cum_time, _) in self._stats.items()
+        ]
+        rows.sort(key=lambda r: r["cum_s"], reverse=True)
+        return rows[:n]
+
+    def save(self, base_path):
+        # Mismo formato que Profile.dump_stats (lo lee pstats)
+        with open(base_path + ".prof", "wb") as f:
+            marshal.dump(self._stats, f)
+        return base_path + ".prof"
+
+
+class _SamplingProfiler:
+    """Muestrea la pila del hilo objetivo cada `interval` segundos desde un hilo aparte
+
+    Costo casi constante aunque el código llame millones de funciones; los tiempos son estimados
+    (muestras x intervalo). Guarda pilas colapsadas (.folded) para flamegraph/speedscope
+    """
+
+    mode = "sample"
+
+    def __init__(self, interval=SAMPLE_INTERVAL_SECONDS, watch_file=None):
+        self.interval = interval
+        # Con watch_file solo cuentan las pilas que pasan por ese script
+        self.watch_file = watch_file
+        self._target = threading.get_ident()
+        self._stacks = Counter()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sop-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._done.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    freeze = stop
+
+    def _run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            watched = self.watch_file is None
+            while frame is not None:
+                code = frame.f_code
+                stack.append(_function_name(code.co_filename, code.co_firstlineno, code.co_name))
+                watched = watched or code.co_filename == self.watch_file
+                frame = frame.f_back
+            if stack and watched:
+                self._stacks[tuple(reversed(stack))] += 1
+
+    def top(self, n):
+        own, total = Counter(), Counter()
+        for stack, count in self._stacks.items():
+            own[stack[-1]] += count
+            # Recursión: cada función cuenta una vez por pila
+            for func in set(stack):
+                total[func] += count
+        rows = [
+            {
+                "function": func,
+                "calls": None,
+                "self_s": own[func] * self.interval,
+                "cum_s": count * self.interval,
+            }
+            for func, count in total.items()
+        ]
+        rows.sort(key=lambda r: r["cum_s"], reverse=True)
+        return rows[:n]
+
+    def save(self, base_path):
+        with open(base_path + ".folded", "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+        return base_path + ".folded"
+
+
+# ==========================================
+# SESIÓN DE PERFIL
+# ==========================================
+
+class ProfileSession:
+    """Un perfil en curso: start() -> código perfilado -> finish() guarda y resume
+
+    watch_file: script cuyo marco debe seguir en la pila del hilo. Si desaparece antes de finish()
+    (rerun cortado por st.stop()/st.rerun()), un hilo vigilante congela el perfil en ese momento,
+    así el tiempo en espera hasta el siguiente rerun no entra en el perfil
+    """
+
+    def __init__(self, label, mode="cprofile", profile_dir=PROFILE_DIR, watch_file=None):
+        self.label = label
+        self.request_id = new_request_id(label)
+        self.profile_dir = profile_dir
+        self.watch_file = watch_file
+        self._profiler = _SamplingProfiler(watch_file=watch_file) if mode == "sample" else _DeterministicProfiler()
+        self._start = None
+        self._stopped_at = None
+        self._finished = threading.Event()
+        self._freeze_lock = threading.Lock()
+        self.result = None
+
+    @property
+    def mode(self):
+        return self._profiler.mode
+
+    def start(self):
+        self._start = time.perf_counter()
+        try:
+            self._profiler.start()
+        except ValueError:
+            # Solo puede haber un cProfile activo (p. ej. dos pestañas de admin): se muestrea
+            self._profiler = _SamplingProfiler(watch_file=self.watch_file)
+            self._profiler.start()
+        if self.watch_file is not None:
+            threading.Thread(
+                target=self._watch, args=(threading.get_ident(),), name="sop-profile-watch", daemon=True
+            ).start()
+        return self
+
+    def _watch(self, target):
+        while not self._finished.wait(WATCH_INTERVAL_SECONDS):
+            frame = sys._current_frames().get(target)
+            while frame is not None and frame.f_code.co_filename != self.watch_file:
+                frame = frame.f_back
+            if frame is None:
+                with self._freeze_lock:
+                    if not self._finished.is_set():
+                        self._stopped_at = time.perf_counter()
+                        self._profiler.freeze()
+                return
+
+    @property
+    def interrupted(self):
+        return self._stopped_at is not None
+
+    def finish(self, top_n=TOP_N):
+        """Detiene el perfilador, guarda el perfil y el resumen; idempotente"""
+        if self.result is not None:
+            return self.result
+        with self._freeze_lock:
+            self._finished.set()
+        self._profiler.stop()
+        # Interrumpido: solo cuenta hasta que el script dejó la pila
+        wall_s = (self._stopped_at or time.perf_counter()) - self._start
+        top = self._profiler.top(top_n)
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base_path = os.path.join(self.profile_dir, self.request_id)
+        raw_path = self._profiler.save(base_path)
+        label = f"{self.label}, interrumpido" if self.interrupted else self.label
+        report = format_report(self.request_id, label, self.mode, wall_s, top)
+        with open(base_path + ".txt", "w", encoding="utf-8") as f:
+            f.write(report)
+        self.result = {
+            "request_id": self.request_id,
+            "label": self.label,
+            "mode": self.mode,
+            "wall_s": wall_s,
+            "interrupted": self.interrupted,
+            "top": top,
+            "path": raw_path,
+            "report_path": base_path + ".txt",
+        }
+        return self.result
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.finish()
+        return False
+
+
+def profile_calls(fn, label, mode, on_result):
+    """Envuelve fn: cada llamada se perfila por separado y on_result recibe el resumen"""
+    def wrapper(*args, **kwargs):
+        session = ProfileSession(label, mode)
+        try:
+            with session:
+                return fn(*args, **kwargs)
+        finally:
+            if session.result is not None:
+                on_result(session.result)
+    return wrapper
+
+
+# ==========================================
+# REPORTES
+# ==========================================
+
+def format_report(request_id, label, mode, wall_s, top):
+    """Tabla de texto con las funciones más costosas (la que se descarga desde la UI)"""
+    lines = [
+        f"Perfil {request_id} ({label}, {mode}) · {wall_s * 1000:.0f} ms",
+        "",
+        f"{'acumulado ms':>12} {'propio ms':>10} {'llamadas':>9}  función",
+    ]
+    for row in top:
+        calls = "-" if row["calls"] is None else str(row["calls"])
+        lines.append(f"{row['cum_s'] * 1000:>12.1f} {row['self_s'] * 1000:>10.1f} {calls:>9}  {row['function']}")
+    return "\n".join(lines) + "\n"
+
+
+def read_profile_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def list_profiles(profile_dir=PROFILE_DIR, limit=10):
+    """Request IDs de los perfiles guardados, más recientes primero"""
+    try:
+        names = [n[:-4] for n in os.listdir(profile_dir) if n.endswith(".txt")]
+    except FileNotFoundError:
+        return []
+    return sorted(names, reverse=True)[:limit]
+
+
+def print_stats(path, top_n=TOP_N, sort="cumulative"):
+    """Resumen de un .prof guardado (para revisar perfiles fuera de la UI)"""
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats(sort).print_stats(top_n)
+    return out.getvalue()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Lista o muestra perfiles guardados")
+    parser.add_argument("request_id", nargs="?", help="Perfil a mostrar (por defecto lista los últimos)")
+    parser.add_argument("--top", type=int, default=TOP_N)
+    parser.add_argument("--sort", default="cumulative", help="Orden de pstats (cumulative, tottime, ...)")
+    args = parser.parse_args()
+
+    if not args.request_id:
+        for request_id in list_profiles(limit=50):
+            print(request_id)
+    else:
+        prof = os.path.join(PROFILE_DIR, args.request_id + ".prof")
+        if os.path.exists(prof):
+            print(print_stats(prof, args.top, args.sort))
+        else:
+            print(read_profile_file(os.path.join(PROFILE_DIR, args.request_id + ".txt")).decode("utf-8"))
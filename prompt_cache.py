@@ -0,0 +1,106 @@
+"""
+Caché de prefijos fijos de prompt (context caching de Gemini)
+El prefijo se registra una vez (en segundo plano) y las llamadas solo envían lo que cambia por petición
+"""
+
+import logging
+import os
+import threading
+import time
+
+from metrics import METRICS
+from prompt_templates import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_ENABLED = os.getenv("SOP_PROMPT_CACHE", "1") != "0"
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("SOP_PROMPT_CACHE_TTL", "3600"))
+
+# Se renueva antes de que expire; si el proveedor lo rechaza se reintenta más tarde
+REFRESH_MARGIN_SECONDS = 120
+RETRY_AFTER_SECONDS = 600
+
+# Mínimo de tokens que Gemini acepta en un CachedContent; por debajo ni se intenta
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+class PrefixCachedModel:
+    """Modelo con un prefijo fijo como system instruction, cacheado si el proveedor lo permite
+
+    model_factory(system_instruction=None, cached_content=None) crea el modelo;
+    cache_factory(prefix, ttl_seconds) registra el prefijo (None = sin caché, solo local).
+    El registro corre en un hilo aparte: mientras tanto las llamadas usan el respaldo local
+    """
+
+    def __init__(self, prefix, model_factory, cache_factory=None, name="prefijo",
+                 ttl_seconds=PROMPT_CACHE_TTL_SECONDS, min_tokens=PROMPT_CACHE_MIN_TOKENS,
+                 count_tokens=estimate_tokens):
+        self.system_prefix = prefix
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.prefix_tokens = count_tokens(prefix)
+        if cache_factory is not None and self.prefix_tokens < min_tokens:
+            logger.info("Prefijo '%s' con ~%s tokens (< %s): sin context caching, va como system instruction",
+                        name, self.prefix_tokens, min_tokens)
+            cache_factory = None
+        self._model_factory = model_factory
+        self._cache_factory = cache_factory
+        self._lock = threading.Lock()
+        self._registering = False
+        self._cached_model = None
+        self._expires_at = 0.0
+        self._retry_at = 0.0
+        # Respaldo local: el prefijo viaja en cada llamada como system instruction
+        self._fallback = model_factory(system_instruction=prefix)
+
+    @property
+    def model_name(self):
+        return getattr(self._fallback, "model_name", "desconocido")
+
+    @property
+    def cacheable(self):
+        """False si el prefijo nunca se registra (sin cache_factory o bajo el mínimo de tokens)"""
+        return self._cache_factory is not None
+
+    @property
+    def is_cached(self):
+        return self._cached_model is not None and time.time() < self._expires_at
+
+    def _register(self):
+        now = time.time()
+        try:
+            cached = self._cache_factory(self.system_prefix, self.ttl_seconds)
+            self._cached_model = self._model_factory(cached_content=cached)
+            self._expires_at = now + self.ttl_seconds
+            logger.info("Prefijo '%s' registrado en caché por %ss", self.name, self.ttl_seconds)
+        except Exception as e:
+            # p. ej. el conteo local se quedó corto frente al del proveedor o caching no disponible
+            logger.warning("Sin caché para '%s' (%s); se envía el prefijo en cada llamada", self.name, e)
+            self._retry_at = time.time() + RETRY_AFTER_SECONDS
+        finally:
+            self._registering = False
+
+    def _refresh_due(self, now):
+        return not self._registering and now >= self._expires_at - REFRESH_MARGIN_SECONDS and now >= self._retry_at
+
+    def _model(self):
+        if self._cache_factory is None:
+            return self._fallback
+        now = time.time()
+        if self._refresh_due(now):
+            with self._lock:
+                if self._refresh_due(now):
+                    # Fuera del camino de la petición (y del event loop en generate_content_async)
+                    self._registering = True
+                    threading.Thread(target=self._register, name=f"prompt-cache-{self.name}", daemon=True).start()
+        if self._cached_model is not None and now < self._expires_at:
+            METRICS.incr("prompt_cache_total", prefix=self.name, result="cached")
+            return self._cached_model
+        METRICS.incr("prompt_cache_total", prefix=self.name, result="fallback")
+        return self._fallback
+
+    def generate_content(self, contents, **kwargs):
+        return self._model().generate_content(contents, **kwargs)
+
+    async def generate_content_async(self, contents, **kwargs):
+        return await self._model().generate_content_async(contents, **kwargs)
@@ -0,0 +1,80 @@
+"""
+Plantillas de prompt precompiladas
+Segmentos fijos primero (prefijo cacheable), campos variables al final, una sola unión por llamada
+"""
+
+import hashlib
+
+# Misma aproximación que usa Gemini para texto en español/inglés (~4 caracteres por token)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text):
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class Static:
+    """Segmento fijo"""
+
+    __slots__ = ("name", "text")
+
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+
+
+class Slot:
+    """Segmento variable; `template` tiene un único {} donde va el valor"""
+
+    __slots__ = ("name", "before", "after", "template")
+
+    def __init__(self, name, template="{}"):
+        self.name = name
+        self.template = template
+        self.before, sep, self.after = template.partition("{}")
+        if not sep:
+            raise ValueError(f"El slot '{name}' necesita un '{{}}' en su plantilla")
+
+
+class PromptTemplate:
+    """Compila los segmentos una vez; render() solo inserta valores y une"""
+
+    def __init__(self, segments):
+        seen_slot = False
+        static = []
+        for segment in segments:
+            if isinstance(segment, Slot):
+                seen_slot = True
+            elif seen_slot:
+                raise ValueError(f"Segmento fijo '{segment.name}' después de un campo variable")
+            else:
+                static.append(segment)
+        self.segments = list(segments)
+        self.slots = [s for s in segments if isinstance(s, Slot)]
+        self.static_prefix = "".join(s.text for s in static)
+        self.static_tokens = {s.name: estimate_tokens(s.text) for s in static}
+        self.version = hashlib.sha256(
+            "\x00".join(getattr(s, "text", None) or s.template for s in segments).encode()
+        ).hexdigest()[:16]
+
+    def parts(self, include_static=True, **values):
+        """Lista [(segmento, texto)] lista para unir; omite el prefijo si ya está en caché"""
+        out = [("static", self.static_prefix)] if include_static else []
+        for slot in self.slots:
+            value = values.get(slot.name) or ""
+            # Un campo vacío no deja sus etiquetas (p. ej. historial sin mensajes)
+            out.append((slot.name, f"{slot.before}{value}{slot.after}" if value else ""))
+        return out
+
+    def render(self, include_static=True, **values):
+        return "".join(text for _, text in self.parts(include_static, **values))
+
+    def segment_tokens(self, parts):
+        """Tokens estimados por segmento de parts() (los fijos, precalculados)"""
+        counts = {}
+        for name, text in parts:
+            if name == "static":
+                counts.update(self.static_tokens)
+            else:
+                counts[name] = estimate_tokens(text)
+        return counts
@@ -0,0 +1,211 @@
+"""
+Normalización y enrutamiento de consultas antes de la búsqueda
+Saludos, agradecimientos y preguntas fuera de tema reciben una respuesta fija; las reformulaciones
+("resúmelo", "no entendí") van sin búsqueda, solo con el historial; los seguimientos cortos
+("¿y eso?", "¿se cura?", "sí") se buscan junto con la pregunta anterior. Todo es local, sin embeddings ni LLM
+"""
+
+import os
+import re
+import unicodedata
+
+QUERY_ROUTING_ENABLED = os.getenv("SOP_QUERY_ROUTING", "1") != "0"
+
+# Palabras máximas para considerar un mensaje como seguimiento o reformulación
+FOLLOWUP_MAX_WORDS = 7
+
+# Términos coloquiales -> término de la guía (texto normalizado, sin acentos)
+SYNONYMS = {
+    r"s\.?o\.?p|pcos|ovarios? poliquisticos?|sindrome de ovarios? poliquisticos?": "SOP",
+    r"regla|periodo": "menstruación",
+    r"pelos?|vellos?|vello (facial|corporal)": "hirsutismo",
+    r"caida del? (pelo|cabello)|calvicie": "alopecia",
+    r"granos|espinillas|barros": "acné",
+    r"pastillas? anticonceptivas?|la pildora|anticonceptivos": "anticonceptivos orales",
+    r"quedar embarazada|tener (hijos|un bebe)|embarazarme": "fertilidad",
+    r"azucar en la sangre|azucar alta": "glucosa",
+    r"sobrepeso|gordura|engordar|subir de peso|bajar de peso|adelgazar": "peso",
+    r"eco|ultrasonido": "ecografía",
+    r"hormona antimulleriana": "AMH",
+}
+_SYNONYM_PATTERNS = [(re.compile(rf"\b(?:{pattern})\b"), term) for pattern, term in SYNONYMS.items()]
+
+# Frases de cortesía (un mensaje que solo tiene estas frases no necesita la guía)
+SMALL_TALK = {
+    "greeting": ["hola", "holi", "buenas", "buenos dias", "buenas tardes", "buenas noches", "hey",
+                 "que tal", "como estas", "saludos", "hello", "hi"],
+    "thanks": ["gracias", "muchas gracias", "muchisimas gracias", "mil gracias", "gracias por la info(?:rmacion)?",
+               "gracias por tu ayuda", "ok", "okay", "vale", "perfecto", "genial", "entendido", "listo",
+               "de acuerdo", "super", "excelente", "thanks"],
+    "farewell": ["adios", "chao", "chau", "hasta luego", "hasta pronto", "nos vemos", "bye"],
+}
+_SMALL_TALK_PHRASES = "|".join(
+    sorted((p for phrases in SMALL_TALK.values() for p in phrases), key=len, reverse=True)
+)
+_SMALL_TALK = re.compile(rf"(?:(?:{_SMALL_TALK_PHRASES}|sofia)\s*)+")
+_SMALL_TALK_INTENTS = {
+    intent: re.compile(rf"\b(?:{'|'.join(phrases)})\b") for intent, phrases in SMALL_TALK.items()
+}
+
+# Raíces del dominio: si aparece alguna, la consulta va a la guía
+DOMAIN_TERMS = re.compile(
+    r"\b(?:sop|pcos|ovari|poliquist|quiste|menstrua|regla|periodo|ciclo|ovula|fertil|infertil|embaraz|"
+    r"hormon|androgen|testosteron|insulin|metformin|anticoncept|pildora|acne|granos|vello|pelo|hirsut|"
+    r"alopecia|peso|obesi|imc|dieta|aliment|comida|ejercicio|ansiedad|depresi|animo|estres|ecograf|eco|"
+    r"ultrason|amh|lh|fsh|diagnost|sintoma|tratamiento|medic|doctor|ginecolog|endocrin|salud|cuerpo|"
+    r"glucosa|azucar|diabet|colesterol|presion|sueno|apnea|piel|endometri|utero|sangr|analisis|laboratorio|"
+    # Vocabulario de la guía (criterios, fenotipos, riesgos, fármacos)
+    r"rotterdam|criterio|foliculo|folicular|fenotipo|hiperandrogen|oligo|anovula|amenorrea|menopaus|"
+    r"adolescen|cardiovascular|cardiaco|corazon|hipertens|lipid|trigliceri|metabolic|tiroid|prolactin|"
+    r"cancer|riesgo|hereditar|genetic|gestacional|preeclampsia|aborto|letrozol|clomifen|inositol|"
+    r"espironolacton|estatina|bariatric|guia|eshre|sindrome|enfermedad|cura)",
+)
+
+# Términos del dominio que no nombran un tema por sí solos ("¿Es hereditario?", "¿Se cura?",
+# "Tratamientos"): sin otro término, el mensaje sigue hablando del tema anterior
+GENERIC_TERMS = re.compile(
+    r"(?:sintoma|tratamiento|medic|doctor|ginecolog|endocrin|salud|cuerpo|analisis|laboratorio|diagnost|"
+    r"criterio|riesgo|hereditar|genetic|cura|enfermedad|sindrome|guia|eshre)"
+)
+
+# Temas claramente ajenos: solo señales inequívocas (y además ningún término del dominio);
+# palabras ambiguas como "serie", "partido" o "programa" no cuentan
+OFF_TOPIC_TERMS = re.compile(
+    r"\b(?:futbol|pelicula|telenovela|bitcoin|cripto(?:moneda)?s?|horoscopo|videojuego|"
+    r"programar en|lenguaje de programacion|python|javascript|chiste|"
+    r"capital de (?:francia|espana|mexico|colombia|argentina|peru|chile)|traduce(?:me)? al)\b"
+)
+
+# Reformulaciones de la respuesta anterior (no necesitan contexto nuevo de la guía)
+HISTORY_ONLY = re.compile(
+    r"\b(?:resum[ea]\w*|mas (?:simple|sencillo|corto|claro)|en palabras (?:simples|sencillas)|"
+    r"explica\w* (?:de otra (?:forma|manera)|otra vez|mejor)|no (?:te )?entendi|no entiendo|repite\w*|"
+    r"dame un ejemplo|un ejemplo|en (?:una|pocas) palabras?)\b"
+)
+
+# Seguimientos que dependen de la pregunta anterior
+FOLLOWUP_START = re.compile(r"^(?:y|pero|entonces|o sea|osea|tambien|ademas)\b")
+FOLLOWUP_REFERENCE = re.compile(
+    r"\b(?:eso|esto|esa|ese|esas|esos|lo anterior|lo ultimo|por que|como asi|en serio|"
+    r"(?:dime|cuentame|explicame) mas|mas detalles?|(?:algo|que) mas|y si|"
+    # Pronombres que apuntan a lo anterior: "¿La puedo tomar...?", "¿Cómo prevenirlo?"
+    r"(?:lo|la|los|las|le|les) (?:puedo|puede|debo|debe|tengo|tiene|tomo|toma|uso|usa|hago|hace)|"
+    r"\w{2,}(?:ar|er|ir)(?:l[oa]s?|les?))\b"
+)
+
+CANNED_REPLIES = {
+    "greeting": "¡Hola! 💜 Soy Sofía. Pregúntame lo que quieras sobre el SOP: síntomas, diagnóstico, "
+                "tratamiento, alimentación o cómo te sientes.",
+    "thanks": "¡Con mucho gusto! 💜 Si te queda alguna duda sobre el SOP, aquí estoy.",
+    "farewell": "¡Cuídate mucho! 💜 Recuerda que tu médico es quien mejor puede acompañarte. "
+                "Vuelve cuando quieras.",
+    "off_topic": "Me encantaría ayudarte, pero solo puedo hablar del Síndrome de Ovario Poliquístico (SOP) 💜. "
+                 "¿Tienes alguna pregunta sobre síntomas, diagnóstico, tratamiento o cómo vivir con SOP?",
+}
+
+HISTORY_ONLY_NOTE = "\n(Responde solo con lo ya explicado en la conversación previa)"
+
+
+def strip_accents(text):
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def normalize(text):
+    """Minúsculas, sin acentos ni signos, espacios simples"""
+    text = strip_accents(text.lower())
+    text = re.sub(r"[^\w\s.]", " ", text).replace("_", " ")
+    text = re.sub(r"(?<!\w)\.|\.(?!\w)", " ", text)
+    return " ".join(text.split())
+
+
+def canonical_terms(normalized):
+    """Términos de la guía que corresponden a sinónimos coloquiales de la consulta"""
+    terms = []
+    for pattern, term in _SYNONYM_PATTERNS:
+        if pattern.search(normalized) and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def expand_query(query, normalized=None):
+    """Consulta + términos canónicos que aún no menciona (mejor recuperación de la guía)"""
+    normalized = normalize(query) if normalized is None else normalized
+    missing = [
+        t for t in canonical_terms(normalized) if not re.search(rf"\b{re.escape(normalize(t))}\b", normalized)
+    ]
+    return f"{query} ({', '.join(missing)})" if missing else query
+
+
+def context_key(route):
+    """Clave del contexto recuperado para la ruta (la consulta de búsqueda normalizada)"""
+    return normalize(route.search_query)
+
+
+def names_topic(normalized):
+    """True si el mensaje nombra un tema del dominio (no solo términos genéricos como "riesgo")"""
+    return any(not GENERIC_TERMS.fullmatch(term) for term in DOMAIN_TERMS.findall(normalized))
+
+
+def _last(chat_history, role):
+    for msg in reversed(list(chat_history or ())):
+        if msg["role"] == role:
+            return msg["content"]
+    return None
+
+
+class Route:
+    """Decisión del enrutador: intent + consulta para la búsqueda + pregunta para el prompt
+
+    reply no es None cuando no hace falta ni búsqueda ni LLM; reuse_context indica que el
+    contexto de la búsqueda anterior de la conversación sirve tal cual
+    """
+
+    __slots__ = ("intent", "normalized", "search_query", "question", "reply", "reuse_context")
+
+    def __init__(self, intent, normalized, search_query=None, question=None, reply=None, reuse_context=False):
+        self.intent = intent
+        self.normalized = normalized
+        self.search_query = search_query
+        self.question = question
+        self.reply = reply
+        self.reuse_context = reuse_context
+
+    @property
+    def needs_search(self):
+        return self.reply is None and self.intent != "history"
+
+    def __repr__(self):
+        return f"Route({self.intent!r}, search_query={self.search_query!r})"
+
+
+def route_query(query, chat_history=()):
+    """rag | follow_up | history | greeting | thanks | farewell | off_topic"""
+    normalized = normalize(query)
+
+    if not normalized or _SMALL_TALK.fullmatch(normalized):
+        intents = [i for i, p in _SMALL_TALK_INTENTS.items() if p.search(normalized)] or ["greeting"]
+        # "ok gracias, adiós" -> despedida; "hola, gracias" -> agradecimiento
+        intent = intents[-1]
+        return Route(intent, normalized, reply=CANNED_REPLIES[intent])
+
+    in_domain = bool(DOMAIN_TERMS.search(normalized))
+    if not in_domain and OFF_TOPIC_TERMS.search(normalized):
+        return Route("off_topic", normalized, reply=CANNED_REPLIES["off_topic"])
+
+    words = len(normalized.split())
+    previous_question = _last(chat_history, "user")
+    if previous_question is not None and words <= FOLLOWUP_MAX_WORDS:
+        if not in_domain and _last(chat_history, "assistant") and HISTORY_ONLY.search(normalized):
+            return Route("history", normalized, question=query + HISTORY_ONLY_NOTE)
+        after_answer = _last(chat_history, "assistant") is not None
+        # Sin señal de continuación, un mensaje que nombra un tema es una pregunta nueva
+        # ("Riesgo de diabetes", "¿Qué es metformina?"), por corto que sea
+        cue = FOLLOWUP_START.match(normalized) or FOLLOWUP_REFERENCE.search(normalized)
+        if cue or (after_answer and not names_topic(normalized)):
+            # "¿y eso?" / "¿se cura?" se busca como la pregunta anterior + lo nuevo
+            rewritten = f"{previous_question} {query}"
+            # Sin términos nuevos del dominio, el contexto anterior basta
+            return Route("follow_up", normalized, search_query=expand_query(rewritten), question=query,
+                         reuse_context=not in_domain)
+
+    return Route("rag", normalized, search_query=expand_query(query, normalized), question=query)
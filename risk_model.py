@@ -0,0 +1,175 @@
+"""
+Motor de puntuación del modelo de riesgo de SOP (solo NumPy)
+Carga los artefactos exportados de los notebooks: regresión logística (RFE, 12 variables)
+y random forest recorrido de forma vectorizada
+"""
+
+import glob
+import json
+import os
+import re
+
+import numpy as np
+
+ARTIFACTS_DIR = "./models/artifacts"
+ARTIFACT_PREFIX = "pcos_risk_v"
+
+# Orden de columnas del notebook de random forest (PCOS_data_cleaned.csv)
+RISK_FEATURES = [
+    "FollicleNoR",
+    "SkinDarkening",
+    "HairGrowth",
+    "WeightGain",
+    "Cycle",
+    "FastFood",
+    "Pimples",
+    "AMH",
+    "Weight",
+    "HairLoss",
+    "Waist",
+    "CycleLength",
+]
+
+# Filas por bloque al recorrer el bosque (los índices de trabajo caben en caché)
+FOREST_CHUNK_ROWS = 1024
+
+# Formulario del panel: etiqueta, tipo y rango (flags Y/N como 0/1; Cycle 2=regular, 4=irregular)
+FEATURE_SPECS = {
+    "FollicleNoR": {"label": "Folículos en ovario derecho (ecografía)", "kind": "int", "min": 0, "max": 30, "default": 6},
+    "SkinDarkening": {"label": "Oscurecimiento de la piel", "kind": "flag", "default": 0},
+    "HairGrowth": {"label": "Crecimiento de vello (hirsutismo)", "kind": "flag", "default": 0},
+    "WeightGain": {"label": "Aumento de peso reciente", "kind": "flag", "default": 0},
+    "Cycle": {"label": "Ciclos irregulares", "kind": "cycle", "default": 2},
+    "FastFood": {"label": "Comida rápida frecuente", "kind": "flag", "default": 0},
+    "Pimples": {"label": "Acné", "kind": "flag", "default": 0},
+    "AMH": {"label": "AMH (ng/mL)", "kind": "float", "min": 0.0, "max": 70.0, "default": 3.7},
+    "Weight": {"label": "Peso (kg)", "kind": "float", "min": 30.0, "max": 150.0, "default": 59.0},
+    "HairLoss": {"label": "Caída de cabello", "kind": "flag", "default": 0},
+    "Waist": {"label": "Cintura (pulgadas)", "kind": "int", "min": 20, "max": 60, "default": 34},
+    "CycleLength": {"label": "Días de sangrado por periodo", "kind": "int", "min": 0, "max": 15, "default": 5},
+}
+
+
+def artifact_paths(version, directory=ARTIFACTS_DIR):
+    base = os.path.join(directory, f"{ARTIFACT_PREFIX}{version}")
+    return base + ".npz", base + ".json"
+
+
+def latest_version(directory=ARTIFACTS_DIR):
+    """Versión más alta con manifiesto en el directorio de artefactos"""
+    versions = []
+    for path in glob.glob(os.path.join(directory, f"{ARTIFACT_PREFIX}*.json")):
+        match = re.search(rf"{ARTIFACT_PREFIX}(\d+)\.json$", path)
+        if match:
+            versions.append(int(match.group(1)))
+    if not versions:
+        raise FileNotFoundError(
+            f"No hay artefactos en {directory}. Ejecuta primero: python export_risk_model.py"
+        )
+    return max(versions)
+
+
+class RiskScorer:
+    """Puntúa un formulario o un lote (filas x RISK_FEATURES) con ambos modelos"""
+
+    def __init__(self, arrays, manifest):
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self.features = manifest["features"]
+        self.threshold = manifest["logistic"]["threshold"]
+        self._fill = arrays["fill_values"].astype(np.float64)
+
+        # Regresión logística: p = sigmoid(X·coef + b)
+        self._coef = arrays["lr_coef"].astype(np.float64)
+        self._intercept = float(arrays["lr_intercept"])
+
+        # Bosque aplanado: todos los árboles en los mismos arreglos, raíces en rf_roots.
+        # Las hojas apuntan a sí mismas con umbral +inf, así todas las filas dan
+        # max_depth pasos sin máscaras; children[2*nodo + (x > umbral)] es el siguiente nodo
+        left = arrays["rf_left"].astype(np.int32)
+        right = arrays["rf_right"].astype(np.int32)
+        leaf = left < 0
+        node_ids = np.arange(left.size, dtype=np.int32)
+        left[leaf] = node_ids[leaf]
+        right[leaf] = node_ids[leaf]
+        self._children = np.column_stack([left, right]).ravel()
+        self._feature = np.where(leaf, 0, arrays["rf_feature"]).astype(np.int32)
+        self._threshold = np.where(leaf, np.inf, arrays["rf_threshold"])
+        self._leaf_proba = arrays["rf_proba"].astype(np.float64)
+        self._roots = arrays["rf_roots"].astype(np.int32)
+        self._depth = int(arrays["rf_max_depth"])
+
+    @classmethod
+    def load(cls, version=None, directory=ARTIFACTS_DIR):
+        version = latest_version(directory) if version is None else version
+        npz_path, json_path = artifact_paths(version, directory)
+        with open(json_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        with np.load(npz_path) as data:
+            arrays = {name: data[name] for name in data.files}
+        return cls(arrays, manifest)
+
+    # ==========================================
+    # ENTRADAS
+    # ==========================================
+
+    def to_matrix(self, rows):
+        """Lista de dicts, DataFrame o arreglo -> matriz float64 en el orden del modelo"""
+        if hasattr(rows, "columns"):
+            missing = [f for f in self.features if f not in rows.columns]
+            if missing:
+                raise ValueError(f"Faltan columnas: {', '.join(missing)}")
+            X = rows[self.features].to_numpy(dtype=np.float64, na_value=np.nan)
+        elif isinstance(rows, np.ndarray):
+            X = np.array(rows, dtype=np.float64).reshape(-1, len(self.features))
+        else:
+            X = np.array([[row.get(f, np.nan) for f in self.features] for row in rows], dtype=np.float64)
+        # Mismo relleno que el notebook (media de la columna en entrenamiento)
+        nan_rows, nan_cols = np.nonzero(np.isnan(X))
+        X[nan_rows, nan_cols] = self._fill[nan_cols]
+        return X
+
+    # ==========================================
+    # MODELOS
+    # ==========================================
+
+    def logistic_proba(self, X):
+        z = X @ self._coef + self._intercept
+        return 1.0 / (1.0 + np.exp(-z))
+
+    def forest_proba(self, X):
+        """Recorre todos los árboles a la vez: un paso por nivel para todas las filas"""
+        n_rows, n_features = X.shape
+        n_trees = self._roots.size
+        # sklearn compara los valores en float32
+        flat = X.astype(np.float32).astype(np.float64).ravel()
+        out = np.empty(n_rows)
+        for start in range(0, n_rows, FOREST_CHUNK_ROWS):
+            stop = min(start + FOREST_CHUNK_ROWS, n_rows)
+            offsets = (np.arange(start, stop, dtype=np.int32) * n_features).repeat(n_trees)
+            nodes = np.tile(self._roots, stop - start)
+            for _ in range(self._depth):
+                go_right = flat[offsets + self._feature[nodes]] > self._threshold[nodes]
+                nodes = self._children[2 * nodes + go_right]
+            out[start:stop] = self._leaf_proba[nodes].reshape(-1, n_trees).mean(axis=1)
+        return out
+
+    def score_batch(self, rows):
+        """Probabilidades de ambos modelos para un lote (vectorizado)"""
+        X = self.to_matrix(rows)
+        logistic = self.logistic_proba(X)
+        return {
+            "logistic": logistic,
+            "forest": self.forest_proba(X),
+            "logistic_flag": logistic >= self.threshold,
+        }
+
+    def score(self, features):
+        """Un formulario (dict) -> probabilidades como floats"""
+        result = self.score_batch([features])
+        return {
+            "logistic": float(result["logistic"][0]),
+            "forest": float(result["forest"][0]),
+            "logistic_flag": bool(result["logistic_flag"][0]),
+            "version": self.version,
+        }
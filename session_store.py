@@ -0,0 +1,507 @@
+"""
+Historial de sesión acotado y persistente
+Ventana reciente en memoria + conversación completa en SQLite (escritura diferida en segundo plano);
+una sesión se retoma con su código anónimo
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+
+from query_router import context_key
+
+logger = logging.getLogger(__name__)
+
+SESSION_DB_PATH = "./session_data/sesiones.db"
+SESSION_WINDOW = int(os.getenv("SOP_SESSION_WINDOW", "20"))
+
+# Conversaciones sin actividad por más de este tiempo se borran
+SESSION_TTL_DAYS = float(os.getenv("SOP_SESSION_TTL_DAYS", "30"))
+
+# Escritura diferida: se agrupan las escrituras hasta WRITE_BATCH o WRITE_INTERVAL_SECONDS
+WRITE_INTERVAL_SECONDS = 0.5
+WRITE_BATCH = 256
+
+# Contextos recuperados que se guardan por conversación
+CONTEXT_CACHE_ENTRIES = 20
+
+_SESSION_ID = re.compile(r"[0-9a-f]{32}")
+
+# ==========================================
+# REGISTROS COMPACTOS
+# ==========================================
+
+class ChatRecord:
+    """Mensaje del chat (rol internado, sin dict por mensaje)"""
+
+    __slots__ = ("role", "content", "timestamp", "sources")
+
+    def __init__(self, role, content, timestamp=None, sources=()):
+        self.role = sys.intern(role)
+        self.content = content
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        # Páginas de la guía usadas para la respuesta (0-based, como PyPDFLoader)
+        self.sources = tuple(sources)
+
+    def __getitem__(self, key):
+        # Compatibilidad con el formato anterior {"role": ..., "content": ...}
+        return getattr(self, key)
+
+
+class ImageRecord:
+    """Análisis de imagen guardado en el historial"""
+
+    __slots__ = ("timestamp", "type", "analysis")
+
+    def __init__(self, timestamp, type, analysis):
+        self.timestamp = timestamp
+        self.type = sys.intern(type)
+        self.analysis = analysis
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+# ==========================================
+# ALMACÉN SQLITE (UNO POR PROCESO)
+# ==========================================
+
+_db_lock = threading.Lock()
+_db_connections = {}
+
+
+def _connect(db_path):
+    """Conexión compartida por proceso (las sesiones de Streamlit son hilos)"""
+    conn = _db_connections.get(db_path)
+    if conn is None:
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS registros (
+                session_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                datos TEXT NOT NULL,
+                PRIMARY KEY (session_id, kind, seq)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS contextos (
+                session_id TEXT NOT NULL,
+                clave TEXT NOT NULL,
+                indice TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                docs TEXT NOT NULL,
+                PRIMARY KEY (session_id, clave)
+            )
+        """)
+        conn.commit()
+        _db_connections[db_path] = conn
+    return conn
+
+
+class _WriteBehind:
+    """Hilo único que agrupa las escrituras de todas las sesiones en transacciones
+
+    El camino de cada respuesta solo encola; el orden de las escrituras se respeta.
+    Cada escritura lleva la sesión a la que pertenece: flush(session_id) espera solo las suyas
+    """
+
+    # Marca en la cola: escribir lo acumulado sin esperar al intervalo
+    _NOW = object()
+
+    def __init__(self, interval=WRITE_INTERVAL_SECONDS, batch=WRITE_BATCH):
+        self.interval = interval
+        self.batch = batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._pending = Counter()
+        self._written = threading.Condition()
+
+    def put(self, db_path, sql, params, session_id=None, on_written=None):
+        """Encola una escritura; on_written() se llama tras el commit (desde el hilo de escritura)"""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="sop-session-writer", daemon=True)
+                    self._thread.start()
+        with self._written:
+            self._pending[session_id] += 1
+        self._queue.put((db_path, sql, params, session_id, on_written))
+
+    def flush(self, session_id=None):
+        """Espera a que lo encolado esté en disco
+
+        Con session_id solo espera las escrituras de esa sesión (retomar una conversación);
+        sin él, todo (salida del proceso)
+        """
+        if self._thread is None:
+            return
+        if session_id is None:
+            self._queue.join()
+            return
+        with self._written:
+            if not self._pending[session_id]:
+                return
+        self._queue.put(self._NOW)
+        with self._written:
+            self._written.wait_for(lambda: not self._pending[session_id])
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(items) < self.batch and items[-1] is not self._NOW:
+                try:
+                    items.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            writes = [item for item in items if item is not self._NOW]
+            try:
+                self._write(writes)
+            except Exception:
+                logger.exception("No se pudieron guardar %d escrituras de sesión", len(writes))
+            else:
+                for *_, on_written in writes:
+                    if on_written is not None:
+                        on_written()
+            finally:
+                with self._written:
+                    for _, _, _, session_id, _ in writes:
+                        self._pending[session_id] -= 1
+                        if not self._pending[session_id]:
+                            del self._pending[session_id]
+                    self._written.notify_all()
+                for _ in items:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _write(items):
+        with _db_lock:
+            touched = set()
+            for db_path, sql, params, _, _ in items:
+                conn = _connect(db_path)
+                conn.execute(sql, params)
+                touched.add(conn)
+            for conn in touched:
+                conn.commit()
+
+
+_writer = _WriteBehind()
+atexit.register(_writer.flush)
+
+
+def flush_writes(session_id=None):
+    _writer.flush(session_id)
+
+
+def new_session_id():
+    """Identificador anónimo de sesión"""
+    return uuid.uuid4().hex
+
+
+def is_session_id(value):
+    return bool(value) and _SESSION_ID.fullmatch(value) is not None
+
+
+def session_exists(session_id, db_path=SESSION_DB_PATH):
+    """True si hay una conversación guardada con ese token"""
+    if not is_session_id(session_id):
+        return False
+    with _db_lock:
+        row = _connect(db_path).execute(
+            "SELECT 1 FROM registros WHERE session_id = ? LIMIT 1", (session_id,)
+        ).fetchone()
+    return row is not None
+
+
+def purge_expired(max_age_seconds=SESSION_TTL_DAYS * 24 * 3600, db_path=SESSION_DB_PATH):
+    """Borra las conversaciones sin actividad reciente (completas, no turnos sueltos)"""
+    cutoff = time.time() - max_age_seconds
+    with _db_lock:
+        conn = _connect(db_path)
+        expired = [row[0] for row in conn.execute(
+            "SELECT session_id FROM registros GROUP BY session_id HAVING MAX(created_at) < ?", (cutoff,)
+        )]
+        conn.executemany("DELETE FROM registros WHERE session_id = ?", [(sid,) for sid in expired])
+        conn.executemany("DELETE FROM contextos WHERE session_id = ?", [(sid,) for sid in expired])
+        conn.execute("DELETE FROM contextos WHERE created_at < ?", (cutoff,))
+        conn.commit()
+        return len(expired)
+
+
+# ==========================================
+# HISTORIAL ACOTADO
+# ==========================================
+
+class BoundedHistory:
+    """Mantiene solo los últimos `window` registros en memoria; todos quedan en SQLite"""
+
+    record_cls = None
+    kind = None
+    interned_fields = ()
+
+    def __init__(self, session_id, window=SESSION_WINDOW, db_path=SESSION_DB_PATH):
+        self.session_id = session_id
+        self.window = window
+        self.db_path = db_path
+        self._recent = deque()
+        self._spilled = 0
+        # Índice global -> registro aún en la cola de escritura (se mezcla con lo leído de SQLite)
+        self._unsaved = {}
+
+    @classmethod
+    def resume(cls, session_id, window=SESSION_WINDOW, db_path=SESSION_DB_PATH):
+        """Historial guardado de la sesión: los últimos `window` registros vuelven a memoria"""
+        history = cls(session_id, window, db_path)
+        # Otra pestaña pudo dejar escrituras de esta sesión en cola
+        _writer.flush(session_id)
+        with _db_lock:
+            (total,) = _connect(db_path).execute(
+                "SELECT COUNT(*) FROM registros WHERE session_id = ? AND kind = ?", (session_id, cls.kind)
+            ).fetchone()
+        history._spilled = max(total - window, 0)
+        history._recent.extend(history._load(history._spilled, total))
+        return history
+
+    def append(self, *fields):
+        record = self.record_cls(*fields)
+        self._persist(record, len(self))
+        self._recent.append(record)
+        if len(self._recent) > self.window:
+            # Ya está en disco: salir de la ventana no escribe nada
+            self._recent.popleft()
+            self._spilled += 1
+        return record
+
+    def _persist(self, record, index):
+        """Encola el registro; el hilo de escritura lo guarda (sin I/O en la petición)
+
+        El seq lo asigna la base (MAX + 1) en el hilo de escritura, que es el único que escribe:
+        dos pestañas con la misma sesión agregan registros sin pisarse. Hasta el commit el registro
+        queda en _unsaved, así leer el historial no espera a la cola
+        """
+        datos = json.dumps(
+            [getattr(record, name) for name in self.record_cls.__slots__],
+            ensure_ascii=False
+        )
+        self._unsaved[index] = record
+        _writer.put(
+            self.db_path,
+            "INSERT INTO registros "
+            "SELECT ?, ?, COALESCE(MAX(seq) + 1, 0), ?, ? FROM registros WHERE session_id = ? AND kind = ?",
+            (self.session_id, self.kind, time.time(), datos, self.session_id, self.kind),
+            session_id=self.session_id,
+            on_written=lambda: self._saved(index, record),
+        )
+
+    def _saved(self, index, record):
+        # Tras clear() el mismo índice puede ser ya otro registro
+        if self._unsaved.get(index) is record:
+            self._unsaved.pop(index, None)
+
+    def _load(self, start, stop):
+        """Registros con seq en [start, stop): SQLite + los que aún esperan en la cola de escritura"""
+        # Copia antes de leer: lo que falte en ella ya estaba en disco al consultar
+        unsaved = dict(self._unsaved)
+        with _db_lock:
+            rows = _connect(self.db_path).execute(
+                "SELECT seq, datos FROM registros "
+                "WHERE session_id = ? AND kind = ? AND seq >= ? AND seq < ? "
+                "ORDER BY seq",
+                (self.session_id, self.kind, start, stop)
+            ).fetchall()
+        records = {seq: self.record_cls(*json.loads(datos)) for seq, datos in rows}
+        records.update((i, record) for i, record in unsaved.items() if start <= i < stop)
+        return [records[i] for i in sorted(records)]
+
+    def __iter__(self):
+        """Solo la ventana en memoria"""
+        return iter(self._recent)
+
+    def __len__(self):
+        return self._spilled + len(self._recent)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def recent(self, n):
+        """Últimos n registros (recupera de disco si n excede la ventana)"""
+        if n <= len(self._recent):
+            return list(self._recent)[len(self._recent) - n:]
+        missing = min(n - len(self._recent), self._spilled)
+        return self._load(self._spilled - missing, self._spilled) + list(self._recent)
+
+    def page(self, start, stop):
+        """Registros con índice global en [start, stop) (disco + memoria)"""
+        start, stop = max(start, 0), min(stop, len(self))
+        if start >= stop:
+            return []
+        records = []
+        if start < self._spilled:
+            records = self._load(start, min(stop, self._spilled))
+        if stop > self._spilled:
+            window = list(self._recent)
+            records += window[max(start - self._spilled, 0):stop - self._spilled]
+        return records
+
+    def iter_all(self, page_size=200):
+        """Recorre el historial completo, de disco a memoria, por páginas"""
+        for start in range(0, self._spilled, page_size):
+            yield from self._load(start, min(start + page_size, self._spilled))
+        yield from list(self._recent)
+
+    def clear(self):
+        _writer.put(
+            self.db_path,
+            "DELETE FROM registros WHERE session_id = ? AND kind = ?",
+            (self.session_id, self.kind),
+            session_id=self.session_id,
+        )
+        self._unsaved.clear()
+        self._recent.clear()
+        self._spilled = 0
+
+    def memory_bytes(self):
+        """Estimación del tamaño en memoria de la ventana"""
+        total = sys.getsizeof(self) + sys.getsizeof(self._recent)
+        for record in self._recent:
+            total += sys.getsizeof(record)
+            for name in self.record_cls.__slots__:
+                # Los roles/tipos internados se comparten entre sesiones
+                if name not in self.interned_fields:
+                    total += sys.getsizeof(getattr(record, name))
+        return total
+
+
+class ChatHistory(BoundedHistory):
+    """Historial del chat"""
+
+    record_cls = ChatRecord
+    kind = "chat"
+    interned_fields = ("role",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_turns = 0
+
+    @classmethod
+    def resume(cls, session_id, window=SESSION_WINDOW, db_path=SESSION_DB_PATH):
+        history = super().resume(session_id, window, db_path)
+        with _db_lock:
+            (history.user_turns,) = _connect(db_path).execute(
+                "SELECT COUNT(*) FROM registros "
+                "WHERE session_id = ? AND kind = ? AND json_extract(datos, '$[0]') = 'user'",
+                (session_id, cls.kind)
+            ).fetchone()
+        return history
+
+    def append(self, role, content, timestamp=None, sources=()):
+        if role == "user":
+            self.user_turns += 1
+        return super().append(role, content, timestamp, sources)
+
+    def clear(self):
+        super().clear()
+        self.user_turns = 0
+
+
+class ImageHistory(BoundedHistory):
+    """Historial de análisis de imágenes"""
+
+    record_cls = ImageRecord
+    kind = "image"
+    interned_fields = ("type",)
+
+
+# ==========================================
+# CONTEXTO RECUPERADO POR CONVERSACIÓN
+# ==========================================
+
+class ContextCache:
+    """Chunks de la guía ya recuperados en la conversación (consulta normalizada -> [(texto, metadata)])
+
+    Un seguimiento de una sesión retomada reutiliza el contexto sin volver a buscar.
+    Cada entrada recuerda la versión del índice de la que salió
+    """
+
+    def __init__(self, session_id, db_path=SESSION_DB_PATH, max_entries=CONTEXT_CACHE_ENTRIES):
+        self.session_id = session_id
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    @classmethod
+    def resume(cls, session_id, db_path=SESSION_DB_PATH, max_entries=CONTEXT_CACHE_ENTRIES):
+        cache = cls(session_id, db_path, max_entries)
+        _writer.flush(session_id)
+        with _db_lock:
+            rows = _connect(db_path).execute(
+                "SELECT clave, indice, docs FROM contextos WHERE session_id = ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (session_id, max_entries)
+            ).fetchall()
+        for key, index, docs in reversed(rows):
+            cache._entries[key] = (index, [tuple(doc) for doc in json.loads(docs)])
+        return cache
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, index):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != index:
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def latest(self, index):
+        """Contexto de la última búsqueda (el que usa un seguimiento como "¿y eso?")"""
+        if not self._entries:
+            return None
+        key = next(reversed(self._entries))
+        return self.get(key, index)
+
+    def for_route(self, route, index):
+        """Contexto guardado que sirve para la ruta: el último si es un seguimiento sin términos nuevos"""
+        return self.latest(index) if route.reuse_context else self.get(context_key(route), index)
+
+    def put(self, key, index, docs):
+        """docs: Documents de langchain o pares (texto, metadata)"""
+        pairs = [
+            (d.page_content, dict(d.metadata)) if hasattr(d, "page_content") else tuple(d) for d in docs
+        ]
+        self._entries[key] = (index, pairs)
+        self._entries.move_to_end(key)
+        _writer.put(
+            self.db_path,
+            "INSERT OR REPLACE INTO contextos VALUES (?, ?, ?, ?, ?)",
+            (self.session_id, key, index, time.time(), json.dumps(pairs, ensure_ascii=False)),
+            session_id=self.session_id,
+        )
+        while len(self._entries) > self.max_entries:
+            old_key, _ = self._entries.popitem(last=False)
+            _writer.put(
+                self.db_path,
+                "DELETE FROM contextos WHERE session_id = ? AND clave = ?",
+                (self.session_id, old_key),
+                session_id=self.session_id,
+            )
+
+    def clear(self):
+        self._entries.clear()
+        _writer.put(
+            self.db_path, "DELETE FROM contextos WHERE session_id = ?", (self.session_id,), session_id=self.session_id
+        )
@@ -0,0 +1,888 @@
+"""
+Motor del chatbot SOP
+Búsqueda, generación de respuestas y análisis de imágenes sin depender de la UI
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+import google.generativeai as genai
+from langchain_community.embeddings import HuggingFaceEmbeddings
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+
+from embedding_batcher import EMBED_BATCH_WINDOW_MS, BatchingEmbeddings
+from embedding_compression import CompressedIndex, ProjectedEmbeddings, compressed_search
+from friendly_errors import friendly_error
+from gemini_pool import GeminiPool, PooledModel, key_label
+from guided_topics import topics_version
+from index_manager import INDEX_ROOT, IndexManager
+from metrics import METRICS
+from page_previews import PagePreviews
+from prompt_cache import PROMPT_CACHE_ENABLED, PrefixCachedModel
+from prompt_templates import PromptTemplate, Slot, Static
+from query_router import QUERY_ROUTING_ENABLED, Route, context_key, route_query
+
+logger = logging.getLogger(__name__)
+
+# Índice sin versionar (anterior a indices/); se usa si no existe indices/CURRENT
+VECTORSTORE_DIR = "./chroma_db_sop"
+COLLECTION_NAME = "sop_medical_guide"
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+GEMINI_MODEL = "gemini-2.5-flash-lite"
+
+# Etapas de las métricas: consultas de usuarias vs precálculo de temas guiados
+CHAT_STAGE = "chat_total"
+WARMUP_STAGE = "guided_topics_warmup"
+
+# Hilos para el trabajo de CPU del camino async (codificar consulta, buscar)
+CPU_WORKERS = int(os.getenv("SOP_CPU_WORKERS", str(os.cpu_count() or 4)))
+
+# ==========================================
+# MODELO GEMINI
+# ==========================================
+
+GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 2048,
+}
+
+SAFETY_SETTINGS = {
+    'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
+    'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
+    'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_LOW_AND_ABOVE',
+    'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_MEDIUM_AND_ABOVE',
+}
+
+def build_model(model_name=GEMINI_MODEL, system_instruction=None, cached_content=None, api_key=None):
+    """Modelo Gemini con la configuración del chatbot (requiere genai.configure)
+
+    api_key usa clientes propios en vez de la clave global (pool de varias claves)
+    """
+    if cached_content is not None:
+        model = genai.GenerativeModel.from_cached_content(
+            cached_content,
+            generation_config=GENERATION_CONFIG,
+            safety_settings=SAFETY_SETTINGS,
+        )
+    else:
+        model = genai.GenerativeModel(
+            model_name,
+            generation_config=GENERATION_CONFIG,
+            safety_settings=SAFETY_SETTINGS,
+            system_instruction=system_instruction,
+        )
+    if api_key is not None:
+        bind_api_key(model, api_key)
+    return model
+
+def bind_api_key(model, api_key):
+    """Clientes propios con api_key en un GenerativeModel (en vez de la clave global)
+
+    google-generativeai no expone una clave por modelo: se usan los atributos privados _client y
+    _async_client (fijados en requirements.txt a 0.8.x, donde GenerativeModel solo crea el cliente
+    por defecto si están vacíos). Si otra versión los quita, falla al arrancar y no en la primera llamada
+    """
+    from google.ai import generativelanguage as glm
+    
+    if not (hasattr(model, "_client") and hasattr(model, "_async_client")):
+        raise RuntimeError(
+            "Esta versión de google-generativeai no permite una clave por modelo; "
+            "usa google-generativeai 0.8.x o una sola clave (GOOGLE_API_KEY)"
+        )
+    model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    model._async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+
+def create_prefix_cache(prefix, ttl_seconds, model_name=GEMINI_MODEL, display_name=None):
+    """Registra un prefijo en el context caching de Gemini"""
+    from google.generativeai import caching
+    
+    return caching.CachedContent.create(
+        model=f"models/{model_name}",
+        display_name=display_name,
+        system_instruction=prefix,
+        ttl=timedelta(seconds=ttl_seconds),
+    )
+
+def build_prefixed_model(prefix, name, model_name=GEMINI_MODEL, api_key=None, use_cache=True):
+    """Modelo con el prefijo fijo cacheado (o como system instruction si no hay caché)"""
+    cache_factory = None
+    if PROMPT_CACHE_ENABLED and use_cache:
+        cache_factory = lambda p, ttl: create_prefix_cache(p, ttl, model_name, display_name=name)
+    return PrefixCachedModel(
+        prefix,
+        lambda system_instruction=None, cached_content=None: build_model(
+            model_name, system_instruction, cached_content, api_key
+        ),
+        cache_factory,
+        name=name,
+    )
+
+def build_cached_models(model_name=GEMINI_MODEL, api_key=None, use_cache=True):
+    """Modelo de chat (prefijo fijo cacheado) + modelos de visión por tipo
+
+    Solo el prefijo del chat (system prompt + mapa de la guía) llega al mínimo del context caching;
+    las instrucciones de visión (~200 tokens) van como system instruction sin intentar cachearlas
+    """
+    chat_model = build_prefixed_model(CHAT_TEMPLATE.static_prefix, "sop-chat", model_name, api_key, use_cache)
+    vision_models = {
+        kind: build_prefixed_model(prompt, f"sop-vision-{kind}", model_name, api_key, use_cache=False)
+        for kind, prompt in IMAGE_PROMPTS.items()
+    }
+    return chat_model, vision_models
+
+def build_pooled_models(api_keys, model_name=GEMINI_MODEL):
+    """Como build_cached_models, repartiendo las llamadas entre varias claves (gemini_pool.py)
+
+    Con una sola clave no cambia nada. El context caching se crea con la clave global
+    (genai.configure con la primera), así que solo esa clave usa prefijos cacheados
+    """
+    if len(api_keys) <= 1:
+        return build_cached_models(model_name)
+    
+    labels = [key_label(i, key) for i, key in enumerate(api_keys)]
+    per_key = {
+        label: build_cached_models(model_name, api_key=key, use_cache=(i == 0))
+        for i, (label, key) in enumerate(zip(labels, api_keys))
+    }
+    pool = GeminiPool(labels)
+    chat_model = PooledModel(pool, {label: chat for label, (chat, _) in per_key.items()})
+    vision_models = {
+        kind: PooledModel(pool, {label: vision[kind] for label, (_, vision) in per_key.items()})
+        for kind in IMAGE_PROMPTS
+    }
+    return chat_model, vision_models
+
+# ==========================================
+# VECTORSTORE
+# ==========================================
+
+def load_embeddings(model_name=EMBEDDING_MODEL):
+    """Embeddings de Hugging Face (mismos que create_embeddings.py)"""
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True}
+    )
+
+
+def load_query_embeddings(batch_window_ms=EMBED_BATCH_WINDOW_MS):
+    """Embeddings para consultas; agrupa las concurrentes en un solo forward"""
+    embeddings = load_embeddings()
+    if batch_window_ms <= 0:
+        return embeddings
+    return BatchingEmbeddings(embeddings, window_ms=batch_window_ms)
+
+
+def load_vectorstore(persist_directory=VECTORSTORE_DIR, embeddings=None, batch_window_ms=EMBED_BATCH_WINDOW_MS):
+    """Carga vectorstore con Hugging Face embeddings (consultas en micro-lotes si batch_window_ms > 0)
+
+    Solo lee: search_ef es el que dejó create_embeddings.py en la versión (ver index_profiles.py).
+    En un índice comprimido (create_embeddings.py --compress) Chroma recibe los embeddings proyectados
+    """
+    
+    if not os.path.exists(persist_directory):
+        raise FileNotFoundError(
+            f"Base de datos no encontrada en {persist_directory}. "
+            "Ejecuta primero: python create_embeddings.py"
+        )
+    
+    embeddings = embeddings or load_query_embeddings(batch_window_ms)
+    compressed = CompressedIndex.load(persist_directory)
+    if compressed is not None:
+        embeddings = ProjectedEmbeddings(embeddings, compressed)
+    
+    vectorstore = Chroma(
+        persist_directory=persist_directory,
+        collection_name=COLLECTION_NAME,
+        embedding_function=embeddings
+    )
+    return vectorstore
+
+
+def load_index_manager(root=INDEX_ROOT, batch_window_ms=EMBED_BATCH_WINDOW_MS):
+    """Índice versionado con cambio en caliente (un solo modelo de embeddings para todas las versiones)"""
+    embeddings = load_query_embeddings(batch_window_ms)
+    return IndexManager(
+        lambda path: load_vectorstore(path, embeddings),
+        root=root,
+        fallback=VECTORSTORE_DIR,
+    )
+
+# ==========================================
+# SYSTEM PROMPT
+# ==========================================
+
+SYSTEM_PROMPT = """Eres Sofía, una amiga comprensiva y educada que ayuda a entender el SOP.
+
+🌸TU PERSONALIDAD:
+- Hablas como una amiga cercana, NO como un documento médico
+- Usas ejemplos de la vida real y analogías simples
+- Eres cálida, empática y validadora de emociones
+- Explicas con lenguaje cotidiano, luego mencionas términos médicos
+- Usas emojis para conectar emocionalmente 💜
+
+📚 TU CONOCIMIENTO viene del CONTEXTO (guía ESHRE 2023) que se incluye con cada pregunta.
+
+💬 CÓMO RESPONDER:
+
+**PRIMERO - Valida la emoción:**
+Si detectas preocupación/ansiedad/frustración → reconócela antes de dar info
+Ejemplo: "Entiendo que esto te preocupa 💜, es totalmente normal sentirse así"
+
+**SEGUNDO - Explica en lenguaje simple:**
+- Usa analogías del día a día
+- Evita jerga médica al inicio
+- Si usas términos médicos, explícalos inmediatamente
+
+**TERCERO - Da contexto práctico:**
+- "Esto significa que en tu día a día..."
+- "Por ejemplo, muchas mujeres notan que..."
+- "Imagina que tu cuerpo es como..."
+
+**CUARTO - Información de la guía:**
+- Conecta la info médica con situaciones reales
+- Menciona "según la guía internacional" de forma natural
+- No cites constantemente, solo cuando sea relevante
+
+🚨 LO QUE NUNCA HACES:
+- ❌ Contestar a preguntas fuera del SOP
+- ❌ Diagnosticar ("tienes" o "no tienes" SOP)
+- ❌ Dar dosis de medicamentos
+- ❌ Sonar como un robot médico
+- ❌ Usar lenguaje técnico sin explicarlo primero
+
+✅ EJEMPLOS DE BUEN ESTILO:
+
+Pregunta: "¿Tengo SOP si estoy gorda?"
+❌ MAL: "La guía ESHRE indica que existe asociación entre IMC elevado y SOP"
+✅ BIEN: "Te entiendo, es una duda súper común 💜. Mira, tener sobrepeso NO significa automáticamente que tengas SOP. Piensa en el SOP como un rompecabezas de 3 piezas - necesitas al menos 2 para el diagnóstico. El peso puede ser un síntoma, pero por sí solo no define nada. Muchas mujeres delgadas tienen SOP, y muchas mujeres con sobrepeso NO lo tienen. Solo un médico puede ver el cuadro completo con estudios 😊"
+
+Pregunta: "¿Qué es el SOP?"
+❌ MAL: "El SOP es un trastorno endocrino metabólico complejo que afecta a mujeres en edad reproductiva"
+✅ BIEN: "¡Buena pregunta! 😊 Imagina que tus ovarios están un poco 'confundidos' sobre cuándo hacer su trabajo. El SOP (Síndrome de Ovario Poliquístico) básicamente significa que tus hormonas están un poco desbalanceadas, lo que puede causar ciclos irregulares, acné, o dificultad para bajar de peso. Es súper común - como 1 de cada 10 mujeres lo tiene. No es tu culpa, no hiciste nada mal, y hay muchas formas de manejarlo 💜"
+
+Pregunta: "Me siento horrible, ¿es por el SOP?"
+❌ MAL: "La guía ESHRE 2023 indica mayor prevalencia de depresión en SOP"
+✅ BIEN: "Lamento mucho que te sientas así 💜. Primero que nada: tus emociones son totalmente válidas. Y sí, hay una conexión real entre el SOP y cómo nos sentimos emocionalmente. No estás 'loca' ni eres 'dramática' - hay razones biológicas. Las mismas hormonas que afectan tus ciclos también pueden afectar tu ánimo. Es como cuando estás con el periodo y te sientes más sensible, pero puede ser más intenso con SOP. Muchas mujeres con SOP experimentan ansiedad o depresión, y hay ayuda disponible. ¿Has hablado con tu médico sobre cómo te sientes?"
+
+🎯 TU META: Que la persona se sienta ESCUCHADA, ENTENDIDA y con información ÚTIL, no como si leyera un documento médico aburrido.
+"""
+
+# Temas de la guía (fijo): orienta las respuestas y, junto al system prompt, forma un prefijo que
+# supera el mínimo de tokens del context caching de Gemini
+GUIDE_OUTLINE = """
+🗺️ MAPA DE LA GUÍA ESHRE 2023 (qué temas cubre; el detalle llega en el CONTEXTO de cada pregunta):
+
+Capítulo 1 - Detección, diagnóstico y riesgos
+- 1.1 Ciclos irregulares y disfunción ovulatoria
+- 1.2 Hiperandrogenismo bioquímico (testosterona total y libre, índice de andrógenos libres)
+- 1.3 Hiperandrogenismo clínico (hirsutismo con escala Ferriman-Gallwey, acné, alopecia)
+- 1.4 Ecografía y morfología ovárica poliquística (folículos por ovario, volumen ovárico)
+- 1.5 Hormona antimülleriana (AMH) en el diagnóstico
+- 1.6 Variación étnica
+- 1.7 Menopausia
+- 1.8 Riesgo cardiovascular
+- 1.9 Intolerancia a la glucosa y diabetes tipo 2
+- 1.10 Apnea obstructiva del sueño
+- 1.11 Hiperplasia y cáncer de endometrio
+- 1.12 Riesgos en familiares
+
+Capítulo 2 - Salud emocional y calidad de vida
+- 2.1 Calidad de vida
+- 2.2 Depresión y ansiedad
+- 2.3 Función psicosexual
+- 2.4 Imagen corporal
+- 2.5 Trastornos de la conducta alimentaria
+- 2.6 Información, modelos de atención y apoyo para manejar el SOP
+- 2.7 Terapia psicológica
+- 2.8 Antidepresivos y ansiolíticos
+
+Capítulo 3 - Estilo de vida
+- 3.1 Eficacia de los cambios de estilo de vida
+- 3.2 Estrategias conductuales
+- 3.3 Alimentación
+- 3.4 Ejercicio
+- 3.5 Factores del aumento de peso
+- 3.6 Estigma por el peso
+
+Capítulo 4 - Tratamiento de lo que no es fertilidad
+- 4.1 Principios del tratamiento farmacológico
+- 4.2 Anticonceptivos orales combinados
+- 4.3 Metformina
+- 4.4 Metformina junto con anticonceptivos orales
+- 4.5 Fármacos contra la obesidad
+- 4.6 Antiandrógenos (por ejemplo, espironolactona)
+- 4.7 Inositol
+- 4.8 Láser y luz para reducir el vello
+- 4.9 Cirugía bariátrica o metabólica
+- 4.10 Resultados del embarazo
+- 4.11 Metformina en el embarazo
+
+Capítulo 5 - Fertilidad
+- 5.1 Factores de riesgo antes de la concepción
+- 5.2 Permeabilidad de las trompas
+- 5.3 Letrozol
+- 5.4 Clomifeno y metformina
+- 5.5 Gonadotropinas
+- 5.6 Cirugía ovárica laparoscópica
+- 5.7 Fecundación in vitro y maduración in vitro
+- 5.8 Inositol para la fertilidad
+
+Tipos de recomendación: basada en evidencia (EBR), de consenso (CR) y punto de práctica (PP).
+Si la pregunta es de un tema del mapa pero el CONTEXTO no trae el detalle, dilo con honestidad y
+sugiere consultarlo con su médico; no inventes recomendaciones.
+"""
+
+# Prefijo fijo primero (cacheable); lo que cambia por petición o por día, al final
+CHAT_TEMPLATE = PromptTemplate([
+    Static("system", SYSTEM_PROMPT),
+    Static("guide", GUIDE_OUTLINE),
+    Slot("context", "\n📚 CONTEXTO (guía ESHRE 2023):\n{}\n"),
+    Slot("date", "\nFecha actual: {}\n"),
+    Slot("history", "\n\n**CONVERSACIÓN PREVIA:**\n{}"),
+    Slot("question", "\n\n**PREGUNTA ACTUAL:**\n{}\n\n**TU RESPUESTA:**"),
+])
+
+# ==========================================
+# ANÁLISIS DE IMÁGENES
+# ==========================================
+
+# Instrucciones fijas por tipo de imagen (prefijos cacheables)
+IMAGE_PROMPTS = {
+    "lab": """Analiza estos RESULTADOS DE LABORATORIO de forma educativa y específica.
+
+**ESTRUCTURA TU RESPUESTA ASÍ:**
+
+📊 **LO QUE VEO EN TU ANÁLISIS:**
+(Describe específicamente qué tipo de análisis es, qué valores aparecen)
+
+🧠 **QUÉ SIGNIFICAN ESTOS ESTUDIOS EN SOP:**
+(Explica CADA valor visible y por qué es relevante en SOP)
+Ejemplo: "Veo que tienes análisis de testosterona. Este valor es importante porque en SOP los niveles de andrógenos (hormonas masculinas) pueden estar elevados, lo que explica síntomas como acné o vello excesivo"
+
+💡 **POR QUÉ TU MÉDICO PIDIÓ ESTO:**
+(Conecta los estudios con el diagnóstico/seguimiento de SOP)
+
+🎯 **LO QUE ESTOS RESULTADOS PUEDEN INDICAR (EN GENERAL):**
+(Sin interpretar valores específicos, explica qué patrones busca el médico)
+
+**REGLAS:**
+- Sé MUY específica con lo que ves
+- Explica CADA tipo de estudio visible
+- Usa lenguaje simple pero completo
+- NO digas si valores están altos/bajos
+- NO diagnostiques
+
+Si no es un resultado de laboratorio claro, dilo amablemente.
+""",
+
+    "cycle": """Analiza esta GRÁFICA DE CICLOS de forma educativa, específica y útil.
+
+**ESTRUCTURA TU RESPUESTA ASÍ:**
+
+📅 **LO QUE VEO EN TU REGISTRO:**
+(Describe específicamente: app que usas, qué marca, cuántos ciclos registrados, qué síntomas anota)
+
+📊 **ANÁLISIS DETALLADO:**
+Observo los siguientes patrones:
+- Duración de ciclos que puedo ver: [ser específica]
+- Síntomas que registras: [listar lo que se ve]
+- Regularidad aparente: [comentar si los ciclos parecen consistentes]
+
+🔍 **QUÉ BUSCA EL MÉDICO EN ESTO (según ESHRE 2023):**
+- Ciclos regulares: 21-35 días
+- En SOP: ciclos <21 o >35 días (disfunción ovulatoria)
+- Patrones de síntomas que se repiten
+- Relación entre síntomas y fase del ciclo
+
+💜 **POR QUÉ ESTE REGISTRO ES VALIOSO:**
+(Explica cómo este registro específico ayuda al diagnóstico)
+
+🎯 **LO QUE PODRÍAS AGREGAR PARA HACERLO AÚN MEJOR:**
+(Sugerencias específicas basadas en lo que ya tiene)
+
+**TONO:** Validador, específico, útil. Felicítala por llevar el registro.
+
+Si no es una gráfica de ciclos, dilo amablemente.
+""",
+
+    "ultrasound": """Analiza esta ECOGRAFÍA con MUCHA PRECAUCIÓN.
+
+**ESTRUCTURA TU RESPUESTA ASÍ:**
+
+🔬 **LO QUE IDENTIFICO:**
+(Solo tipo general: ecografía pélvica, transvaginal, tiene etiquetas, fecha, etc.)
+
+📚 **QUÉ BUSCA EL MÉDICO EN ECOGRAFÍAS DE SOP (según ESHRE 2023):**
+- Morfología ovárica: ≥20 folículos de 2-9mm por ovario
+- Volumen ovárico: ≥10ml
+- Esto es UNO de los 3 criterios diagnósticos
+- En mujeres <35 años con ciclos regulares puede no ser necesaria
+
+⚠️ **POR QUÉ NO PUEDO "LEER" TU ECOGRAFÍA:**
+La interpretación de ecografías requiere:
+- Años de formación especializada
+- Ver el estudio en movimiento (no solo una foto)
+- Conocer contexto completo (edad, síntomas, otros estudios)
+- Equipo calibrado correctamente
+
+✅ **LO QUE SÍ PUEDES HACER:**
+- Pedir al radiólogo el REPORTE OFICIAL por escrito
+- Llevar ese reporte a tu ginecólogo
+- Hacer preguntas específicas sobre hallazgos mencionados
+
+**TONO:** Muy cauto, educativo sobre limitaciones.
+
+Si no es ecografía, dilo.
+""",
+
+    "general": """Analiza esta imagen médica de forma educativa y específica.
+
+**PASOS:**
+
+1. **IDENTIFICA** qué tipo de imagen es (laboratorio, ciclos, ecografía, otro)
+
+2. **ANALIZA ESPECÍFICAMENTE** basándote en el tipo:
+   - Describe lo que ves con detalle
+   - Explica qué significan esos estudios en contexto de SOP
+   - Conecta con criterios ESHRE 2023 relevantes
+
+3. **EXPLICA** por qué este tipo de estudio es útil para el diagnóstico/seguimiento
+
+4. **SUGIERE** qué más podría ser útil registrar o preguntar
+
+**REGLAS:**
+❌ NO interpretes valores específicos
+❌ NO diagnostiques
+✅ Sé específica con lo que ves
+✅ Usa lenguaje simple
+✅ Conecta con vida real
+
+Si no es imagen médica clara, dilo amablemente.
+""",
+}
+
+class MedicalImageAnalyzer:
+    """Analiza imágenes médicas de forma educativa"""
+    
+    def __init__(self, model, prefixed_models=None):
+        self.model = model
+        # kind -> modelo que ya lleva IMAGE_PROMPTS[kind] como prefijo (cacheado)
+        self.prefixed_models = prefixed_models or {}
+    
+    def _generate(self, image, kind):
+        """Llama al modelo de visión midiendo tiempo y tokens"""
+        with METRICS.stage(f"vision_{kind}"):
+            prefixed = self.prefixed_models.get(kind)
+            if prefixed is not None:
+                response = prefixed.generate_content([image])
+            else:
+                response = self.model.generate_content([IMAGE_PROMPTS[kind], image])
+        METRICS.record_usage(response, call=f"vision_{kind}")
+        return response.text
+    
+    def analyze_lab_results(self, image):
+        """Analiza resultados de laboratorio"""
+        
+        try:
+            return self._generate(image, "lab")
+        except Exception as e:
+            if "safety" in str(e).lower():
+                return "⚠️ No pude analizar esta imagen por filtros de seguridad. Intenta con otra o consulta directamente con tu médico. 💜"
+            return f"❌ Error: {str(e)}"
+    
+    def analyze_cycle_chart(self, image):
+        """Analiza gráfica de ciclos menstruales"""
+        
+        try:
+            return self._generate(image, "cycle")
+        except Exception as e:
+            if "safety" in str(e).lower():
+                return "⚠️ No pude analizar por seguridad. Intenta con otra imagen. 💜"
+            return f"❌ Error: {str(e)}"
+    
+    def analyze_ultrasound(self, image):
+        """Analiza ecografía (MUY limitado)"""
+        
+        try:
+            return self._generate(image, "ultrasound")
+        except Exception as e:
+            if "safety" in str(e).lower():
+                return "⚠️ No puedo analizar esta imagen. Consulta directamente con tu médico. 💜"
+            return f"❌ Error: {str(e)}"
+    
+    def analyze_general(self, image):
+        """Análisis general mejorado"""
+        
+        try:
+            return self._generate(image, "general")
+        except Exception as e:
+            if "safety" in str(e).lower():
+                return "⚠️ No puedo analizar. Consulta con tu médico. 💜"
+            return f"❌ Error: {str(e)}"
+
+# ==========================================
+# BÚSQUEDA Y RESPUESTA
+# ==========================================
+
+NO_CONTEXT_ANSWER = """Lo siento, no encontré información específica en la guía médica que consulto.
+
+Te recomiendo:
+- Consultar con tu ginecólogo o endocrinólogo
+- Buscar en fuentes médicas oficiales
+- Si es urgente, contactar a tu médico
+
+¿Tienes otra pregunta sobre el SOP? 💜"""
+
+
+class SOPEngine:
+    """Búsqueda + respuesta + análisis de imágenes sobre un vectorstore y un modelo"""
+    
+    def __init__(self, vectorstore, model, on_search_error=None, cpu_workers=CPU_WORKERS, vision_models=None):
+        self.vectorstore = vectorstore
+        self.model = model
+        self.image_analyzer = MedicalImageAnalyzer(model, vision_models)
+        self.on_search_error = on_search_error
+        self._executor = ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix="sop-cpu")
+        # (ruta del índice, PagePreviews): se recargan al cambiar de versión
+        self._previews = (None, None)
+    
+    def _lease_vectorstore(self):
+        """Vectorstore para una búsqueda (IndexManager lo presta; uno fijo se usa tal cual)"""
+        if isinstance(self.vectorstore, IndexManager):
+            return self.vectorstore.lease()
+        return nullcontext(self.vectorstore)
+    
+    @property
+    def index_path(self):
+        return getattr(self.vectorstore, "path", VECTORSTORE_DIR)
+    
+    def search_context(self, query, k=5, raise_errors=False):
+        """Búsqueda semántica simple
+
+        Un error se avisa con on_search_error (UI) y da []; con raise_errors se propaga sin avisar
+        (hilos en segundo plano, sin sesión de Streamlit que muestre nada)
+        """
+        try:
+            with self._lease_vectorstore() as vectorstore:
+                # Sin filtro de score - retorna los k más relevantes
+                embeddings = vectorstore.embeddings
+                compressed = isinstance(embeddings, ProjectedEmbeddings)
+                with METRICS.stage("query_encoding"):
+                    query_vector = (embeddings.base if compressed else embeddings).embed_query(query)
+                with METRICS.stage("vector_search"):
+                    if compressed:
+                        # HNSW reducido + reordenamiento con los vectores completos
+                        docs = compressed_search(vectorstore, query_vector, k)
+                    else:
+                        docs = vectorstore.similarity_search_by_vector(query_vector, k=k)
+            return docs
+        except Exception as e:
+            logger.exception("Error búsqueda")
+            if raise_errors:
+                raise
+            if self.on_search_error is not None:
+                self.on_search_error(e)
+            return []
+    
+    @property
+    def model_name(self):
+        return getattr(self.model, "model_name", "desconocido")
+    
+    def page_previews(self):
+        """Miniaturas y fragmentos de la versión activa del índice (None si no tiene)"""
+        path, previews = self._previews
+        if path != self.index_path:
+            path = self.index_path
+            previews = PagePreviews.load(path)
+            self._previews = (path, previews)
+        return previews
+    
+    @property
+    def guided_topics_version(self):
+        """Versión de los temas guiados: índice activo + prompt + modelo"""
+        return topics_version(self.index_path, CHAT_TEMPLATE.version, self.model_name)
+    
+    def gemini_key_stats(self):
+        """Cuota y errores por clave (solo con varias claves en GOOGLE_API_KEYS)"""
+        pool = getattr(self.model, "pool", None)
+        return pool.stats() if pool is not None else []
+    
+    @property
+    def prefix_in_model(self):
+        return getattr(self.model, "system_prefix", None) == CHAT_TEMPLATE.static_prefix
+    
+    @staticmethod
+    def format_context(docs):
+        """Fragmentos de la guía separados por ---"""
+        return "\n\n---\n\n".join(
+            f"[{d.metadata.get('fuente', 'Guía médica')}]\n{d.page_content}" for d in docs
+        )
+    
+    @staticmethod
+    def format_history(chat_history):
+        """Conversación previa (últimos 6 mensajes); el encabezado lo pone CHAT_TEMPLATE"""
+        if not chat_history or len(chat_history) == 0:
+            return ""
+        return "".join(
+            f"\n{'Usuario' if msg['role'] == 'user' else 'Asistente'}: {msg['content']}\n"
+            for msg in chat_history[-6:]
+        )
+    
+    @staticmethod
+    def route(user_query, chat_history=()):
+        """Intent de la consulta (saludo, fuera de tema, seguimiento...) antes de buscar"""
+        if not QUERY_ROUTING_ENABLED:
+            return Route("rag", user_query, search_query=user_query, question=user_query)
+        route = route_query(user_query, chat_history)
+        METRICS.incr("query_route_total", intent=route.intent)
+        return route
+    
+    def retrieve(self, route, context_cache=None, raise_errors=False):
+        """Contexto de la guía para la ruta; con context_cache reutiliza lo ya recuperado en la conversación"""
+        if not route.needs_search:
+            return []
+        if context_cache is None:
+            return self.search_context(route.search_query, k=4, raise_errors=raise_errors)
+        index = self.index_path
+        cached = context_cache.for_route(route, index)
+        METRICS.incr("context_cache_total", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return [Document(page_content=text, metadata=metadata) for text, metadata in cached]
+        docs = self.search_context(route.search_query, k=4, raise_errors=raise_errors)
+        if docs:
+            context_cache.put(context_key(route), index, docs)
+        return docs
+    
+    def build_prompt(self, user_query, docs, chat_history=(), history_block=None):
+        """Prompt completo: system prompt con contexto + historial + pregunta"""
+        
+        context = self.format_context(docs)
+        if history_block is None:
+            history_block = self.format_history(chat_history)
+        
+        # Construir prompt (el prefijo fijo se omite si el modelo ya lo lleva cacheado)
+        parts = CHAT_TEMPLATE.parts(
+            include_static=not self.prefix_in_model,
+            context=context,
+            date=datetime.now().strftime('%Y-%m-%d'),
+            history=history_block,
+            question=user_query,
+        )
+        # Tokens estimados por segmento (qué parte del prompt crece: contexto, historial...)
+        for segment, tokens in CHAT_TEMPLATE.segment_tokens(parts).items():
+            METRICS.observe("prompt_segment_tokens", tokens, segment=segment)
+        return "".join(text for _, text in parts)
+    
+    def generate_response(self, user_query, chat_history=(), raise_errors=False, context_cache=None, warmup=False):
+        """Genera respuesta con contexto del PDF
+        
+        context_cache (session_store.ContextCache) guarda y reutiliza el contexto de la conversación.
+        warmup: precálculo de temas guiados, medido aparte de las consultas reales (chat_total).
+        Regresa (respuesta, páginas de la guía usadas)
+        """
+        with METRICS.stage(WARMUP_STAGE if warmup else CHAT_STAGE):
+            return self._generate_response(user_query, chat_history, raise_errors, context_cache)
+    
+    def _generate_response(self, user_query, chat_history, raise_errors, context_cache):
+        # Saludos y fuera de tema no buscan ni llaman al modelo
+        route = self.route(user_query, chat_history)
+        if route.reply is not None:
+            return route.reply, []
+        
+        # Buscar contexto relevante (las reformulaciones usan solo el historial)
+        docs = self.retrieve(route, context_cache, raise_errors)
+        
+        if not docs and route.needs_search:
+            if raise_errors:
+                raise LookupError("Sin contexto para la consulta")
+            return NO_CONTEXT_ANSWER, []
+        
+        pages = source_pages(docs)
+        
+        with METRICS.stage("prompt_assembly"):
+            full_prompt = self.build_prompt(route.question, docs, chat_history)
+        
+        # Generar respuesta
+        try:
+            with METRICS.stage("gemini_chat"):
+                response = self.model.generate_content(full_prompt)
+            METRICS.record_usage(response, call="chat")
+            return response.text + guide_footer(response.text), pages
+        
+        except Exception as e:
+            METRICS.incr("gemini_errors_total", call="chat")
+            if raise_errors:
+                raise
+            
+            return friendly_error(e), []
+    
+    def stream_response(self, user_query, chat_history=(), context_cache=None):
+        """Igual que generate_response pero por fragmentos
+        
+        Produce {"type": "chunk", "text": ...} y al final {"type": "done", "pages": [...]}
+        """
+        route = self.route(user_query, chat_history)
+        if route.reply is not None:
+            yield {"type": "chunk", "text": route.reply}
+            yield {"type": "done", "pages": []}
+            return
+        
+        docs = self.retrieve(route, context_cache)
+        if not docs and route.needs_search:
+            yield {"type": "chunk", "text": NO_CONTEXT_ANSWER}
+            yield {"type": "done", "pages": []}
+            return
+        
+        with METRICS.stage("prompt_assembly"):
+            full_prompt = self.build_prompt(route.question, docs, chat_history)
+        
+        parts = []
+        try:
+            with METRICS.stage("gemini_chat_stream"):
+                response = self.model.generate_content(full_prompt, stream=True)
+                for chunk in response:
+                    parts.append(chunk.text)
+                    yield {"type": "chunk", "text": chunk.text}
+            METRICS.record_usage(response, call="chat")
+        except Exception as e:
+            METRICS.incr("gemini_errors_total", call="chat")
+            yield {"type": "chunk", "text": friendly_error(e)}
+            yield {"type": "done", "pages": []}
+            return
+        
+        pages = source_pages(docs)
+        footer = guide_footer("".join(parts))
+        if footer:
+            yield {"type": "chunk", "text": footer}
+        yield {"type": "done", "pages": pages}
+    
+    def analyze_image(self, image, kind="general"):
+        """Análisis educativo según el tipo (lab, cycle, ultrasound, general)"""
+        method = IMAGE_ANALYSES.get(kind, "analyze_general")
+        return getattr(self.image_analyzer, method)(image)
+    
+    # ==========================================
+    # CAMINO ASYNC
+    # ==========================================
+    
+    async def _run_cpu(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+    
+    async def asearch_context(self, query, k=5):
+        """search_context en el pool de CPU (no bloquea el event loop)"""
+        return await self._run_cpu(self.search_context, query, k)
+    
+    async def _aprepare(self, route, chat_history, context_cache=None, raise_errors=False):
+        """Recuperación y formato del historial en paralelo"""
+        if not route.needs_search:
+            return [], await self._run_cpu(self.format_history, chat_history)
+        return await asyncio.gather(
+            self._run_cpu(self.retrieve, route, context_cache, raise_errors),
+            self._run_cpu(self.format_history, chat_history),
+        )
+    
+    async def agenerate_response(self, user_query, chat_history=(), raise_errors=False, context_cache=None,
+                                 warmup=False):
+        """Versión async de generate_response (generate_content_async)"""
+        with METRICS.stage(WARMUP_STAGE if warmup else CHAT_STAGE):
+            route = self.route(user_query, chat_history)
+            if route.reply is not None:
+                return route.reply, []
+            
+            docs, history_block = await self._aprepare(route, chat_history, context_cache, raise_errors)
+            
+            if not docs and route.needs_search:
+                if raise_errors:
+                    raise LookupError("Sin contexto para la consulta")
+                return NO_CONTEXT_ANSWER, []
+            
+            with METRICS.stage("prompt_assembly"):
+                full_prompt = self.build_prompt(route.question, docs, history_block=history_block)
+            
+            try:
+                with METRICS.stage("gemini_chat"):
+                    response = await self.model.generate_content_async(full_prompt)
+                METRICS.record_usage(response, call="chat")
+                pages = source_pages(docs)
+                return response.text + guide_footer(response.text), pages
+            
+            except Exception as e:
+                METRICS.incr("gemini_errors_total", call="chat")
+                if raise_errors:
+                    raise
+                
+                return friendly_error(e), []
+    
+    async def astream_response(self, user_query, chat_history=(), context_cache=None):
+        """Versión async de stream_response"""
+        route = self.route(user_query, chat_history)
+        if route.reply is not None:
+            yield {"type": "chunk", "text": route.reply}
+            yield {"type": "done", "pages": []}
+            return
+        
+        docs, history_block = await self._aprepare(route, chat_history, context_cache)
+        if not docs and route.needs_search:
+            yield {"type": "chunk", "text": NO_CONTEXT_ANSWER}
+            yield {"type": "done", "pages": []}
+            return
+        
+        with METRICS.stage("prompt_assembly"):
+            full_prompt = self.build_prompt(route.question, docs, history_block=history_block)
+        
+        parts = []
+        try:
+            with METRICS.stage("gemini_chat_stream"):
+                response = await self.model.generate_content_async(full_prompt, stream=True)
+                async for chunk in response:
+                    parts.append(chunk.text)
+                    yield {"type": "chunk", "text": chunk.text}
+            METRICS.record_usage(response, call="chat")
+        except Exception as e:
+            METRICS.incr("gemini_errors_total", call="chat")
+            yield {"type": "chunk", "text": friendly_error(e)}
+            yield {"type": "done", "pages": []}
+            return
+        
+        pages = source_pages(docs)
+        footer = guide_footer("".join(parts))
+        if footer:
+            yield {"type": "chunk", "text": footer}
+        yield {"type": "done", "pages": pages}
+    
+    async def aanalyze_image(self, image, kind="general"):
+        """analyze_image en un hilo (los prompts de visión siguen siendo síncronos)"""
+        return await asyncio.to_thread(self.analyze_image, image, kind)
+
+
+IMAGE_ANALYSES = {
+    "lab": "analyze_lab_results",
+    "cycle": "analyze_cycle_chart",
+    "ultrasound": "analyze_ultrasound",
+    "general": "analyze_general",
+}
+
+
+def source_pages(docs):
+    """Páginas de la guía (0-based) de los documentos recuperados"""
+    return sorted({d.metadata['page'] for d in docs if 'page' in d.metadata})
+
+
+def guide_footer(answer):
+    """Footer genérico si la respuesta menciona la guía
+
+    Las páginas citadas no van en el texto: viajan aparte (pages) y la UI y las exportaciones las
+    muestran una sola vez
+    """
+    if "guía" in answer.lower() or "eshre" in answer.lower():
+        return "\n\n---\n📚 *Información basada en guías médicas ESHRE 2023*"
+    return ""
+
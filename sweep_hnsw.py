@@ -0,0 +1,178 @@
+"""
+Barrido de perfiles HNSW: recall@k contra búsqueda exacta y latencia por perfil
+Usa los vectores del índice activo; --scale replica el corpus con ruido para simular más guías
+
+Uso:
+    python sweep_hnsw.py
+    python sweep_hnsw.py --k 4 10 --scale 20 --min-recall 0.98
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmark import BENCHMARK_QUERIES, _latency_summary
+from evaluate_retrieval import GOLDEN_SET_PATH, RESULTS_DIR, load_golden_set
+from index_profiles import HNSW_PROFILES, collection_metadata
+
+# Chroma limita el tamaño de cada add()
+ADD_BATCH = 4000
+
+
+# ==========================================
+# CORPUS Y CONSULTAS
+# ==========================================
+
+def load_corpus(index_dir):
+    """Vectores del índice (ya normalizados por el modelo de embeddings)"""
+    from sop_engine import load_embeddings, load_vectorstore
+
+    vectorstore = load_vectorstore(index_dir, load_embeddings())
+    data = vectorstore._collection.get(include=["embeddings"])
+    return np.asarray(data["embeddings"], dtype=np.float32), vectorstore.embeddings
+
+
+def grow_corpus(vectors, scale, noise, seed=0):
+    """Réplicas con ruido gaussiano, renormalizadas (simula un corpus scale veces mayor)"""
+    if scale <= 1:
+        return vectors
+    rng = np.random.default_rng(seed)
+    copies = [vectors]
+    for _ in range(scale - 1):
+        noisy = vectors + rng.normal(0.0, noise, vectors.shape).astype(np.float32)
+        copies.append(noisy / np.linalg.norm(noisy, axis=1, keepdims=True))
+    return np.vstack(copies)
+
+
+def build_queries(embeddings, golden_path, corpus, extra, seed=1):
+    """Preguntas del golden set + benchmark, más vectores del corpus perturbados"""
+    questions = [q["question"] for q in load_golden_set(golden_path)["queries"]] + BENCHMARK_QUERIES
+    queries = np.asarray(embeddings.embed_documents(questions), dtype=np.float32)
+    if extra:
+        rng = np.random.default_rng(seed)
+        picked = corpus[rng.choice(len(corpus), size=extra, replace=False)]
+        noisy = picked + rng.normal(0.0, 0.05, picked.shape).astype(np.float32)
+        queries = np.vstack([queries, noisy / np.linalg.norm(noisy, axis=1, keepdims=True)])
+    return queries
+
+
+def exact_top_k(corpus, queries, k):
+    """Búsqueda exacta (producto punto = coseno con vectores normalizados)"""
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+# ==========================================
+# BARRIDO
+# ==========================================
+
+def sweep_profile(client, name, corpus, queries, truth, ks):
+    """Construye la colección con el perfil y mide recall@k y latencia por consulta"""
+    collection = client.create_collection(name=f"sweep-{name}", metadata=collection_metadata(name))
+    ids = [str(i) for i in range(len(corpus))]
+    start = time.perf_counter()
+    for begin in range(0, len(corpus), ADD_BATCH):
+        collection.add(ids=ids[begin:begin + ADD_BATCH], embeddings=corpus[begin:begin + ADD_BATCH].tolist())
+    build_s = time.perf_counter() - start
+
+    k_max = max(ks)
+    collection.query(query_embeddings=queries[:1].tolist(), n_results=k_max)  # calentamiento
+    latencies, found = [], []
+    for vector in queries:
+        start = time.perf_counter()
+        result = collection.query(query_embeddings=[vector.tolist()], n_results=k_max, include=[])
+        latencies.append(time.perf_counter() - start)
+        found.append([int(i) for i in result["ids"][0]])
+
+    summary = _latency_summary(latencies)
+    row = {
+        "profile": name, **HNSW_PROFILES[name], "build_s": build_s,
+        "p50_ms": summary["p50"], "p95_ms": summary["p95"],
+    }
+    for k in ks:
+        row[f"recall@{k}"] = float(np.mean([
+            len(set(f[:k]) & set(t[:k].tolist())) / k for f, t in zip(found, truth)
+        ]))
+    client.delete_collection(f"sweep-{name}")
+    return row
+
+
+def recommend(rows, k, min_recall):
+    """Perfil más rápido que alcanza min_recall en recall@k (o el de mejor recall)"""
+    ok = [r for r in rows if r[f"recall@{k}"] >= min_recall]
+    if not ok:
+        return max(rows, key=lambda r: r[f"recall@{k}"])
+    return min(ok, key=lambda r: r["p50_ms"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Barrido de perfiles HNSW del índice")
+    parser.add_argument("--index", default=None, help="Directorio del índice (por defecto indices/CURRENT)")
+    parser.add_argument("--profiles", nargs="+", choices=list(HNSW_PROFILES), default=list(HNSW_PROFILES))
+    parser.add_argument("--k", nargs="+", type=int, default=[4, 10])
+    parser.add_argument("--scale", type=int, default=1, help="Multiplica el corpus con réplicas ruidosas")
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--extra-queries", type=int, default=200)
+    parser.add_argument("--min-recall", type=float, default=0.95)
+    parser.add_argument("--golden", default=GOLDEN_SET_PATH)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    import chromadb
+
+    from index_manager import current_index_dir
+    from sop_engine import VECTORSTORE_DIR
+
+    index_dir = args.index or current_index_dir(fallback=VECTORSTORE_DIR)
+    base, embeddings = load_corpus(index_dir)
+    corpus = grow_corpus(base, args.scale, args.noise)
+    queries = build_queries(embeddings, args.golden, base, min(args.extra_queries, len(base)))
+    print(f"📐 {len(corpus)} vectores ({len(base)} x {args.scale}) de {index_dir}; {len(queries)} consultas")
+
+    start = time.perf_counter()
+    truth = exact_top_k(corpus, queries, max(args.k))
+    exact_ms = (time.perf_counter() - start) / len(queries) * 1000
+
+    client = chromadb.Client()
+    rows = [sweep_profile(client, name, corpus, queries, truth, args.k) for name in args.profiles]
+
+    recall_cols = "".join(f" {f'recall@{k}':>10}" for k in args.k)
+    print(f"\n{'perfil':<15} {'M':>3} {'ef_c':>5} {'ef_s':>5} {'build s':>8} {'p50 ms':>7} {'p95 ms':>7}{recall_cols}")
+    for r in rows:
+        recalls = "".join(f" {r[f'recall@{k}']:>10.3f}" for k in args.k)
+        print(f"{r['profile']:<15} {r['hnsw:M']:>3} {r['hnsw:construction_ef']:>5} {r['hnsw:search_ef']:>5} "
+              f"{r['build_s']:>8.2f} {r['p50_ms']:>7.2f} {r['p95_ms']:>7.2f}{recalls}")
+    print(f"{'exacta (NumPy)':<15} {'':>3} {'':>5} {'':>5} {'':>8} {exact_ms:>7.2f}")
+
+    k_ref = min(args.k)
+    best = recommend(rows, k_ref, args.min_recall)
+    print(f"\n💡 Recomendado: {best['profile']} (recall@{k_ref} {best[f'recall@{k_ref}']:.3f}, "
+          f"p50 {best['p50_ms']:.2f} ms). Usar con create_embeddings.py "
+          f"--profile {best['profile']} (o --retune {best['profile']} para cambiar solo search_ef)")
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"hnsw_sweep_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "index": index_dir,
+            "corpus_size": int(len(corpus)),
+            "scale": args.scale,
+            "queries": int(len(queries)),
+            "exact_ms_per_query": exact_ms,
+            "results": rows,
+            "recommended": best["profile"],
+        }, f, ensure_ascii=False, indent=2)
+    print(f"✅ Resultados en {output}")
+
+
+if __name__ == "__main__":
+    main()
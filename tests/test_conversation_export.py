@@ -0,0 +1,56 @@
+"""Exportación de la conversación por formato"""
+
+import json
+import re
+
+from conversation_export import PDF_LINES_PER_PAGE, build_export, export_data
+from session_store import ChatHistory, new_session_id
+
+
+def make_history(tmp_path, n=8):
+    history = ChatHistory(new_session_id(), window=3, db_path=str(tmp_path / "s.db"))
+    for i in range(n):
+        history.append("user" if i % 2 == 0 else "assistant", f"mensaje {i}")
+    return history
+
+
+def test_export_data_reads_the_history_only_when_called(tmp_path):
+    history = make_history(tmp_path)
+    reads = []
+
+    def messages():
+        reads.append(1)
+        return history.iter_all()
+
+    build = export_data("TXT", messages)
+    assert reads == []
+    text = build().getvalue().decode("utf-8")
+    assert reads == [1]
+    assert text.index("Usuario: mensaje 0") < text.index("Sofía: mensaje 7")
+
+
+def test_json_export_is_valid_and_complete(tmp_path):
+    history = make_history(tmp_path, n=5)
+    buffer, ext, mime = build_export("JSON", history.iter_all())
+    document = json.loads(buffer.getvalue())
+    assert (ext, mime) == ("json", "application/json")
+    assert [m["content"] for m in document["messages"]] == [f"mensaje {i}" for i in range(5)]
+    assert document["image_analyses"] == []
+
+
+def test_pdf_xref_points_at_every_object(tmp_path):
+    # Más líneas de las que caben en una página
+    history = make_history(tmp_path, n=PDF_LINES_PER_PAGE)
+    history.append("assistant", "Acné y (vello) 💜 \\ fin")
+    pdf = build_export("PDF", history.iter_all())[0].getvalue()
+
+    assert pdf.startswith(b"%PDF-1.4") and pdf.endswith(b"%%EOF\n")
+    startxref = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+    xref = pdf[startxref:].split(b"trailer")[0].splitlines()
+    count = int(xref[1].split()[1])
+    offsets = [int(line[:10]) for line in xref[3:3 + count - 1]]
+    for obj_id, offset in enumerate(offsets, start=1):
+        assert pdf[offset:].startswith(f"{obj_id} 0 obj".encode())
+    assert int(re.search(rb"/Count (\d+)", pdf).group(1)) >= 2
+    # Paréntesis escapados; el emoji no cabe en WinAnsi y se omite
+    assert b"Acn\xe9 y \\(vello\\)  \\\\ fin" in pdf
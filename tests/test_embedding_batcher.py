@@ -0,0 +1,54 @@
+"""Micro-batching de embeddings de consulta"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from embedding_batcher import BatchingEmbeddings  # noqa: E402
+
+
+class FakeEmbeddings:
+    """Vector = [longitud del texto]; guarda el tamaño de cada lote"""
+
+    model_name = "falso"
+
+    def __init__(self, fail_on=None):
+        self.batches = []
+        self.fail_on = fail_on
+        self.ready = threading.Event()
+
+    def embed_documents(self, texts):
+        self.ready.wait(5)
+        self.batches.append(len(texts))
+        if self.fail_on in texts:
+            raise RuntimeError("modelo caído")
+        return [[float(len(t))] for t in texts]
+
+
+def test_concurrent_queries_share_a_batch_and_keep_their_vectors():
+    base = FakeEmbeddings()
+    embeddings = BatchingEmbeddings(base, window_ms=200, max_batch=8)
+    texts = ["a" * n for n in range(1, 9)]
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(embeddings.embed_query, t) for t in texts]
+        base.ready.set()
+        vectors = [f.result(5) for f in futures]
+
+    assert vectors == [[float(len(t))] for t in texts]
+    assert sum(base.batches) == 8 and len(base.batches) < 8
+    assert embeddings.stats()["max_batch"] == max(base.batches)
+    # Atributos del modelo envuelto
+    assert embeddings.model_name == "falso"
+
+
+def test_errors_reach_every_query_in_the_batch():
+    base = FakeEmbeddings(fail_on="malo")
+    base.ready.set()
+    embeddings = BatchingEmbeddings(base, window_ms=0, max_batch=1)
+    with pytest.raises(RuntimeError):
+        embeddings.embed_query("malo")
+    # El hilo de lotes sigue vivo después del error
+    assert embeddings.embed_query("bien") == [4.0]
@@ -0,0 +1,122 @@
+"""Pool de claves de Gemini sobre el modelo falso de gemini_stub"""
+
+import asyncio
+
+import pytest
+
+from gemini_pool import BACKOFF_BASE_SECONDS, GeminiPool, PoolExhaustedError, PooledModel
+from gemini_stub import FakeGenerativeModel, FakeQuotaError
+
+
+class FakeClock:
+    """Reloj manual: las pruebas no esperan de verdad"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fake_model(**kwargs):
+    return FakeGenerativeModel(latency=0, jitter=0, seed=0, **kwargs)
+
+
+def test_picks_key_with_most_remaining_quota():
+    pool = GeminiPool(["a", "b"], rpm=5, clock=FakeClock())
+    first = pool.acquire()
+    pool.release(first)
+    # La otra clave tiene más cuota libre
+    assert pool.acquire() != first
+
+
+def test_prefers_key_with_fewer_recent_errors():
+    pool = GeminiPool(["a", "b"], rpm=100, clock=FakeClock())
+    pool.acquire(exclude={"b"})
+    pool.release("a", RuntimeError("500 interno"))
+    for _ in range(3):
+        assert pool.acquire() == "b"
+        pool.release("b")
+
+
+def test_rate_limit_cools_key_down_with_exponential_backoff():
+    clock = FakeClock()
+    pool = GeminiPool(["a", "b"], rpm=100, clock=clock)
+    for strikes in (1, 2, 3):
+        pool.acquire(exclude={"b"})
+        pool.release("a", FakeQuotaError())
+        cooldown = next(s["cooldown_s"] for s in pool.stats() if s["key"] == "a")
+        assert cooldown == pytest.approx(BACKOFF_BASE_SECONDS * 2 ** (strikes - 1))
+        assert pool.acquire() == "b"
+        pool.release("b")
+        clock.now += cooldown
+    # Un acierto reinicia el backoff
+    pool.acquire(exclude={"b"})
+    pool.release("a")
+    pool.acquire(exclude={"b"})
+    pool.release("a", FakeQuotaError())
+    assert next(s["cooldown_s"] for s in pool.stats() if s["key"] == "a") == BACKOFF_BASE_SECONDS
+
+
+def test_rate_limited_call_is_retried_on_another_key():
+    pool = GeminiPool(["a", "b"], rpm=100, clock=FakeClock())
+    exhausted = fake_model(rpm_limit=0)
+    healthy = fake_model()
+    model = PooledModel(pool, {"a": exhausted, "b": healthy})
+    # Primero la clave "a" (empate: la primera), que responde 429
+    response = model.generate_content("¿Qué es el SOP?")
+    assert response.text
+    assert exhausted.calls == 1 and healthy.calls == 1
+    stats = {s["key"]: s for s in pool.stats()}
+    assert stats["a"]["cooldown_s"] > 0
+    assert stats["a"]["in_flight"] == stats["b"]["in_flight"] == 0
+
+
+def test_rate_limit_on_every_key_is_raised():
+    pool = GeminiPool(["a", "b"], rpm=100, clock=FakeClock())
+    model = PooledModel(pool, {"a": fake_model(rpm_limit=0), "b": fake_model(rpm_limit=0)})
+    with pytest.raises(FakeQuotaError):
+        model.generate_content("hola")
+
+
+def test_other_errors_are_not_retried():
+    pool = GeminiPool(["a", "b"], rpm=100, clock=FakeClock())
+    failing = fake_model(safety_rate=1.0)
+    other = fake_model()
+    model = PooledModel(pool, {"a": failing, "b": other})
+    with pytest.raises(Exception, match="safety"):
+        model.generate_content("hola")
+    assert other.calls == 0
+
+
+def test_waits_for_quota_then_raises_pool_exhausted(monkeypatch):
+    clock = FakeClock()
+    sleeps = []
+
+    def fake_sleep(seconds):
+        sleeps.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr("gemini_pool.time.sleep", fake_sleep)
+    pool = GeminiPool(["a"], rpm=1, window_seconds=10, max_wait=30, clock=clock)
+    pool.acquire()
+    pool.release("a")
+    # Sin cuota: espera a que la llamada salga de la ventana y vuelve a tener clave
+    assert pool.acquire() == "a"
+    assert sleeps and sum(sleeps) == pytest.approx(10.5)
+    pool.release("a")
+
+    # Espera mayor que max_wait: se rinde sin dormir
+    pool = GeminiPool(["a"], rpm=1, window_seconds=60, max_wait=5, clock=clock)
+    pool.acquire()
+    sleeps.clear()
+    with pytest.raises(PoolExhaustedError, match="429"):
+        pool.acquire()
+    assert sleeps == []
+
+
+def test_async_path_retries_on_another_key():
+    pool = GeminiPool(["a", "b"], rpm=100, clock=FakeClock())
+    model = PooledModel(pool, {"a": fake_model(rpm_limit=0), "b": fake_model()})
+    response = asyncio.run(model.generate_content_async("¿Se cura?"))
+    assert response.text
@@ -0,0 +1,106 @@
+"""Índice versionado: cambio en caliente y limpieza de versiones"""
+
+import os
+import threading
+import time
+
+import index_manager
+from index_manager import (
+    IndexManager,
+    current_index_dir,
+    list_versions,
+    new_version_dir,
+    prune_versions,
+    publish_version,
+)
+
+
+class FakeVectorstore:
+    def __init__(self, path):
+        self.path = path
+
+    def similarity_search(self, query, k=4):
+        return []
+
+
+def make_manager(root, **kwargs):
+    publish_version(new_version_dir(str(root)), str(root))
+    return IndexManager(FakeVectorstore, root=str(root), poll_seconds=0, **kwargs)
+
+
+def test_lease_does_not_wait_for_old_versions_to_be_deleted(tmp_path, monkeypatch):
+    release = threading.Event()
+    pruned = threading.Event()
+
+    def slow_prune(*args, **kwargs):
+        release.wait(5)
+        pruned.set()
+        return []
+
+    monkeypatch.setattr(index_manager, "prune_versions", slow_prune)
+    manager = make_manager(tmp_path, grace_seconds=0)
+    start = time.perf_counter()
+    with manager.lease() as vectorstore:
+        assert vectorstore.path == manager.path
+    assert time.perf_counter() - start < 1
+    release.set()
+    assert pruned.wait(5)
+
+
+def make_versions(root, names):
+    for name in names:
+        os.makedirs(os.path.join(str(root), name))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_prune_keeps_recent_current_and_protected_versions(tmp_path):
+    make_versions(tmp_path, ["v1", "v2", "v3", "v4", "v5"])
+    publish_version(os.path.join(str(tmp_path), "v1"), str(tmp_path))
+
+    removed = prune_versions(str(tmp_path), keep=2, protect=[os.path.join(str(tmp_path), "v3")])
+    assert removed == ["v2"]
+    assert list_versions(str(tmp_path)) == ["v1", "v3", "v4", "v5"]
+    assert current_index_dir(str(tmp_path)) == os.path.join(str(tmp_path), "v1")
+
+
+def test_swap_keeps_leased_version_until_released(tmp_path):
+    make_versions(tmp_path, ["v1", "v2"])
+    publish_version(os.path.join(str(tmp_path), "v1"), str(tmp_path))
+    manager = IndexManager(FakeVectorstore, root=str(tmp_path), poll_seconds=0, grace_seconds=0, keep_versions=0)
+    old_path = manager.path
+
+    with manager.lease() as old:
+        publish_version(os.path.join(str(tmp_path), "v2"), str(tmp_path))
+        assert manager.refresh()
+        assert wait_for(lambda: manager.path.endswith("v2"))
+        # La petición en curso termina con su versión; la vieja sigue en disco
+        assert old.path == old_path
+        manager.collect_garbage()
+        assert "v1" in list_versions(str(tmp_path))
+
+    with manager.lease() as new:
+        assert new.path == manager.path
+    manager.collect_garbage()
+    assert list_versions(str(tmp_path)) == ["v2"]
+
+
+def test_failed_load_keeps_the_active_version(tmp_path):
+    make_versions(tmp_path, ["v1", "v2"])
+    publish_version(os.path.join(str(tmp_path), "v1"), str(tmp_path))
+
+    def loader(path):
+        if path.endswith("v2"):
+            raise OSError("índice corrupto")
+        return FakeVectorstore(path)
+
+    manager = IndexManager(loader, root=str(tmp_path), poll_seconds=0)
+    publish_version(os.path.join(str(tmp_path), "v2"), str(tmp_path))
+    assert manager.refresh()
+    assert wait_for(lambda: manager._loading is None)
+    assert manager.path.endswith("v1")
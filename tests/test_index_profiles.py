@@ -0,0 +1,44 @@
+"""search_ef por versión: --retune cambia una copia, nunca la colección publicada"""
+
+import json
+
+import pytest
+
+from index_profiles import (
+    PROFILE_FILE,
+    collection_metadata,
+    current_search_ef,
+    get_profile,
+    retune_copy,
+    write_profile,
+)
+
+chromadb = pytest.importorskip("chromadb")
+
+COLLECTION = "sop_medical_guide"
+
+
+def build_version(path, profile="balanced"):
+    client = chromadb.PersistentClient(path=str(path))
+    collection = client.create_collection(COLLECTION, metadata=collection_metadata(profile))
+    collection.add(ids=["a", "b", "c"], embeddings=[[1.0, 0.0], [0.0, 1.0], [0.7, 0.7]])
+    write_profile(str(path), profile)
+    return collection
+
+
+def test_retune_changes_only_the_copy(tmp_path):
+    source, target = tmp_path / "v1", tmp_path / "v2"
+    original = build_version(source)
+    before = current_search_ef(original)
+
+    assert retune_copy(str(source), str(target), "fast")
+
+    copy = chromadb.PersistentClient(path=str(target)).get_collection(COLLECTION)
+    assert current_search_ef(copy) == get_profile("fast")["hnsw:search_ef"]
+    assert copy.count() == 3
+    reopened = chromadb.PersistentClient(path=str(source)).get_collection(COLLECTION)
+    assert current_search_ef(reopened) == before == get_profile("balanced")["hnsw:search_ef"]
+
+    with open(target / PROFILE_FILE, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["profile"] == "balanced" and saved["search_profile"] == "fast"
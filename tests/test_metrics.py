@@ -0,0 +1,25 @@
+"""Exportación de métricas (snapshots y formato de texto de Prometheus)"""
+
+from metrics import Metrics, merge_snapshots, snapshot_summary, snapshot_to_prometheus
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.incr("errores_total", kind='dice "hola"\\\nadiós')
+    assert 'sop_errores_total{kind="dice \\"hola\\"\\\\\\nadiós"} 1' in metrics.to_prometheus()
+
+
+def test_merged_snapshots_keep_each_metric_in_one_block():
+    api, ui = Metrics(), Metrics()
+    api.observe("stage_seconds", 0.5, stage="chat_total")
+    api.incr("query_route_total", intent="rag")
+    ui.observe("stage_seconds", 0.01, stage="render")
+    snapshot = merge_snapshots(api.snapshot(), ui.snapshot())
+
+    assert snapshot_summary(snapshot, "stage_seconds", stage="chat_total")["rate_1m"] == 1
+    assert snapshot_summary(snapshot, "stage_seconds", stage="render")["count"] == 1
+    names = [line.split("{")[0].split(" ")[0] for line in snapshot_to_prometheus(snapshot).splitlines()
+             if not line.startswith("#")]
+    # Todas las líneas de sop_stage_seconds* seguidas, sin otra métrica en medio
+    stage_lines = [i for i, name in enumerate(names) if name.startswith("sop_stage_seconds")]
+    assert stage_lines == list(range(stage_lines[0], stage_lines[-1] + 1))
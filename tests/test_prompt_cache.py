@@ -0,0 +1,47 @@
+"""Caché de prefijos (PrefixCachedModel) sobre el modelo falso de gemini_stub"""
+
+import time
+
+from gemini_stub import FakeCachedContent, FakeGenerativeModel
+from prompt_cache import PROMPT_CACHE_MIN_TOKENS, PrefixCachedModel
+
+LONG_PREFIX = "Instrucciones fijas del chatbot. " * 200
+SHORT_PREFIX = "Instrucciones cortas."
+
+
+def fake_model():
+    return FakeGenerativeModel(latency=0, jitter=0, seed=0)
+
+
+def wait_cached(model, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not model.is_cached and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return model.is_cached
+
+
+def test_long_prefix_is_registered_and_served_from_cache():
+    calls = []
+
+    def cache_factory(prefix, ttl):
+        calls.append(prefix)
+        return FakeCachedContent(prefix, ttl)
+
+    model = PrefixCachedModel(LONG_PREFIX, fake_model().with_prefix, cache_factory, name="prueba")
+    assert model.cacheable
+    # La primera llamada usa el respaldo mientras el registro corre en segundo plano
+    model.generate_content("hola")
+    assert wait_cached(model)
+    response = model.generate_content("hola")
+    assert response.usage_metadata.cached_content_token_count >= PROMPT_CACHE_MIN_TOKENS
+    assert calls == [LONG_PREFIX]
+
+
+def test_short_prefix_never_tries_to_register():
+    def cache_factory(prefix, ttl):
+        raise AssertionError("no debería registrarse un prefijo bajo el mínimo")
+
+    model = PrefixCachedModel(SHORT_PREFIX, fake_model().with_prefix, cache_factory, name="prueba")
+    assert not model.cacheable
+    response = model.generate_content("hola")
+    assert response.usage_metadata.cached_content_token_count == 0
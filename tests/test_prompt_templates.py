@@ -0,0 +1,48 @@
+"""Plantillas de prompt: prefijo fijo, campos variables y versión"""
+
+import pytest
+
+from prompt_templates import PromptTemplate, Slot, Static, estimate_tokens
+
+TEMPLATE = PromptTemplate([
+    Static("system", "Eres Sofía.\n"),
+    Static("rules", "Responde en español.\n"),
+    Slot("history", "HISTORIAL:\n{}\n"),
+    Slot("question", "PREGUNTA: {}"),
+])
+
+
+def test_render_joins_static_prefix_and_filled_slots():
+    assert TEMPLATE.static_prefix == "Eres Sofía.\nResponde en español.\n"
+    assert TEMPLATE.render(question="¿Qué es el SOP?") == (
+        "Eres Sofía.\nResponde en español.\nPREGUNTA: ¿Qué es el SOP?"
+    )
+    # Con el prefijo en caché solo se envían los campos
+    assert TEMPLATE.render(include_static=False, history="Usuario: hola", question="¿y eso?") == (
+        "HISTORIAL:\nUsuario: hola\nPREGUNTA: ¿y eso?"
+    )
+
+
+def test_segment_tokens_cover_every_part():
+    parts = TEMPLATE.parts(history="", question="x" * 40)
+    counts = TEMPLATE.segment_tokens(parts)
+    assert counts == {
+        "system": estimate_tokens("Eres Sofía.\n"),
+        "rules": estimate_tokens("Responde en español.\n"),
+        "history": 0,
+        "question": estimate_tokens("PREGUNTA: " + "x" * 40),
+    }
+
+
+def test_version_changes_with_the_text():
+    same = PromptTemplate(list(TEMPLATE.segments))
+    changed = PromptTemplate([Static("system", "Eres otra.\n"), *TEMPLATE.segments[1:]])
+    assert same.version == TEMPLATE.version
+    assert changed.version != TEMPLATE.version
+
+
+def test_invalid_templates_are_rejected():
+    with pytest.raises(ValueError):
+        Slot("question", "PREGUNTA:")
+    with pytest.raises(ValueError):
+        PromptTemplate([Slot("question"), Static("system", "tarde")])
@@ -0,0 +1,91 @@
+"""Enrutamiento de consultas: preguntas médicas reales no deben quedar fuera de tema"""
+
+import pytest
+
+from query_router import route_query
+
+HISTORY = [
+    {"role": "user", "content": "¿Qué es el SOP?"},
+    {"role": "assistant", "content": "El SOP es un trastorno hormonal frecuente..."},
+]
+
+
+@pytest.mark.parametrize("query", [
+    "¿Qué son los criterios de Rotterdam?",
+    "¿Cuántos folículos se necesitan para el diagnóstico?",
+    "¿Aumenta el riesgo cardiovascular?",
+    "Tengo una serie de síntomas raros",
+    "¿Puedo hacer un programa de ejercicio?",
+    "¿Qué dice la guía de la ESHRE sobre el letrozol?",
+])
+def test_guideline_questions_go_to_rag(query):
+    route = route_query(query)
+    assert route.intent == "rag"
+    assert route.needs_search
+
+
+@pytest.mark.parametrize("query", [
+    "Cuéntame un chiste",
+    "¿Quién ganó el partido de fútbol?",
+    "¿Cuál es la capital de Francia?",
+])
+def test_clear_off_topic(query):
+    route = route_query(query)
+    assert route.intent == "off_topic"
+    assert route.reply is not None
+
+
+@pytest.mark.parametrize("query", ["¿Es hereditario?", "¿Se cura?", "sí", "no", "¿Cuánto tiempo dura?", "¿y eso?"])
+def test_short_messages_after_answer_are_follow_ups(query):
+    route = route_query(query, HISTORY)
+    assert route.intent == "follow_up"
+    # La búsqueda incluye la pregunta anterior para no perder el tema
+    assert route.search_query.startswith("¿Qué es el SOP?")
+    assert route.question == query
+
+
+@pytest.mark.parametrize("query", [
+    "Riesgo de diabetes",
+    "Dieta para SOP",
+    "¿Qué es metformina?",
+    "Ejercicio recomendado",
+    "¿Puedo embarazarme?",
+])
+def test_short_new_topics_after_answer_are_rag(query):
+    route = route_query(query, HISTORY)
+    assert route.intent == "rag"
+    # Sin la pregunta anterior delante: no contamina la búsqueda
+    assert route.search_query.startswith(query)
+
+
+@pytest.mark.parametrize("query", [
+    "¿La puedo tomar en el embarazo?",
+    "¿Cómo prevenirlo con dieta?",
+    "y con metformina",
+    "¿Qué más?",
+])
+def test_continuation_cues_make_follow_ups_even_with_a_topic(query):
+    route = route_query(query, HISTORY)
+    assert route.intent == "follow_up"
+    assert route.search_query.startswith("¿Qué es el SOP?")
+
+
+def test_follow_up_without_new_terms_reuses_context():
+    assert route_query("sí", HISTORY).reuse_context
+    assert not route_query("¿Se cura?", HISTORY).reuse_context
+
+
+def test_standalone_question_after_answer_is_rag():
+    route = route_query("¿Qué es la metformina?", HISTORY)
+    assert route.intent == "rag"
+    assert route.search_query == "¿Qué es la metformina?"
+
+
+def test_short_message_without_history_is_rag():
+    assert route_query("¿Se cura?").intent == "rag"
+
+
+def test_small_talk_and_reformulation():
+    assert route_query("hola").intent == "greeting"
+    assert route_query("ok gracias, adiós").intent == "farewell"
+    assert route_query("resúmelo", HISTORY).intent == "history"
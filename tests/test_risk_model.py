@@ -0,0 +1,51 @@
+"""Motor NumPy del modelo de riesgo frente a sklearn (la diferencia de verify() debe ser ~0)"""
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+
+from export_risk_model import export, verify
+from risk_model import RISK_FEATURES, RiskScorer, latest_version
+
+
+def synthetic_data(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n, len(RISK_FEATURES))), columns=RISK_FEATURES)
+    X["Cycle"] = rng.choice([2, 4], size=n)
+    X["HairGrowth"] = rng.integers(0, 2, size=n)
+    logits = X["FollicleNoR"] + 0.8 * (X["Cycle"] == 4) + X["HairGrowth"] - 0.5
+    y = (logits + rng.normal(scale=0.5, size=n) > 0).astype(int)
+    return X, y
+
+
+def export_models(directory, version=1):
+    X, y = synthetic_data()
+    lr = LogisticRegression(max_iter=20000).fit(X, y)
+    forest = RandomForestClassifier(n_estimators=15, random_state=0).fit(X, y)
+    fill_values = X.mean()
+    export(lr, forest, fill_values, {}, version, "sha-prueba", directory=str(directory))
+    return lr, forest, X, fill_values
+
+
+def test_numpy_scorer_matches_sklearn(tmp_path):
+    lr, forest, X, _ = export_models(tmp_path)
+    assert latest_version(str(tmp_path)) == 1
+    scorer = RiskScorer.load(directory=str(tmp_path))
+    # Filas de entrenamiento y filas nuevas (otros umbrales del bosque)
+    X_new, _ = synthetic_data(n=2000, seed=1)
+    for data in (X, X_new):
+        diff = verify(scorer, lr, forest, data)
+        assert diff["logistic"] < 1e-9
+        assert diff["forest"] < 1e-9
+
+
+def test_missing_form_values_use_the_training_fill(tmp_path):
+    _, _, X, fill_values = export_models(tmp_path)
+    scorer = RiskScorer.load(1, str(tmp_path))
+    row = X.iloc[0].to_dict()
+    partial = {k: v for k, v in row.items() if k != "AMH"}
+    filled = {**partial, "AMH": fill_values["AMH"]}
+
+    assert scorer.score(partial) == scorer.score(filled)
+    assert scorer.score(row)["version"] == 1
@@ -0,0 +1,97 @@
+"""Historial acotado con escritura diferida a SQLite"""
+
+import time
+
+from session_store import (
+    WRITE_INTERVAL_SECONDS,
+    ChatHistory,
+    ContextCache,
+    flush_writes,
+    new_session_id,
+    session_exists,
+)
+
+
+def fill(history, n):
+    for i in range(n):
+        history.append("user" if i % 2 == 0 else "assistant", f"mensaje {i}")
+
+
+def contents(records):
+    return [r.content for r in records]
+
+
+def test_spilled_history_is_read_without_waiting_for_the_writer(tmp_path):
+    history = ChatHistory(new_session_id(), window=3, db_path=str(tmp_path / "s.db"))
+    fill(history, 10)
+    start = time.perf_counter()
+    # Parte de estos registros sigue en la cola de escritura
+    recent = history.recent(7)
+    assert time.perf_counter() - start < WRITE_INTERVAL_SECONDS / 2
+    assert contents(recent) == [f"mensaje {i}" for i in range(3, 10)]
+    assert contents(history.page(0, 4)) == [f"mensaje {i}" for i in range(4)]
+
+
+def test_session_flush_does_not_wait_for_the_batch_interval(tmp_path):
+    history = ChatHistory(new_session_id(), window=3, db_path=str(tmp_path / "s.db"))
+    fill(history, 5)
+    start = time.perf_counter()
+    flush_writes(history.session_id)
+    assert time.perf_counter() - start < WRITE_INTERVAL_SECONDS / 2
+    assert not history._unsaved
+
+
+def test_resume_restores_order_window_and_user_turns(tmp_path):
+    db_path = str(tmp_path / "s.db")
+    history = ChatHistory(new_session_id(), window=3, db_path=db_path)
+    fill(history, 11)
+
+    resumed = ChatHistory.resume(history.session_id, window=4, db_path=db_path)
+    assert len(resumed) == 11
+    assert resumed.user_turns == 6
+    assert contents(resumed) == [f"mensaje {i}" for i in range(7, 11)]
+    assert contents(resumed.iter_all(page_size=3)) == [f"mensaje {i}" for i in range(11)]
+    assert session_exists(history.session_id, db_path)
+
+
+def test_two_tabs_of_one_session_append_without_overwriting(tmp_path):
+    db_path = str(tmp_path / "s.db")
+    session_id = new_session_id()
+    first = ChatHistory(session_id, window=2, db_path=db_path)
+    second = ChatHistory(session_id, window=2, db_path=db_path)
+    for i in range(3):
+        first.append("user", f"pestaña 1 #{i}")
+        second.append("user", f"pestaña 2 #{i}")
+
+    resumed = ChatHistory.resume(session_id, db_path=db_path)
+    assert contents(resumed.iter_all()) == [
+        "pestaña 1 #0", "pestaña 2 #0", "pestaña 1 #1", "pestaña 2 #1", "pestaña 1 #2", "pestaña 2 #2",
+    ]
+
+
+def test_cleared_history_resumes_empty(tmp_path):
+    db_path = str(tmp_path / "s.db")
+    history = ChatHistory(new_session_id(), window=2, db_path=db_path)
+    fill(history, 5)
+    history.clear()
+    history.append("user", "de nuevo")
+
+    resumed = ChatHistory.resume(history.session_id, db_path=db_path)
+    assert contents(resumed.iter_all()) == ["de nuevo"]
+    assert resumed.user_turns == 1
+
+
+def test_context_cache_resumes_latest_entries_for_the_same_index(tmp_path):
+    db_path = str(tmp_path / "s.db")
+    cache = ContextCache(new_session_id(), db_path=db_path, max_entries=2)
+    for key in ("sop", "metformina", "dieta"):
+        cache.put(key, "v1", [(f"texto {key}", {"page": 1})])
+        time.sleep(0.01)
+
+    resumed = ContextCache.resume(cache.session_id, db_path=db_path, max_entries=2)
+    assert len(resumed) == 2
+    assert resumed.get("sop", "v1") is None
+    assert resumed.get("metformina", "v1") == [("texto metformina", {"page": 1})]
+    # Otra versión del índice no reutiliza el contexto guardado
+    assert resumed.get("dieta", "v2") is None
+    assert resumed.latest("v1") == [("texto metformina", {"page": 1})]
@@ -0,0 +1,313 @@
+"""
+Pipeline de entrenamiento del modelo de riesgo de SOP (reemplaza correr los notebooks)
+Validación cruzada + búsqueda de hiperparámetros + selección RFE en paralelo, con caché por fold
+
+Uso:
+    python train_pipeline.py                          # todos los núcleos, exporta pcos_risk_vN
+    python train_pipeline.py --features rfe           # exporta con las variables del mejor RFE
+    python train_pipeline.py --scaling 1 2 4 --no-export
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import sklearn
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.feature_selection import RFE
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.preprocessing import StandardScaler
+
+from export_risk_model import LOGISTIC_THRESHOLD, export, unknown_features, verify
+from pcos_data import DATASET_PATH, FEATURES, load_pcos
+from risk_model import RISK_FEATURES, RiskScorer, latest_version
+
+FOLD_CACHE_DIR = "./cache/train_folds"
+REPORTS_DIR = "./models/reports"
+
+N_SPLITS = 5
+SEED = 42
+
+# Variables por conservar que prueba la selección RFE (step=2 como en el notebook)
+RFE_SIZES = [8, 12, 16, 20]
+
+# Rejilla de hiperparámetros (la primera de cada modelo es la del notebook)
+PARAM_GRID = {
+    "logistic": [{"C": c} for c in (1.0, 0.1, 0.3, 3.0, 10.0)],
+    "forest": [
+        {"n_estimators": n, "max_depth": d, "min_samples_leaf": leaf}
+        for n, d, leaf in itertools.product((50, 200), (None, 8), (1, 3))
+    ],
+}
+
+
+# ==========================================
+# TAREAS (se ejecutan en los procesos del pool)
+# ==========================================
+
+_X = None
+_y = None
+_columns = None
+
+
+def _init_worker(X, y, columns):
+    """Cada proceso recibe los datos una vez, no en cada tarea"""
+    global _X, _y, _columns
+    _X, _y, _columns = X, y, columns
+
+
+def build_model(kind, params):
+    if kind == "logistic":
+        return LogisticRegression(max_iter=20000, **params)
+    return RandomForestClassifier(n_jobs=1, random_state=SEED, **params)
+
+
+def run_task(task):
+    """('rfe', fold, k) -> variables elegidas; ('fit', fold, modelo, params, variables) -> métricas"""
+    train_idx, val_idx = task["train"], task["val"]
+    if task["kind"] == "rfe":
+        X_train = StandardScaler().fit_transform(_X[train_idx])
+        rfe = RFE(LogisticRegression(max_iter=20000), n_features_to_select=task["k"], step=2)
+        rfe.fit(X_train, _y[train_idx])
+        return {"features": [c for c, keep in zip(_columns, rfe.support_) if keep]}
+
+    cols = [_columns.index(f) for f in task["features"]]
+    model = build_model(task["model"], task["params"])
+    model.fit(_X[np.ix_(train_idx, cols)], _y[train_idx])
+    proba = model.predict_proba(_X[np.ix_(val_idx, cols)])[:, 1]
+    return {
+        "auc": roc_auc_score(_y[val_idx], proba),
+        "accuracy": accuracy_score(_y[val_idx], proba >= 0.5),
+        "recall_at_threshold": float(((proba >= LOGISTIC_THRESHOLD) & (_y[val_idx] == 1)).sum() / max(_y[val_idx].sum(), 1)),
+    }
+
+
+# ==========================================
+# CACHÉ POR FOLD
+# ==========================================
+
+class FoldCache:
+    """Un JSON por tarea; la clave incluye datos, fold, modelo, parámetros y versión de sklearn"""
+
+    def __init__(self, directory=FOLD_CACHE_DIR, enabled=True):
+        self.directory = directory
+        self.enabled = enabled
+        self.hits = 0
+        if enabled:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(data_hash, task):
+        spec = {k: v for k, v in task.items() if k not in ("train", "val")}
+        spec.update(data=data_hash, splits=N_SPLITS, seed=SEED, sklearn=sklearn.__version__)
+        return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:24]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                result = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key, result):
+        if not self.enabled:
+            return
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        os.replace(tmp_path, self._path(key))
+
+
+def run_tasks(tasks, data, cache, data_hash, workers):
+    """Ejecuta en el pool solo las tareas que no están en caché"""
+    keys = [FoldCache.key(data_hash, t) for t in tasks]
+    results = [cache.get(k) for k in keys]
+    pending = [i for i, r in enumerate(results) if r is None]
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=data) as pool:
+            for i, result in zip(pending, pool.map(run_task, [tasks[i] for i in pending], chunksize=1)):
+                results[i] = result
+                cache.put(keys[i], result)
+    return results
+
+
+# ==========================================
+# PIPELINE
+# ==========================================
+
+def load_dataset(path=DATASET_PATH):
+    """Matriz completa desde la caché columnar (limpia y tipada)"""
+    data = load_pcos(path)
+    return data.matrix(FEATURES), data.target, list(FEATURES), data.fill_series(FEATURES), data
+
+
+def run_pipeline(X, y, columns, data_hash, workers, cache):
+    folds = [
+        (train.tolist(), val.tolist())
+        for train, val in StratifiedKFold(N_SPLITS, shuffle=True, random_state=SEED).split(X, y)
+    ]
+    data = (X, y, columns)
+
+    # 1. Selección de variables dentro de cada fold
+    rfe_tasks = [
+        {"kind": "rfe", "fold": f, "k": k, "train": train, "val": val}
+        for f, (train, val) in enumerate(folds) for k in RFE_SIZES
+    ]
+    rfe_results = run_tasks(rfe_tasks, data, cache, data_hash, workers)
+    selected = {(t["fold"], t["k"]): r["features"] for t, r in zip(rfe_tasks, rfe_results)}
+
+    # 2. Búsqueda de hiperparámetros por conjunto de variables
+    feature_sets = {"notebook": lambda fold: RISK_FEATURES}
+    for k in RFE_SIZES:
+        feature_sets[f"rfe{k}"] = lambda fold, k=k: selected[(fold, k)]
+
+    fit_tasks = [
+        {
+            "kind": "fit", "fold": f, "model": model, "params": params,
+            "feature_set": name, "features": features_for(f),
+            "train": train, "val": val,
+        }
+        for name, features_for in feature_sets.items()
+        for model, grid in PARAM_GRID.items()
+        for params in grid
+        for f, (train, val) in enumerate(folds)
+    ]
+    fit_results = run_tasks(fit_tasks, data, cache, data_hash, workers)
+
+    rows = {}
+    for task, result in zip(fit_tasks, fit_results):
+        key = (task["feature_set"], task["model"], json.dumps(task["params"], sort_keys=True))
+        rows.setdefault(key, []).append(result)
+    table = [
+        {
+            "feature_set": feature_set,
+            "model": model,
+            "params": json.loads(params),
+            "cv_auc": float(np.mean([r["auc"] for r in results])),
+            "cv_auc_std": float(np.std([r["auc"] for r in results])),
+            "cv_accuracy": float(np.mean([r["accuracy"] for r in results])),
+            "cv_recall_at_threshold": float(np.mean([r["recall_at_threshold"] for r in results])),
+        }
+        for (feature_set, model, params), results in rows.items()
+    ]
+    table.sort(key=lambda r: -r["cv_auc"])
+    return table, len(rfe_tasks) + len(fit_tasks)
+
+
+def best(table, model, feature_set):
+    return next(r for r in table if r["model"] == model and r["feature_set"] == feature_set)
+
+
+def rfe_full_data(X, y, columns, k):
+    """Variables finales: RFE sobre todos los datos con el k ganador"""
+    rfe = RFE(LogisticRegression(max_iter=20000), n_features_to_select=k, step=2)
+    rfe.fit(StandardScaler().fit_transform(X), y)
+    return [c for c, keep in zip(columns, rfe.support_) if keep]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Entrena y exporta el modelo de riesgo de SOP")
+    parser.add_argument("--data", default=DATASET_PATH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--features", choices=["notebook", "rfe"], default="notebook",
+                        help="notebook = 12 variables del formulario; rfe = mejor tamaño de RFE")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--no-export", action="store_true")
+    parser.add_argument("--scaling", nargs="+", type=int, default=None,
+                        help="Mide el tiempo sin caché con estos números de procesos")
+    args = parser.parse_args()
+
+    X, y, columns, fill_values, data = load_dataset(args.data)
+    # Incluye la versión del esquema: si cambia la limpieza, los folds se recalculan
+    data_hash = data.fingerprint
+
+    scaling = []
+    for workers in args.scaling or []:
+        start = time.perf_counter()
+        _, n_tasks = run_pipeline(X, y, columns, data_hash, workers, FoldCache(enabled=False))
+        scaling.append({"workers": workers, "wall_s": time.perf_counter() - start})
+        print(f"⏱️  {workers} procesos: {scaling[-1]['wall_s']:.1f} s ({n_tasks} tareas)")
+
+    cache = FoldCache(enabled=not args.no_cache)
+    start = time.perf_counter()
+    table, n_tasks = run_pipeline(X, y, columns, data_hash, args.workers, cache)
+    wall = time.perf_counter() - start
+    print(f"✅ {n_tasks} tareas en {wall:.1f} s con {args.workers} procesos ({cache.hits} desde caché)")
+
+    print(f"\n{'variables':<10} {'modelo':<9} {'AUC':>6} {'±':>6}  parámetros")
+    for r in table[:10]:
+        print(f"{r['feature_set']:<10} {r['model']:<9} {r['cv_auc']:>6.3f} {r['cv_auc_std']:>6.3f}  {r['params']}")
+
+    if args.features == "rfe":
+        best_rfe = max((r for r in table if r["feature_set"].startswith("rfe")), key=lambda r: r["cv_auc"])
+        feature_set = best_rfe["feature_set"]
+        features = rfe_full_data(X, y, columns, int(feature_set[3:]))
+    else:
+        feature_set, features = "notebook", RISK_FEATURES
+    lr_row, rf_row = best(table, "logistic", feature_set), best(table, "forest", feature_set)
+
+    report = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "data": {"path": args.data, "fingerprint": data_hash, "rows": int(X.shape[0])},
+        "cv": {"splits": N_SPLITS, "seed": SEED},
+        "workers": args.workers,
+        "wall_s": wall,
+        "tasks": n_tasks,
+        "cache_hits": cache.hits,
+        "scaling": scaling,
+        "chosen": {"feature_set": feature_set, "features": features, "logistic": lr_row, "forest": rf_row},
+        "results": table,
+    }
+
+    unknown = unknown_features(features)
+    if unknown and not args.no_export:
+        # El mejor RFE puede elegir variables que el panel no pregunta: se reporta pero no se publica
+        print(f"\n⛔ {feature_set} usa variables fuera del formulario ({', '.join(unknown)}): "
+              "no se exporta artefacto. Agrégalas a FEATURE_SPECS o usa --features notebook")
+        report["artifact"] = {"refused": unknown}
+    elif not args.no_export:
+        cols = [columns.index(f) for f in features]
+        lr = build_model("logistic", lr_row["params"]).fit(X[:, cols], y)
+        forest = build_model("forest", {**rf_row["params"], "oob_score": True}).fit(X[:, cols], y)
+        try:
+            version = latest_version() + 1
+        except FileNotFoundError:
+            version = 1
+        metrics = {
+            "logistic": {"cv_auc": lr_row["cv_auc"], "cv_accuracy": lr_row["cv_accuracy"]},
+            "forest": {"cv_auc": rf_row["cv_auc"], "oob_accuracy": forest.oob_score_},
+        }
+        npz_path, _ = export(
+            lr, forest, fill_values, metrics, version, data.manifest["source"]["sha256"],
+            extra={"training": {"pipeline": "train_pipeline.py", "params": {
+                "logistic": lr_row["params"], "forest": rf_row["params"]}}},
+            features=features, source_path=args.data,
+        )
+        diff = verify(RiskScorer.load(version), lr, forest, X[:, cols])
+        report["artifact"] = {"version": version, "path": npz_path, "max_diff_vs_sklearn": diff}
+        print(f"\n📦 Artefacto v{version}: {npz_path} (diferencia máx. vs sklearn {max(diff.values()):.1e})")
+
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    report_path = os.path.join(REPORTS_DIR, f"train_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📝 Reporte en {report_path}")
+
+
+if __name__ == "__main__":
+    main()